@@ -0,0 +1,112 @@
+"""
+Сравнение задержки обработчиков: соединение на каждый запрос vs пул.
+
+Имитирует поток обновлений: каждое "обновление" сохраняет вопрос и читает
+статистику, как handle_message + кнопка статистики. Старый вариант открывает
+новое SSL-соединение на каждый вызов и выполняет запрос прямо в event loop,
+новый использует Database с пулом соединений.
+
+Запуск (только на тестовой БД, скрипт пишет в таблицу questions):
+    DATABASE_URL=postgres://... python benchmarks/db_latency.py --updates 500 --rate 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+class PerCallConnectDatabase:
+    """Старое поведение: psycopg2.connect на каждый вызов, блокирующий запрос"""
+
+    def __init__(self, connection_string: str):
+        self.conn_string = connection_string
+
+    async def save_question(self, user_id, message_id, question_text):
+        conn = psycopg2.connect(self.conn_string, sslmode='require')
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO questions (user_id, message_id, question_text) VALUES (%s, %s, %s) RETURNING id",
+            (user_id, message_id, question_text)
+        )
+        question_id = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+        conn.close()
+        return question_id
+
+    async def get_stats(self):
+        conn = psycopg2.connect(self.conn_string, sslmode='require')
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM questions")
+        total = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM questions WHERE is_answered = TRUE")
+        answered = cur.fetchone()[0]
+        cur.close()
+        conn.close()
+        return {"total": total, "answered": answered, "pending": total - answered}
+
+
+async def fake_handler(db, i: int):
+    await db.save_question(user_id=-1, message_id=i, question_text=f"benchmark question {i}")
+    await db.get_stats()
+
+
+async def run(db, updates: int, rate: float):
+    latencies = []
+
+    async def one(i: int):
+        started = time.perf_counter()
+        await fake_handler(db, i)
+        latencies.append(time.perf_counter() - started)
+
+    tasks = []
+    for i in range(updates):
+        tasks.append(asyncio.create_task(one(i)))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def report(name: str, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{name:<22} p50={p50:8.1f} ms  p99={p99:8.1f} ms  n={len(latencies)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=300, help='количество обновлений')
+    parser.add_argument('--rate', type=float, default=30.0, help='обновлений в секунду')
+    parser.add_argument('--pool-min', type=int, default=2)
+    parser.add_argument('--pool-max', type=int, default=10)
+    args = parser.parse_args()
+
+    url = os.getenv('DATABASE_URL')
+    if not url:
+        sys.exit("DATABASE_URL не задан")
+
+    pooled = Database(url, min_size=args.pool_min, max_size=args.pool_max)
+    await pooled.connect()
+
+    report("per-call connect", await run(PerCallConnectDatabase(url), args.updates, args.rate))
+    report("pool", await run(pooled, args.updates, args.rate))
+
+    # Убираем за собой тестовые вопросы
+    conn = psycopg2.connect(url, sslmode='require')
+    with conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM questions WHERE user_id = -1")
+    conn.close()
+    await pooled.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
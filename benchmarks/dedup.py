@@ -0,0 +1,112 @@
+"""
+Бенчмарк поиска повторов на синтетическом корпусе.
+
+Прогоняет поток вопросов через DuplicateDetector (find, затем add), как это
+делает handle_message. Часть вопросов — точные повторы или небольшие вариации
+недавних вопросов. Печатает задержку find/add (p50/p99/max), долю найденных
+повторов и долю ложных срабатываний на новых вопросах.
+
+Запуск:
+    python benchmarks/dedup.py --questions 1000000 --window 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup import DuplicateDetector  # noqa: E402
+
+WORDS = (
+    "как где почему когда зачем можно ли сделать работать канал админ вопрос ответ бот "
+    "телеграм время деньги учеба работа жизнь стрим реклама связаться подскажите пожалуйста "
+    "следующий выпуск новости правила подписка оплата доставка заказ возврат скидка курс урок "
+    "проект команда друг совет помощь проблема ошибка телефон приложение сайт аккаунт пароль"
+).split()
+
+
+def fresh_question(rng: random.Random) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(6, 30))) + rng.choice(["?", "", "!", "??"])
+
+
+def vary(text: str, rng: random.Random) -> str:
+    """Небольшая вариация: вставка, удаление или замена одного слова, регистр и пунктуация"""
+    words = text.rstrip("?!").split()
+    op = rng.choice(("insert", "delete", "replace"))
+    i = rng.randrange(len(words))
+    if op == "insert":
+        words.insert(i, rng.choice(WORDS))
+    elif op == "delete" and len(words) > 6:
+        del words[i]
+    else:
+        words[i] = rng.choice(WORDS)
+    result = " ".join(words)
+    return (result.capitalize() if rng.random() < 0.5 else result) + rng.choice(["?", "!!", "", "..."])
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=1000000)
+    parser.add_argument('--window', type=int, default=20000, help='размер окна DuplicateDetector')
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--repeat-share', type=float, default=0.1, help='доля точных повторов')
+    parser.add_argument('--variant-share', type=float, default=0.1, help='доля вариаций')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    detector = DuplicateDetector(max_entries=args.window)
+    recent = []
+    find_times, add_times = [], []
+    stats = {"repeat": [0, 0], "variant": [0, 0], "fresh": [0, 0]}
+
+    started = time.perf_counter()
+    for question_id in range(1, args.questions + 1):
+        roll = rng.random()
+        if recent and roll < args.repeat_share:
+            kind, (text, user_id) = "repeat", rng.choice(recent)
+        elif recent and roll < args.repeat_share + args.variant_share:
+            base, user_id = rng.choice(recent)
+            kind, text = "variant", vary(base, rng)
+        else:
+            kind, text, user_id = "fresh", fresh_question(rng), rng.randrange(args.users)
+
+        t0 = time.perf_counter()
+        match = detector.find(text, user_id)
+        t1 = time.perf_counter()
+        detector.add(question_id, user_id, text)
+        t2 = time.perf_counter()
+        find_times.append(t1 - t0)
+        add_times.append(t2 - t1)
+
+        stats[kind][0] += 1
+        stats[kind][1] += match is not None
+        # Повторы берутся из недавних вопросов, которые заведомо еще в окне
+        recent.append((text, user_id))
+        if len(recent) > min(1000, args.window):
+            recent.pop(0)
+
+        if question_id % 100000 == 0:
+            print(f"... {question_id} вопросов, {time.perf_counter() - started:.0f} с", file=sys.stderr)
+
+    find_times.sort()
+    add_times.sort()
+    print(f"вопросов: {args.questions}, окно: {args.window}, в индексе: {len(detector)}")
+    for name, values in (("find", find_times), ("add", add_times)):
+        print(
+            f"{name:<5} p50={percentile(values, 0.5) * 1e6:7.1f} us  "
+            f"p99={percentile(values, 0.99) * 1e6:7.1f} us  max={values[-1] * 1e6:8.1f} us"
+        )
+    for kind, (total, found) in stats.items():
+        label = "ложные срабатывания" if kind == "fresh" else "найдено"
+        print(f"{kind:<8} {total:>8}  {label}: {found / max(total, 1) * 100:5.1f}%")
+
+
+if __name__ == '__main__':
+    main()
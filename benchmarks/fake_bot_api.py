@@ -0,0 +1,238 @@
+"""
+Локальная заглушка Telegram Bot API для нагрузочного теста.
+
+Понимает ровно то, что нужно боту: getMe, getUpdates (long polling),
+setWebhook/deleteWebhook, sendMessage, editMessageText, answerCallbackQuery
+и любые другие методы с ответом-заглушкой. Задержка ответа и доля ответов
+429 (RetryAfter) настраиваются. Обновления подкладываются через push_update:
+в режиме polling они отдаются в getUpdates, в режиме webhook отправляются
+POST-запросом на адрес из setWebhook. Если setWebhook вызвали несколько
+экземпляров бота с разными адресами, обновления раздаются им по кругу,
+как балансировщик перед кластером.
+
+Каждый вызов метода передается в наблюдателей (watch): по ним нагрузочный
+тест определяет, когда бот ответил на конкретное обновление.
+"""
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "LoadTestBot", "username": "load_test_bot"}
+
+_PATH = re.compile(r'^/bot[^/]+/(\w+)$')
+_MULTIPART_NAME = re.compile(rb'name="([^"]+)"')
+
+def _decode(value: str) -> Any:
+    """PTB передает сложные параметры строками JSON, простые строки — как есть"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def _parse_multipart(body: bytes, content_type: str) -> Dict[str, Any]:
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+    params = {}
+    for part in body.split(b'--' + boundary):
+        head, _, content = part.partition(b'\r\n\r\n')
+        match = _MULTIPART_NAME.search(head)
+        if not match or b'filename=' in head:
+            continue
+        params[match.group(1).decode()] = _decode(content[:-2].decode(errors='replace'))
+    return params
+
+def _parse_body(body: bytes, content_type: str) -> Dict[str, Any]:
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        return _parse_multipart(body, content_type)
+    return {key: _decode(value) for key, value in parse_qsl(body.decode())}
+
+
+class FakeBotAPI:
+    """HTTP-сервер, отвечающий как Bot API"""
+
+    def __init__(self, latency: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.floods: Counter = Counter()
+        self.webhook_urls: List[str] = []
+        self.webhook_secrets: Dict[str, Optional[str]] = {}
+        self.webhook_set = asyncio.Event()
+        self._webhook_turn = itertools.count()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers = set()
+        self._update_ids = itertools.count(1)
+        self._message_ids = defaultdict(lambda: itertools.count(1))
+        self._updates: List[dict] = []
+        self._updates_ready = asyncio.Event()
+        self._watchers: List[Callable[[str, dict, Any], None]] = []
+        self._http = None
+
+    # --- Сервер ---
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._handle, host, port, backlog=1024)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._http is not None:
+            await self._http.aclose()
+        if self._server is not None:
+            self._server.close()
+            # Незавершенный long polling держит соединение: отпускаем его и закрываем сами
+            self._updates_ready.set()
+            await asyncio.sleep(0)
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # HTTP/1.1 keep-alive: httpx переиспользует соединения из своего пула
+        self._writers.add(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                path = request_line.split(' ')[1]
+                status, payload = await self._dispatch(path, _parse_body(body, headers.get('content-type', '')))
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, path: str, params: dict):
+        match = _PATH.match(path)
+        if not match:
+            return '404 Not Found', {"ok": False, "error_code": 404, "description": "Not Found"}
+        method = match.group(1)
+        self.calls[method] += 1
+
+        if method == 'getUpdates':
+            return '200 OK', {"ok": True, "result": await self._get_updates(params)}
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method not in ('getMe', 'setWebhook', 'deleteWebhook') and self.random.random() < self.flood_rate:
+            self.floods[method] += 1
+            return '429 Too Many Requests', {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            }
+
+        result = self._result(method, params)
+        for watcher in list(self._watchers):
+            watcher(method, params, result)
+        return '200 OK', {"ok": True, "result": result}
+
+    def _message(self, chat_id: int, params: dict, message_id: Optional[int] = None) -> dict:
+        message = {
+            "message_id": message_id or next(self._message_ids[chat_id]),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get('text') or params.get('caption') or '',
+        }
+        if params.get('reply_markup'):
+            message["reply_markup"] = params['reply_markup']
+        return message
+
+    def _result(self, method: str, params: dict) -> Any:
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'setWebhook':
+            url = params.get('url')
+            if url not in self.webhook_urls:
+                self.webhook_urls.append(url)
+            self.webhook_secrets[url] = params.get('secret_token')
+            self.webhook_set.set()
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_urls.clear()
+            self.webhook_secrets.clear()
+            return True
+        if method in ('editMessageText', 'editMessageReplyMarkup', 'editMessageCaption'):
+            if 'inline_message_id' in params:
+                return True
+            return self._message(int(params['chat_id']), params, int(params['message_id']))
+        if method == 'copyMessage':
+            return {"message_id": next(self._message_ids[int(params['chat_id'])])}
+        if method == 'sendMediaGroup':
+            media = params['media']
+            media = json.loads(media) if isinstance(media, str) else media
+            return [self._message(int(params['chat_id']), {}) for _ in media]
+        if method.startswith('send') and 'chat_id' in params:
+            return self._message(int(params['chat_id']), params)
+        return True
+
+    # --- Обновления ---
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), timeout=float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit') or 100)]
+
+    async def wait_webhooks(self, count: int = 1):
+        """Дождаться, пока setWebhook вызовут count экземпляров бота"""
+        await self.webhook_set.wait()
+        while len(self.webhook_urls) < count:
+            await asyncio.sleep(0.05)
+
+    async def push_update(self, update: dict):
+        """Отдать обновление боту (update_id проставляется здесь)"""
+        update['update_id'] = next(self._update_ids)
+        if self.webhook_urls:
+            if self._http is None:
+                import httpx
+                self._http = httpx.AsyncClient(limits=httpx.Limits(max_connections=256), timeout=30)
+            url = self.webhook_urls[next(self._webhook_turn) % len(self.webhook_urls)]
+            secret = self.webhook_secrets.get(url)
+            headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+            await self._http.post(url, json=update, headers=headers)
+        else:
+            self._updates.append(update)
+            self._updates_ready.set()
+
+    def next_message_id(self, chat_id: int) -> int:
+        """ID для входящего сообщения пользователя (общая нумерация с сообщениями бота в чате)"""
+        return next(self._message_ids[chat_id])
+
+    # --- Наблюдение за вызовами ---
+
+    def watch(self, watcher: Callable[[str, dict, Any], None]):
+        self._watchers.append(watcher)
+
+    def unwatch(self, watcher: Callable[[str, dict, Any], None]):
+        self._watchers.remove(watcher)
@@ -0,0 +1,520 @@
+"""
+Сквозной нагрузочный тест бота на локальной заглушке Bot API.
+
+Бот собирается тем же build_application(), что и в main(), и работает
+в этом процессе с хранилищем из DATABASE_URL (по умолчанию memory://,
+внешние сервисы не нужны; sqlite:///load.db или postgres://... —
+чтобы измерить настоящую БД). Заглушка Bot API
+(benchmarks/fake_bot_api.py) и генератор нагрузки работают в отдельном
+процессе, чтобы не делить с ботом event loop. Каждый виртуальный клиент
+отправляет обновление и ждет ответа бота в своем чате, затем отправляет
+следующее; задержка — от отправки обновления до ответа.
+
+Сценарии:
+    questions — пользователи массово задают вопросы
+    replies   — админы отвечают на заранее заданные вопросы
+    buttons   — админы жмут статистику, обновление и список неотвеченных
+    mixed     — все сразу
+
+С --instances N бот запускается кластером из N процессов (CLUSTER_ENABLED,
+webhook, общая БД — sqlite:///файл или PostgreSQL), а заглушка раздает
+обновления их webhook-адресам по кругу, как балансировщик.
+
+Печатает пропускную способность, p50/p95/p99 по типам запросов, число
+таймаутов, повторно доставленные админам копии вопросов и, для PostgreSQL,
+пиковое число соединений с БД (pg_stat_activity). С порогами --min-throughput / --max-p99 / --max-timeouts
+завершается с кодом 1 при их нарушении, поэтому годится как регрессионная
+проверка.
+
+Запуск (с PostgreSQL — только на тестовой БД, скрипт пишет в таблицы бота):
+    python benchmarks/load_test.py --workload mixed --duration 30
+    DATABASE_URL=postgres://localhost/bot_test?sslmode=disable \\
+        python benchmarks/load_test.py --workload mixed --duration 30 --reset
+    DATABASE_URL=sqlite:///load.db python benchmarks/load_test.py --instances 3 --reset
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import secrets
+import socket
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Optional
+
+from fake_bot_api import FakeBotAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKLOADS = ('questions', 'replies', 'buttons', 'mixed')
+BUTTONS = ('stats', 'refresh_stats', 'show_pending')
+USER_ID_BASE = 10_000_000
+PREFILL_USER_ID_BASE = 5_000_000
+
+WORDS = (
+    "как где почему когда можно ли сделать канал админ вопрос ответ бот телеграм время учеба "
+    "работа стрим реклама подскажите пожалуйста выпуск новости правила подписка оплата курс"
+).split()
+
+
+# --- Генератор нагрузки (процесс заглушки) ---
+
+class LoadDriver:
+    """Виртуальные пользователи и админы, отправляющие обновления в заглушку"""
+
+    def __init__(self, api: FakeBotAPI, opts: dict):
+        self.api = api
+        self.opts = opts
+        self.admin_ids = list(range(1, opts['admins'] + 1))
+        self.rng = random.Random(opts['seed'])
+        self.latencies = defaultdict(list)
+        self.timeouts = Counter()
+        self._waiters = defaultdict(list)
+        self._copies = defaultdict(list)
+        self._copy_keys = Counter()
+        self._callback_ids = itertools.count(1)
+        self.copies_delivered = 0
+        self.duplicate_copies = 0
+        api.watch(self._on_call)
+
+    def _on_call(self, method: str, params: dict, result):
+        chat_id = params.get('chat_id')
+        if chat_id is None:
+            return
+        chat_id = int(chat_id)
+        if method == 'sendMessage' and chat_id in self.admin_ids and self._is_question_copy(params):
+            self._copies[chat_id].append(result)
+            self.copies_delivered += 1
+            # Один вопрос должен прийти каждому админу ровно один раз, сколько бы узлов ни работало
+            key = (chat_id, self._question_id(params))
+            self._copy_keys[key] += 1
+            if self._copy_keys[key] > 1:
+                self.duplicate_copies += 1
+        waiters = self._waiters.get(chat_id)
+        if not waiters:
+            return
+        for i, (predicate, future) in enumerate(waiters):
+            if not future.done() and predicate(method, params):
+                future.set_result(None)
+                del waiters[i]
+                return
+
+    @staticmethod
+    def _is_question_copy(params: dict) -> bool:
+        markup = params.get('reply_markup') or {}
+        return any(
+            str(button.get('callback_data', '')).startswith('reply_')
+            for row in markup.get('inline_keyboard', ()) for button in row
+        )
+
+    def _message(self, chat_id: int, text: str, reply_to: dict = None) -> dict:
+        message = {
+            "message_id": self.api.next_message_id(chat_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": f"u{chat_id}"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"u{chat_id}"},
+            "text": text,
+        }
+        if reply_to is not None:
+            message["reply_to_message"] = reply_to
+        return message
+
+    def _question_text(self, user_id: int, n: int) -> str:
+        return f"Вопрос {user_id}-{n}: " + " ".join(self.rng.choices(WORDS, k=self.rng.randint(5, 20))) + "?"
+
+    async def request(self, kind: str, chat_id: int, update: dict, predicate):
+        """Отправить обновление и дождаться ответа бота в чате chat_id"""
+        future = asyncio.get_running_loop().create_future()
+        waiter = (predicate, future)
+        self._waiters[chat_id].append(waiter)
+        start = time.perf_counter()
+        await self.api.push_update(update)
+        try:
+            await asyncio.wait_for(future, timeout=self.opts['timeout'])
+        except asyncio.TimeoutError:
+            self.timeouts[kind] += 1
+            if waiter in self._waiters[chat_id]:
+                self._waiters[chat_id].remove(waiter)
+            return
+        self.latencies[kind].append(time.perf_counter() - start)
+
+    async def ask(self, user_id: int, n: int, kind: str = 'question'):
+        update = {"message": self._message(user_id, self._question_text(user_id, n))}
+        await self.request(kind, user_id, update, lambda method, params: method == 'sendMessage')
+
+    async def question_client(self, user_id: int, deadline: float):
+        for n in itertools.count():
+            if time.monotonic() >= deadline:
+                return
+            await self.ask(user_id, n)
+
+    async def reply_client(self, admin_index: int, deadline: float):
+        admin_id = self.admin_ids[admin_index]
+        copies = self._copies[admin_id]
+        while time.monotonic() < deadline:
+            # Каждый админ отвечает на свою долю вопросов, чтобы ответы не пересекались
+            copy = next((c for c in copies if self._question_id(c) % len(self.admin_ids) == admin_index), None)
+            if copy is None:
+                await asyncio.sleep(0.05)
+                continue
+            copies.remove(copy)
+            message = self._message(admin_id, "Нагрузочный ответ", reply_to=copy)
+            target = message["message_id"]
+            await self.request(
+                'reply', admin_id, {"message": message},
+                lambda method, params: int(params.get('reply_to_message_id') or 0) == target
+            )
+
+    async def button_client(self, admin_index: int, deadline: float):
+        admin_id = self.admin_ids[admin_index]
+        target = self._message(admin_id, "Статистика")
+        target["from"] = {"id": 1000000001, "is_bot": True, "first_name": "LoadTestBot"}
+        for data in itertools.cycle(BUTTONS):
+            if time.monotonic() >= deadline:
+                return
+            update = {"callback_query": {
+                "id": str(next(self._callback_ids)),
+                "from": {"id": admin_id, "is_bot": False, "first_name": f"u{admin_id}"},
+                "chat_instance": str(admin_id),
+                "message": target,
+                "data": data,
+            }}
+            await self.request(
+                'button', admin_id, update,
+                lambda method, params: method == 'editMessageText'
+                and int(params.get('message_id') or 0) == target["message_id"]
+            )
+
+    @staticmethod
+    def _question_id(copy: dict) -> int:
+        for row in copy.get('reply_markup', {}).get('inline_keyboard', ()):
+            for button in row:
+                if str(button.get('callback_data', '')).startswith('reply_'):
+                    return int(button['callback_data'].split('_')[1])
+        return 0
+
+    async def prefill(self, count: int):
+        """Задать вопросы, на которые потом будут отвечать админы, и дождаться их доставки"""
+        semaphore = asyncio.Semaphore(50)
+
+        async def one(i):
+            async with semaphore:
+                await self.ask(PREFILL_USER_ID_BASE + i, 0, kind='prefill')
+
+        await asyncio.gather(*(one(i) for i in range(count)))
+        deadline = time.monotonic() + self.opts['timeout']
+        while self.copies_delivered < count and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def run(self) -> dict:
+        workload, duration = self.opts['workload'], self.opts['duration']
+        if workload in ('replies', 'mixed'):
+            await self.prefill(self.opts['prefill'])
+        self.latencies.pop('prefill', None)
+
+        deadline = time.monotonic() + duration
+        clients = []
+        if workload in ('questions', 'mixed'):
+            clients += [self.question_client(USER_ID_BASE + i, deadline) for i in range(self.opts['users'])]
+        if workload in ('replies', 'mixed'):
+            clients += [self.reply_client(i, deadline) for i in range(len(self.admin_ids))]
+        if workload in ('buttons', 'mixed'):
+            clients += [
+                self.button_client(i % len(self.admin_ids), deadline)
+                for i in range(self.opts['button_clients'])
+            ]
+        started = time.perf_counter()
+        await asyncio.gather(*clients)
+        return {
+            'elapsed': time.perf_counter() - started,
+            'latencies': dict(self.latencies),
+            'timeouts': dict(self.timeouts),
+            'api_calls': dict(self.api.calls),
+            'api_floods': dict(self.api.floods),
+            'duplicate_copies': self.duplicate_copies,
+        }
+
+
+async def drive(conn, opts: dict):
+    api = FakeBotAPI(latency=opts['api_latency'] / 1000, flood_rate=opts['flood_rate'], seed=opts['seed'])
+    conn.send(await api.start())
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, conn.recv)
+    if opts['mode'] == 'webhook':
+        await asyncio.wait_for(api.wait_webhooks(opts['instances']), timeout=30)
+    results = await LoadDriver(api, opts).run()
+    conn.send(results)
+    # Заглушка должна пережить остановку бота: updater делает последний getUpdates
+    await loop.run_in_executor(None, conn.recv)
+    await api.stop()
+
+
+def driver_process(conn, opts: dict):
+    asyncio.run(drive(conn, opts))
+
+
+# --- Бот и БД (основной процесс) ---
+
+class ConnectionSampler(threading.Thread):
+    """Раз в interval секунд считает соединения с тестовой БД"""
+
+    def __init__(self, url: str, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.url = url
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_active = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        import psycopg2
+        conn = psycopg2.connect(self.url)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            while not self._stop_event.wait(self.interval):
+                cur.execute(
+                    "SELECT COUNT(*), COUNT(*) FILTER (WHERE state = 'active') FROM pg_stat_activity "
+                    "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+                )
+                total, active = cur.fetchone()
+                self.peak_total = max(self.peak_total, total)
+                self.peak_active = max(self.peak_active, active)
+        conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def reset_database(url: str):
+    if url.startswith('sqlite://'):
+        path = url.split('://', 1)[1][1:]
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        return
+    if not url.startswith('postgres'):
+        return
+    import psycopg2
+    conn = psycopg2.connect(url)
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('public.questions') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute("TRUNCATE questions, admin_messages, outbox RESTART IDENTITY CASCADE")
+            cur.execute("UPDATE question_stats SET total = 0, answered = 0")
+        cur.execute("SELECT to_regclass('public.inbox') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute("TRUNCATE inbox, cluster_slots, cluster_nodes")
+    conn.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def run_bot(bot, args, conn, api_port: int) -> dict:
+    application = bot.build_application(base_url=f"http://127.0.0.1:{api_port}/bot")
+    loop = asyncio.get_running_loop()
+    async with application:
+        # run_polling/run_webhook вызывают хуки сами; здесь жизненным циклом управляет тест
+        await bot.post_init(application)
+        await application.start()
+        if args.mode == 'webhook':
+            port = free_port()
+            await application.updater.start_webhook(
+                listen='127.0.0.1', port=port, url_path='telegram',
+                webhook_url=f"http://127.0.0.1:{port}/telegram",
+                secret_token=bot.Config.WEBHOOK_SECRET or secrets.token_urlsafe(16),
+                allowed_updates=bot.ALLOWED_UPDATES
+            )
+        else:
+            await application.updater.start_polling(allowed_updates=bot.ALLOWED_UPDATES)
+        conn.send('ready')
+        results = await loop.run_in_executor(None, conn.recv)
+        await application.updater.stop()
+        await application.stop()
+        await bot.post_stop(application)
+        await bot.post_shutdown(application)
+    conn.send('done')
+    return results
+
+
+def import_bot(log_level: str):
+    # Корень репозитория — первым: в benchmarks/ есть свой dedup.py
+    sys.path.insert(0, ROOT)
+    import logging
+    import bot
+    logging.getLogger().setLevel(log_level)
+    return bot
+
+
+def bot_process(conn, args, api_port: int):
+    asyncio.run(run_bot(import_bot(args.log_level), args, conn, api_port))
+
+
+def run_cluster(args, driver_conn, api_port: int) -> dict:
+    """
+    Запустить args.instances процессов бота и передавать сигналы между ними
+    и генератором нагрузки: готовность всех узлов, результаты, остановку.
+    """
+    context = multiprocessing.get_context('spawn')
+    nodes = []
+    for i in range(args.instances):
+        # Окружение передается процессу при запуске: у каждого узла свое имя
+        os.environ['NODE_ID'] = f"load-{i + 1}"
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=bot_process, args=(child_conn, args, api_port))
+        process.start()
+        nodes.append((process, conn))
+    for _, conn in nodes:
+        conn.recv()
+    driver_conn.send('ready')
+    results = driver_conn.recv()
+    for _, conn in nodes:
+        conn.send(results)
+    for process, conn in nodes:
+        conn.recv()
+        process.join(timeout=30)
+    driver_conn.send('done')
+    return results
+
+
+def percentile(values, q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def report(results: dict, sampler: Optional[ConnectionSampler], args) -> dict:
+    elapsed = results['elapsed']
+    summary = {'elapsed': elapsed, 'kinds': {}, 'api_calls': results['api_calls'], 'api_floods': results['api_floods']}
+    if sampler is not None:
+        summary.update(db_connections_peak=sampler.peak_total, db_connections_active_peak=sampler.peak_active)
+    print(f"\nСценарий: {args.workload}, режим: {args.mode}, длительность: {elapsed:.1f} с")
+    print(f"{'запрос':<10} {'n':>8} {'в сек':>9} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'таймауты':>9}")
+    total = 0
+    for kind in sorted(set(results['latencies']) | set(results['timeouts'])):
+        values = sorted(results['latencies'].get(kind, ()))
+        timeouts = results['timeouts'].get(kind, 0)
+        total += len(values)
+        stats = {'count': len(values), 'throughput': len(values) / elapsed, 'timeouts': timeouts}
+        if values:
+            stats.update(p50=statistics.median(values) * 1000, p95=percentile(values, 0.95) * 1000,
+                         p99=percentile(values, 0.99) * 1000)
+        summary['kinds'][kind] = stats
+        print(f"{kind:<10} {len(values):>8} {stats['throughput']:>9.1f} {stats.get('p50', 0):>9.1f} "
+              f"{stats.get('p95', 0):>9.1f} {stats.get('p99', 0):>9.1f} {timeouts:>9}")
+    summary['throughput'] = total / elapsed
+    print(f"Всего: {total / elapsed:.1f} запросов/с")
+    if sampler is not None:
+        print(f"Соединения с БД: пик {sampler.peak_total}, активных одновременно {sampler.peak_active}")
+    print(f"Вызовы Bot API: {results['api_calls']}, ответов 429: {sum(results['api_floods'].values())}")
+    summary['duplicate_copies'] = results['duplicate_copies']
+    print(f"Повторно доставленных админам копий вопросов: {results['duplicate_copies']}")
+    return summary
+
+
+def check_gates(summary: dict, args) -> list:
+    failures = []
+    if args.min_throughput is not None and summary['throughput'] < args.min_throughput:
+        failures.append(f"пропускная способность {summary['throughput']:.1f} < {args.min_throughput}")
+    for kind, stats in summary['kinds'].items():
+        if args.max_p99 is not None and stats.get('p99', 0) > args.max_p99:
+            failures.append(f"{kind}: p99 {stats['p99']:.1f} мс > {args.max_p99} мс")
+    timeouts = sum(stats['timeouts'] for stats in summary['kinds'].values())
+    if timeouts > args.max_timeouts:
+        failures.append(f"таймаутов {timeouts} > {args.max_timeouts}")
+    if summary['duplicate_copies']:
+        failures.append(f"вопросы доставлены админам повторно: {summary['duplicate_copies']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workload', choices=WORKLOADS, default='mixed')
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--instances', type=int, default=1,
+                        help='процессов бота в кластере (больше 1 — webhook и общая БД)')
+    parser.add_argument('--duration', type=float, default=20.0, help='длительность замера, с')
+    parser.add_argument('--users', type=int, default=200, help='одновременных пользователей')
+    parser.add_argument('--admins', type=int, default=5)
+    parser.add_argument('--button-clients', type=int, default=20, help='одновременных нажатий кнопок')
+    parser.add_argument('--prefill', type=int, default=500, help='вопросов для сценария replies')
+    parser.add_argument('--api-latency', type=float, default=20.0, help='задержка ответа Bot API, мс')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--timeout', type=float, default=30.0, help='сколько ждать ответа бота, с')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='очистить таблицы бота перед запуском')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    parser.add_argument('--min-throughput', type=float, help='порог: запросов/с не меньше')
+    parser.add_argument('--max-p99', type=float, help='порог: p99 любого типа запросов не больше, мс')
+    parser.add_argument('--max-timeouts', type=int, default=0, help='порог: таймаутов не больше')
+    args = parser.parse_args()
+
+    url = os.environ.setdefault('DATABASE_URL', 'memory://')
+    if args.instances > 1:
+        if url.startswith('memory') or url.endswith(':memory:'):
+            parser.error("--instances требует общей БД: DATABASE_URL=sqlite:///файл или postgres://...")
+        # Узлы кластера принимают обновления только по webhook с общим секретом
+        args.mode = 'webhook'
+        os.environ.setdefault('CLUSTER_ENABLED', 'true')
+        os.environ.setdefault('WEBHOOK_SECRET', secrets.token_urlsafe(16))
+
+    # Лимиты Telegram и защита от флуда ограничили бы сам тест, а не бот;
+    # переменные окружения, заданные явно, имеют приоритет
+    os.environ.setdefault('BOT_TOKEN', '123456:LOAD-TEST')
+    os.environ.setdefault('ADMIN_IDS', ','.join(str(i) for i in range(1, args.admins + 1)))
+    os.environ.setdefault('TG_GLOBAL_RATE', '100000')
+    os.environ.setdefault('TG_CHAT_RATE', '100000')
+    os.environ.setdefault('TG_CHAT_BURST', '100000')
+    os.environ.setdefault('USER_RATE_PER_MINUTE', '1000000')
+    os.environ.setdefault('USER_BURST', '1000000')
+    os.environ.setdefault('MAX_OUTBOUND_QUEUE', '1000000')
+    os.environ.setdefault('MAX_DB_QUEUE', '1000000')
+    os.environ.setdefault('METRICS_PORT', '0')
+    # Каждый прогон начинается с пустых кэшей, а не со снимка прошлого
+    os.environ.setdefault('STATE_PATH', '')
+    # Под перегрузкой медленным становится почти каждое обновление: предупреждения заняли бы весь вывод
+    os.environ.setdefault('SLOW_UPDATE_MS', '0')
+
+    if args.reset:
+        reset_database(url)
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    driver = multiprocessing.get_context('spawn').Process(target=driver_process, args=(child_conn, vars(args)))
+    driver.start()
+    api_port = parent_conn.recv()
+
+    sampler = ConnectionSampler(url) if url.startswith('postgres') else None
+    if sampler is not None:
+        sampler.start()
+    try:
+        if args.instances > 1:
+            results = run_cluster(args, parent_conn, api_port)
+        else:
+            results = asyncio.run(run_bot(import_bot(args.log_level), args, parent_conn, api_port))
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        driver.join(timeout=10)
+
+    summary = report(results, sampler, args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    failures = check_gates(summary, args)
+    for failure in failures:
+        print(f"❌ Порог нарушен: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,211 @@
+import asyncio
+import functools
 import logging
 import html
+import secrets
+import signal
+import tempfile
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, 
-    CallbackQueryHandler, ContextTypes, filters
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler, 
+    CallbackQueryHandler, ContextTypes, TypeHandler, filters
 )
+from cache import LRUCache
+from circuit import STATE_VALUES
+from cluster import ClusterCoordinator
 from config import Config
-from database import Database
+from dedup import DuplicateDetector
+from delivery import DeliveryWorker
+from export import ExportWriter, describe_filters, parse_export_args
+from logs import bind_question, setup_logging
+from media import CAPTION_TYPES, MediaGroupCollector, album_media, media_type_of, message_media, messages_media, with_media_label
+from metrics import (
+    CLUSTER_NODES, CLUSTER_SLOTS_OWNED, DB_CIRCUIT_STATE, DB_QUEUE_DEPTH, HANDLER_ERRORS, HANDLER_LATENCY, INBOX_INFLIGHT,
+    OUTBOUND_QUEUE_DEPTH, SPOOL_PENDING, EventLoopMonitor, MetricsServer, timed
+)
+from profiling import UpdateProfiler, traced
+from ratelimit import SlidingWindowRate, UserRateLimiter
+from routing import AdminRouter
+from sender import InstrumentedRequest, OutboundSender
+from spool import QuestionSpool
+from storage import SPOOLED, open_storage
+from updates import ChatOrderedUpdateProcessor, RecentUpdates
+from warmstate import WarmState
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+# Настройка логирования: запись в фоновом потоке через ограниченную очередь,
+# INFO-записи обработки обновлений прореживаются по LOG_SAMPLE_RATE
+setup_logging(
+    level=Config.LOG_LEVEL,
+    fmt=Config.LOG_FORMAT,
+    sample_rate=Config.LOG_SAMPLE_RATE,
+    queue_size=Config.LOG_QUEUE_SIZE
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация базы данных
-db = Database(Config.DATABASE_URL)
+# Хранилище по DATABASE_URL: PostgreSQL, SQLite или память (открывается в post_init)
+db = open_storage(
+    Config.DATABASE_URL,
+    min_size=Config.DB_POOL_MIN_SIZE,
+    max_size=Config.DB_POOL_MAX_SIZE,
+    healthcheck_interval=Config.DB_HEALTHCHECK_INTERVAL,
+    reply_cache_size=Config.REPLY_CACHE_SIZE,
+    stats_cache_ttl=Config.STATS_CACHE_TTL,
+    history_cache_ttl=Config.HISTORY_CACHE_TTL,
+    connect_timeout=Config.DB_CONNECT_TIMEOUT,
+    breaker_threshold=Config.DB_BREAKER_THRESHOLD,
+    breaker_reset_timeout=Config.DB_BREAKER_RESET
+)
+# Пока БД недоступна, вопросы пишутся в локальный журнал и переносятся в нее после восстановления
+if Config.SPOOL_PATH and db.supports_spool:
+    db.spool = QuestionSpool(Config.SPOOL_PATH)
+
+# Типы обновлений, которые реально обрабатывают зарегистрированные обработчики:
+# сообщения (вопросы, ответы, команды) и нажатия inline-кнопок
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# Сколько неотвеченных вопросов показывать на одной странице
+PENDING_PAGE_SIZE = 10
+
+# История вопросов пользователя (/myquestions): вопросов на странице и длина превью вопроса и ответа
+HISTORY_PAGE_SIZE = 5
+HISTORY_PREVIEW_LENGTH = 200
+
+# Поиск: результатов на странице и сколько последних запросов помнить для кнопок листания
+# (текст запроса не помещается в callback_data, там только короткий ключ)
+SEARCH_PAGE_SIZE = 10
+search_queries = LRUCache(1000)
+
+# Выбор админов, которым уходит вопрос (всем или одному назначенному)
+router = AdminRouter(db, Config.ADMIN_IDS, mode=Config.ROUTING_MODE, weights=Config.ADMIN_WEIGHTS)
+
+# Частота входящих вопросов за последнюю минуту: по ней включается режим дайджеста
+intake_rate = SlidingWindowRate(window=60)
+
+# Ограничение частоты вопросов от одного пользователя
+user_limiter = UserRateLimiter(
+    rate_per_minute=Config.USER_RATE_PER_MINUTE,
+    burst=Config.USER_BURST,
+    cooldown=Config.USER_COOLDOWN,
+    max_users=Config.RATE_LIMITER_MAX_USERS
+)
+
+# Окно недавних вопросов для поиска повторов
+dedup = DuplicateDetector(
+    max_entries=Config.DEDUP_WINDOW,
+    ttl=Config.DEDUP_TTL,
+    similarity=Config.DEDUP_SIMILARITY
+)
+
+# Длина превью вопроса в дайджесте
+DIGEST_PREVIEW_LENGTH = 150
+
+# Вложения, которые принимаются в вопросах и ответах (пересылаются без повторной загрузки)
+MEDIA_FILTER = (
+    filters.PHOTO | filters.VIDEO | filters.ANIMATION | filters.Document.ALL | filters.AUDIO
+    | filters.VOICE | filters.VIDEO_NOTE | filters.Sticker.ALL
+)
+
+# Сборка альбомов: каждый элемент приходит отдельным сообщением
+media_groups = MediaGroupCollector(Config.MEDIA_GROUP_WINDOW)
+
+# Общий отправитель исходящих сообщений с учетом лимитов Telegram
+sender = OutboundSender(
+    global_rate=Config.TG_GLOBAL_RATE,
+    chat_rate=Config.TG_CHAT_RATE,
+    chat_burst=Config.TG_CHAT_BURST,
+    max_retries=Config.TG_MAX_RETRIES
+)
+
+# Кластер: несколько экземпляров бота делят обновления по слотам чатов
+# и обмениваются событиями через БД; лимиты Telegram делятся между узлами поровну
+cluster = ClusterCoordinator(
+    db,
+    node_id=Config.NODE_ID,
+    slots=Config.CLUSTER_SLOTS,
+    lease_seconds=Config.CLUSTER_LEASE,
+    max_inflight=Config.MAX_CONCURRENT_UPDATES * 2,
+    on_resize=lambda nodes: sender.set_share(1 / nodes)
+) if Config.CLUSTER_ENABLED else None
+
+# Текст вопроса в событии кластера: для окна повторов хватает начала, а NOTIFY ограничен 8000 байт
+CLUSTER_EVENT_TEXT_LENGTH = 3000
+
+def on_cluster_question(event: dict):
+    """Вопрос, сохраненный другим узлом: окно повторов, частота вопросов и статистика"""
+    # Повторы ищутся только среди текстовых вопросов (у вопроса с вложениями текст пустой)
+    if event["text"]:
+        dedup.add(event["id"], event["user_id"], event["text"])
+    intake_rate.add()
+    db.invalidate_stats()
+
+def on_cluster_answered(event: dict):
+    """Ответ на другом узле: повтор вопроса станет новым вопросом"""
+    dedup.forget(event["id"])
+    db.invalidate_stats()
+
+def on_cluster_archived(event: dict):
+    """Другой узел перенес вопросы в архив: соответствия копий у админов устарели"""
+    db.reply_cache.clear()
+    db.invalidate_stats()
+
+if cluster:
+    cluster.on("question", on_cluster_question)
+    cluster.on("answered", on_cluster_answered)
+    cluster.on("stats", lambda event: db.invalidate_stats())
+    cluster.on("archived", on_cluster_archived)
+    cluster.on("reset", on_cluster_archived)
+
+# Обработанные обновления: их повторы от Telegram после перезапуска пропускаются
+# (в кластере повторы отсекает inbox)
+recent_updates = RecentUpdates() if not cluster else None
+
+def dump_reply_cache() -> list:
+    return [[chat_id, message_id, question["id"], question["user_id"]]
+            for (chat_id, message_id), question in db.reply_cache.items()]
+
+def load_reply_cache(items: list, elapsed: float):
+    for chat_id, message_id, question_id, user_id in items:
+        db.reply_cache.put((chat_id, message_id), {"id": question_id, "user_id": user_id})
+
+# Теплый перезапуск: кэш ответов, лимиты пользователей и обработанные обновления
+# сохраняются в файл и восстанавливаются при запуске (outbox и статистика и так в БД)
+warm_state = WarmState(Config.STATE_PATH, max_age=Config.STATE_MAX_AGE) if Config.STATE_PATH else None
+if warm_state:
+    # Вопросы в памяти не переживают перезапуск: кэш ответов указывал бы в пустоту
+    if db.persistent:
+        warm_state.register("reply_cache", dump_reply_cache, load_reply_cache)
+    warm_state.register("rate_limits", user_limiter.snapshot, user_limiter.restore)
+    if recent_updates is not None:
+        warm_state.register("updates", recent_updates.snapshot, lambda ids, elapsed: recent_updates.extend(ids))
+
+# Метрики: HTTP-эндпоинт в формате Prometheus и замер задержки event loop
+metrics_server = MetricsServer(Config.METRICS_HOST, Config.METRICS_PORT) if Config.METRICS_PORT else None
+loop_monitor = EventLoopMonitor()
+DB_QUEUE_DEPTH.set_function(lambda: db.queue_depth)
+DB_CIRCUIT_STATE.set_function(lambda: STATE_VALUES[db.breaker.state])
+SPOOL_PENDING.set_function(lambda: db.spool.pending if db.spool else 0)
+OUTBOUND_QUEUE_DEPTH.set_function(lambda: sender.queue_depth)
+if cluster:
+    CLUSTER_NODES.set_function(lambda: cluster.nodes)
+    CLUSTER_SLOTS_OWNED.set_function(lambda: len(cluster.owned))
+    INBOX_INFLIGHT.set_function(lambda: cluster.inflight)
+
+# Время обработки обновлений по этапам: медленные пишутся в лог, /profile N включает cProfile
+profiler = UpdateProfiler(Config.SLOW_UPDATE_MS / 1000, keep_slow=Config.SLOW_UPDATES_KEPT)
+
+# Сколько обновлений можно профилировать одной командой /profile
+PROFILE_MAX_UPDATES = 10000
+
+def instrumented(callback):
+    """Обернуть обработчик замером времени, подсчетом исключений и отметкой в замере обновления по его имени"""
+    return timed(HANDLER_LATENCY, HANDLER_ERRORS, callback.__name__, ignore=(ApplicationHandlerStop,))(traced(callback))
+
+def run_in_background(context: ContextTypes.DEFAULT_TYPE, coroutine, update: Update) -> asyncio.Task:
+    """Фоновая задача обработчика; при остановке бота она прерывается по тому же сроку, что и обновления"""
+    task = context.application.create_task(coroutine, update=update)
+    context.application.update_processor.track(task)
+    return task
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
@@ -40,15 +229,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Отправляем уведомление админам о новом пользователе
     if Config.ADMIN_IDS:
         admin_text = f"🆕 <b>Новый пользователь запустил бота</b>\nВремя: {update.message.date}\n(Анонимный ID: {user.id})"
-        for admin_id in Config.ADMIN_IDS:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=admin_text,
-                    parse_mode='HTML'
-                )
-            except Exception as e:
-                logger.error(f"❌ Не удалось уведомить админа {admin_id}: {e}")
+        await sender.broadcast(context.bot, Config.ADMIN_IDS, admin_text, parse_mode='HTML')
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
@@ -79,6 +260,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Начало работы\n"
         "/help - Эта справка\n"
         "/rules - Правила использования\n"
+        "/myquestions - Ваши вопросы и ответы на них\n"
         "/cancel - Отменить текущее действие\n\n"
         
         "💡 <b>Совет:</b> Чем подробнее вопрос, тем точнее ответ!"
@@ -118,15 +300,169 @@ async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_html(rules_text)
 
+def render_pending_page(page: dict, page_number: int):
+    """Текст и кнопки страницы неотвеченных вопросов"""
+    keyboard = []
+    if not page['items']:
+        text = "✅ <b>Нет неотвеченных вопросов!</b>\n\nВсе вопросы обработаны."
+    else:
+        text = f"⏳ <b>НЕОТВЕЧЕННЫЕ ВОПРОСЫ</b> ({page['total']})\n\n"
+        first_number = page_number * PENDING_PAGE_SIZE + 1
+        for i, question in enumerate(page['items'], first_number):
+            text += (
+                f"{i}. <b>#{question['id']}</b>\n"
+                f"📝 {html.escape(with_media_label(question['preview'], question['media_type']))}\n"
+                f"🕐 {question['asked_at'].strftime('%d.%m %H:%M')}\n\n"
+            )
+        text += f"<i>Страница {page_number + 1}</i>"
+        
+        # Курсоры листания: граница первого и последнего вопроса на странице
+        navigation = []
+        if page['has_newer'] and page_number > 0:
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Новее", callback_data=f"pending_newer_{page_number - 1}_{page['items'][0]['cursor']}"
+            ))
+        if page['has_older']:
+            navigation.append(InlineKeyboardButton(
+                "Старше ➡️", callback_data=f"pending_older_{page_number + 1}_{page['items'][-1]['cursor']}"
+            ))
+        if navigation:
+            keyboard.append(navigation)
+    
+    keyboard.append([InlineKeyboardButton("📊 Назад к статистике", callback_data="refresh_stats")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+def render_history_page(page: dict, page_number: int):
+    """Текст и кнопки страницы истории вопросов пользователя"""
+    if not page['items']:
+        return "📭 <b>У вас пока нет вопросов.</b>\n\nПросто напишите свой вопрос в этот чат.", None
+    
+    text = "📋 <b>ВАШИ ВОПРОСЫ</b>\n\n"
+    for question in page['items']:
+        if not question['is_answered']:
+            status = "⏳ ожидает ответа"
+        elif question['answer_preview'] is None:
+            status = "✅ отмечен отвеченным"
+        else:
+            status = "✅ отвечен"
+        text += (
+            f"<b>#{question['id']}</b> · {question['asked_at'].strftime('%d.%m %H:%M')} · {status}\n"
+            f"📝 {html.escape(with_media_label(question['preview'], question['media_type']))}\n"
+        )
+        if question['answer_preview']:
+            text += f"💬 {html.escape(question['answer_preview'])}\n"
+        text += "\n"
+    text += f"<i>Страница {page_number + 1}</i>"
+    
+    navigation = []
+    if page['has_newer'] and page_number > 0:
+        navigation.append(InlineKeyboardButton(
+            "⬅️ Новее", callback_data=f"history_newer_{page_number - 1}_{page['items'][0]['cursor']}"
+        ))
+    if page['has_older']:
+        navigation.append(InlineKeyboardButton(
+            "Старше ➡️", callback_data=f"history_older_{page_number + 1}_{page['items'][-1]['cursor']}"
+        ))
+    return text, InlineKeyboardMarkup([navigation]) if navigation else None
+
+def render_search_page(key: str, query: str, result: dict, page_number: int):
+    """Текст и кнопки страницы результатов поиска"""
+    if not result['items']:
+        text = f"🔍 По запросу «{html.escape(query)}» ничего не найдено."
+        if page_number == 0:
+            return text, None
+    else:
+        text = f"🔍 <b>ПОИСК:</b> {html.escape(query)}\n\n"
+        first_number = page_number * SEARCH_PAGE_SIZE + 1
+        for i, question in enumerate(result['items'], first_number):
+            status = "✅" if question['is_answered'] else "⏳"
+            preview = with_media_label(question['preview'], question['media_type'])
+            text += f"{i}. {status} <b>#{question['id']}</b>\n📝 {html.escape(preview)}\n"
+            if question['answer_preview']:
+                text += f"💬 {html.escape(question['answer_preview'])}\n"
+            text += f"🕐 {question['asked_at'].strftime('%d.%m.%Y %H:%M')}\n\n"
+        text += f"<i>Страница {page_number + 1}</i>"
+    
+    navigation = []
+    if page_number > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"search_{key}_{page_number - 1}"))
+    if result['has_more']:
+        navigation.append(InlineKeyboardButton("Дальше ➡️", callback_data=f"search_{key}_{page_number + 1}"))
+    return text, InlineKeyboardMarkup([navigation]) if navigation else None
+
+async def skip_processed(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Повтор обновления, обработанного до перезапуска: Telegram присылает заново неподтвержденные"""
+    if update.update_id in recent_updates:
+        logger.info(f"⏭ Обновление {update.update_id} уже обработано, повтор пропущен")
+        raise ApplicationHandlerStop
+
+async def cluster_ingest(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Кластер: принятое по webhook обновление уходит в общий inbox к узлу-владельцу
+    слота его чата. Забранные из inbox обновления проходят к обычным обработчикам.
+    """
+    if cluster.is_replay(update):
+        return
+    if await cluster.ingest(update):
+        raise ApplicationHandlerStop
+    # БД недоступна: лучше обработать здесь, чем потерять обновление
+    logger.warning(f"⚠️ Обновление {update.update_id} не записано в inbox, обрабатывается на этом узле")
+
+async def admission_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Допуск сообщений пользователей до handle_message: лимит на пользователя и сброс нагрузки"""
+    user = update.effective_user
+    if user.id in Config.ADMIN_IDS:
+        return
+    
+    # Следующие элементы альбома — часть уже допущенного вопроса
+    if update.message.media_group_id and media_groups.pending(update.message):
+        return
+    
+    allowed, retry_after, notify = user_limiter.check(user.id)
+    if not allowed:
+        if notify:
+            await update.message.reply_text(
+                f"⏳ Слишком много сообщений. Попробуйте снова через {int(retry_after) + 1} сек."
+            )
+        raise ApplicationHandlerStop
+    
+    # Глобальный сброс нагрузки: очередь исходящих или запросов к БД слишком длинная
+    if sender.queue_depth > Config.MAX_OUTBOUND_QUEUE or db.queue_depth > Config.MAX_DB_QUEUE:
+        logger.warning(
+            f"⚠️ Перегрузка (исходящие: {sender.queue_depth}, БД: {db.queue_depth}), сообщение отклонено"
+        )
+        if user_limiter.block(user.id, Config.USER_COOLDOWN):
+            await update.message.reply_text(
+                "⏳ Бот сейчас перегружен. Пожалуйста, отправьте вопрос чуть позже."
+            )
+        raise ApplicationHandlerStop
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка текстовых сообщений от пользователей"""
+    """Обработка вопросов от пользователей: текст или вложения (фото, видео, файлы, голосовые, альбомы)"""
     user = update.effective_user
     message = update.message
     
+    # Следующий элемент альбома, который уже собирается (вопрос или ответ админа)
+    if message.media_group_id and media_groups.pending(message):
+        media_groups.add(message)
+        return
+    
     # Если сообщение от админа - игнорируем (админы отвечают через reply)
     if user.id in Config.ADMIN_IDS:
         return
     
+    if message.media_group_id:
+        # Альбом собирается в фоне: обработчик не должен задерживать обновления этого чата,
+        # иначе остальные элементы альбома до него не дойдут
+        media_groups.add(message)
+        run_in_background(context, handle_album(update, context), update)
+        return
+    
+    media = message_media(message)
+    if media:
+        await accept_question(update, context, message.caption or "", media["type"], [media])
+        return
+    
     # Проверяем длину сообщения
     if len(message.text) > 4000:
         await message.reply_text(
@@ -141,129 +477,333 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Сохраняем вопрос в БД
-    question_id = db.save_question(
+    # Свой повтор складываем в уже заданный вопрос, чужой — помечаем для админов
+    duplicate = dedup.find(message.text, user.id)
+    if duplicate and duplicate.user_id == user.id:
+        await message.reply_html(
+            f"🔁 <b>Вы уже задавали этот вопрос</b>\n\n"
+            f"🆔 Номер вопроса: <code>#{duplicate.question_id}</code>\n"
+            f"⏳ Ответ придет сюда же, как только администратор ответит."
+        )
+        return
+    
+    await accept_question(update, context, message.text, duplicate_of=duplicate.question_id if duplicate else None)
+
+async def handle_album(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Вопрос-альбом: дождаться всех элементов и сохранить их одним вопросом"""
+    caption, media = messages_media(await media_groups.collect(update.message))
+    await accept_question(update, context, caption, media_type_of(media), media)
+
+async def accept_question(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str,
+                          media_type: str = None, media: list = None, duplicate_of: int = None):
+    """Сохранить вопрос (текст или подпись к вложениям) и подтвердить его пользователю"""
+    user = update.effective_user
+    message = update.message
+    
+    # Сохраняем вопрос и доставки админам в одной транзакции (outbox)
+    recipients, assigned_admin_id = await router.route()
+    question_id = await db.save_question(
         user_id=user.id,
         message_id=message.message_id,
-        question_text=message.text
+        question_text=text,
+        recipients=recipients,
+        assigned_admin_id=assigned_admin_id,
+        duplicate_of=duplicate_of,
+        media_type=media_type,
+        media=media
     )
     
+    if question_id == SPOOLED:
+        # БД недоступна: вопрос надежно записан в локальный журнал и получит номер при переносе в БД
+        await message.reply_html(
+            f"✅ <b>Ваш вопрос принят!</b>\n\n"
+            f"🔒 <i>Ваша анонимность сохранена</i>\n"
+            f"🕐 Время отправки: {message.date.strftime('%H:%M')}\n\n"
+            f"⏳ Вопрос будет передан администраторам в ближайшее время.\n"
+            f"<b>Ответ придет сюда же, в этот чат.</b>"
+        )
+        return
+    
     if not question_id:
         await message.reply_text(
             "❌ Произошла ошибка при сохранении вопроса. Попробуйте позже."
         )
         return
     
-    # Формируем сообщение для админов
-    admin_text = (
-        f"❓ <b>НОВЫЙ АНОНИМНЫЙ ВОПРОС</b> [#{question_id}]\n"
-        f"🕐 {update.message.date.strftime('%d.%m.%Y %H:%M')}\n"
-        f"🔢 ID вопроса: {question_id}\n"
-        f"📊 Длина: {len(message.text)} символов\n\n"
-        f"━━━━━━━━━━━━━━━━━━━━\n"
-        f"{html.escape(message.text)}\n"
-        f"━━━━━━━━━━━━━━━━━━━━\n\n"
-        f"<i>Чтобы ответить, используйте reply на это сообщение</i>"
-    )
+    # Вопрос надежно сохранен: доставку админам выполнит фоновый воркер
+    bind_question(question_id)
+    if not media_type:
+        dedup.add(question_id, user.id, text)
+    intake_rate.add()
+    delivery.wake()
+    if cluster:
+        run_in_background(context, cluster.publish(
+            "question", id=question_id, user_id=user.id,
+            text="" if media_type else text[:CLUSTER_EVENT_TEXT_LENGTH]
+        ), update)
     
-    # Создаем клавиатуру для быстрых действий
+    # Подтверждаем пользователю
+    confirmation_text = (
+        f"✅ <b>Ваш вопрос отправлен администраторам!</b>\n\n"
+        f"🔒 <i>Ваша анонимность сохранена</i>\n"
+        f"🆔 Номер вопроса: <code>#{question_id}</code>\n"
+        f"🕐 Время отправки: {message.date.strftime('%H:%M')}\n\n"
+        f"⏳ <b>Ожидайте ответа здесь же в этом чате.</b>\n\n"
+        f"💡 <i>Ответ обычно приходит в течение 24 часов</i>\n"
+        f"📋 Ваши вопросы и ответы: /myquestions"
+    )
+    await message.reply_html(confirmation_text)
+
+def question_keyboard(question_id, seen: bool = False) -> InlineKeyboardMarkup:
+    """Клавиатура быстрых действий под вопросом у админа"""
     keyboard = [
         [
             InlineKeyboardButton("📝 Ответить", callback_data=f"reply_{question_id}"),
             InlineKeyboardButton("✅ Отвечено", callback_data=f"done_{question_id}")
-        ],
-        [
-            InlineKeyboardButton("👁️ Просмотрено", callback_data=f"seen_{question_id}"),
-            InlineKeyboardButton("📊 Статистика", callback_data="stats")
         ]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # Отправляем вопрос всем админам
-    sent_to_admins = []
-    for admin_id in Config.ADMIN_IDS:
-        try:
-            admin_message = await context.bot.send_message(
-                chat_id=admin_id,
-                text=admin_text,
-                parse_mode='HTML',
-                reply_markup=reply_markup
-            )
-            
-            # Сохраняем ID сообщения у админа
-            db.save_admin_message_id(question_id, admin_message.message_id)
-            sent_to_admins.append(admin_id)
-            
-            logger.info(f"✅ Вопрос #{question_id} отправлен админу {admin_id} (message_id: {admin_message.message_id})")
-            
-        except Exception as e:
-            logger.error(f"❌ Не удалось отправить вопрос админу {admin_id}: {e}")
-    
-    if sent_to_admins:
-        # Подтверждаем пользователю
-        confirmation_text = (
-            f"✅ <b>Ваш вопрос отправлен администраторам!</b>\n\n"
-            f"🔒 <i>Ваша анонимность сохранена</i>\n"
-            f"🆔 Номер вопроса: <code>#{question_id}</code>\n"
-            f"🕐 Время отправки: {update.message.date.strftime('%H:%M')}\n\n"
-            f"⏳ <b>Ожидайте ответа здесь же в этом чате.</b>\n\n"
-            f"💡 <i>Ответ обычно приходит в течение 24 часов</i>"
+    # Взять вопрос себе имеет смысл, только если вопросы назначаются одному админу
+    if router.assigns:
+        keyboard.append([
+            InlineKeyboardButton("🙋 Взять себе", callback_data=f"claim_{question_id}"),
+            InlineKeyboardButton("↩️ Отказаться", callback_data=f"release_{question_id}")
+        ])
+    keyboard.append([
+        InlineKeyboardButton("📊 Статистика", callback_data="stats")
+    ])
+    if not seen:
+        keyboard[-1].insert(0, InlineKeyboardButton("👁️ Просмотрено", callback_data=f"seen_{question_id}"))
+    return InlineKeyboardMarkup(keyboard)
+
+def render_admin_question(question_id: int, question_text: str, asked_at, duplicate_of: int = None,
+                          media_type: str = None, footer: str = None) -> str:
+    """
+    Текст вопроса для админа (вложения вопроса отправляются перед ним);
+    footer заменяет подсказку про reply, когда вопрос уже закрыт
+    """
+    duplicate_line = f"🔁 Похож на вопрос #{duplicate_of}\n" if duplicate_of else ""
+    media_line = f"📎 Вложение: {with_media_label('', media_type)} (выше)\n" if media_type else ""
+    body = html.escape(question_text) if question_text else "<i>без подписи</i>"
+    return (
+        f"❓ <b>НОВЫЙ АНОНИМНЫЙ ВОПРОС</b> [#{question_id}]\n"
+        f"🕐 {asked_at.strftime('%d.%m.%Y %H:%M')}\n"
+        f"🔢 ID вопроса: {question_id}\n"
+        f"📊 Длина: {len(question_text)} символов\n"
+        f"{media_line}"
+        f"{duplicate_line}\n"
+        f"━━━━━━━━━━━━━━━━━━━━\n"
+        f"{body}\n"
+        f"━━━━━━━━━━━━━━━━━━━━\n\n"
+        f"{footer or '<i>Чтобы ответить, используйте reply на это сообщение</i>'}"
+    )
+
+async def close_admin_copies(bot, question_id: int, footer: str, extra_target: tuple = None) -> int:
+    """
+    Исправить карточки вопроса у всех админов разом: убрать кнопки и вместо
+    подсказки про reply показать footer (кто и когда ответил). Правки идут
+    параллельно через общий лимитер. Возвращает число исправленных карточек.
+    """
+    question, cards = await asyncio.gather(db.get_question(question_id), db.get_question_cards(question_id))
+    if not question:
+        return 0
+    if extra_target and extra_target not in cards:
+        # Нажатая карточка могла быть отправлена до того, как карточки стали записываться
+        cards.append(extra_target)
+    text = render_admin_question(
+        question['id'], question['question_text'], question['asked_at'], question['duplicate_of'],
+        question['media_type'], footer=footer
+    )
+    edited = await sender.edit_messages(bot, cards, text, parse_mode='HTML')
+    logger.info(f"✏️ Карточки вопроса #{question_id} закрыты у админов: {edited}/{len(cards)}")
+    return edited
+
+async def relay_media(bot, chat_id: int, from_chat_id: int, message_id: int, media: list) -> list:
+    """
+    Переслать вложения без повторной загрузки и без имени отправителя: одно вложение —
+    copy_message исходного сообщения, альбом — send_media_group по сохраненным file_id.
+    Возвращает ID отправленных сообщений.
+    """
+    if not media:
+        return []
+    if len(media) == 1:
+        # Подпись убирается: текст идет следующим сообщением вместе с номером вопроса
+        caption = {'caption': ''} if media[0]['type'] in CAPTION_TYPES else {}
+        copied = await sender.call(
+            chat_id, bot.copy_message,
+            chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id, **caption
         )
-        await message.reply_html(confirmation_text)
-    else:
-        error_text = (
-            "❌ <b>Не удалось отправить вопрос</b>\n\n"
-            "Администраторы временно недоступны.\n"
-            "Пожалуйста, попробуйте позже.\n\n"
-            "<i>Мы уже уведомлены о проблеме</i>"
+        return [copied.message_id]
+    sent = await sender.call(chat_id, bot.send_media_group, chat_id=chat_id, media=album_media(media))
+    return [message.message_id for message in sent]
+
+async def deliver_question(bot, item: dict):
+    """Отправить вопрос из outbox одному админу; возвращает ID отправленных сообщений"""
+    question_id = item['question_id']
+    bind_question(question_id)
+    # Вложения, отправленные прошлой попыткой, повторно не шлются
+    media_ids = item['sent_message_ids'] or await relay_media(
+        bot, item['chat_id'], item['user_id'], item['message_id'], item['media']
+    )
+    admin_text = render_admin_question(
+        question_id, item['question_text'], item['asked_at'], item['duplicate_of'], item['media_type']
+    )
+    
+    try:
+        admin_message = await sender.send_message(
+            bot, item['chat_id'], admin_text,
+            parse_mode='HTML',
+            reply_markup=question_keyboard(question_id),
+            reply_to_message_id=media_ids[0] if media_ids else None
         )
-        await message.reply_html(error_text)
-        
-        # Логируем критическую ошибку
-        logger.critical(f"❌ Вопрос #{question_id} не отправлен ни одному админу!")
+    except Exception as e:
+        # Воркер сохранит ID вложений в доставке, и повтор отправит только карточку
+        e.sent_message_ids = media_ids
+        raise
+    # Reply на вложение тоже находит вопрос
+    return media_ids + [admin_message.message_id]
+
+async def deliver_digest(bot, chat_id: int, items: list):
+    """Отправить админу сводку из нескольких вопросов (режим дайджеста при всплеске)"""
+    header = f"📚 <b>ДАЙДЖЕСТ ВОПРОСОВ</b> ({len(items)})\n<i>Нажмите /qN, чтобы открыть вопрос и ответить на него</i>\n\n"
+    # Части сводки: текст и ID доставок, вопросы которых в него вошли
+    chunks = [[header, []]]
+    for item in items:
+        text = with_media_label(item['question_text'], item['media_type'])
+        preview = text[:DIGEST_PREVIEW_LENGTH] + "..." if len(text) > DIGEST_PREVIEW_LENGTH else text
+        duplicate_mark = f" 🔁 #{item['duplicate_of']}" if item['duplicate_of'] else ""
+        line = f"<b>#{item['question_id']}</b> /q{item['question_id']}{duplicate_mark}\n📝 {html.escape(preview)}\n\n"
+        # Лимит Telegram — 4096 символов на сообщение
+        if len(chunks[-1][0]) + len(line) > 4000:
+            chunks.append(["", []])
+        chunks[-1][0] += line
+        chunks[-1][1].append(item['id'])
+    
+    # Результат по каждой доставке: отправленные части не повторяются при следующей попытке
+    results = {}
+    error = None
+    for chunk, delivery_ids in chunks:
+        if error is None:
+            try:
+                await sender.send_message(bot, chat_id, chunk, parse_mode='HTML')
+            except Exception as e:
+                # Остальные части не отправляем: их вопросы повторятся вместе с этой
+                error = e
+        for delivery_id in delivery_ids:
+            results[delivery_id] = [] if error is None else error
+    return [results[item['id']] for item in items]
+
+async def open_question_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Открыть вопрос из дайджеста по ссылке /qN (только для админов)"""
+    user = update.effective_user
+    if user.id not in Config.ADMIN_IDS:
+        await update.message.reply_text("❌ Эта команда только для администраторов.")
+        return
+    
+    question_id = int(context.match.group(1))
+    question = await db.get_question(question_id)
+    if not question:
+        await update.message.reply_text(f"❌ Вопрос #{question_id} не найден.")
+        return
+    
+    chat_id = update.effective_chat.id
+    media_ids = await relay_media(context.bot, chat_id, question['user_id'], question['message_id'], question['media'])
+    admin_message = await update.message.reply_html(
+        render_admin_question(
+            question['id'], question['question_text'], question['asked_at'], question['duplicate_of'],
+            question['media_type']
+        ),
+        reply_markup=question_keyboard(question['id'])
+    )
+    # Эта копия вопроса (и ее вложения) тоже принимает reply с ответом
+    await db.save_admin_messages(
+        question['id'], question['user_id'],
+        [(chat_id, admin_message.message_id)],
+        [(chat_id, message_id) for message_id in media_ids]
+    )
+
+# Фоновая доставка вопросов админам из outbox (при всплеске — дайджестами)
+delivery = DeliveryWorker(
+    db, deliver_question,
+    batch_size=Config.OUTBOX_BATCH_SIZE,
+    poll_interval=Config.OUTBOX_POLL_INTERVAL,
+    max_attempts=Config.OUTBOX_MAX_ATTEMPTS,
+    deliver_digest=deliver_digest,
+    rate_meter=intake_rate,
+    digest_threshold=Config.DIGEST_THRESHOLD,
+    digest_window=Config.DIGEST_WINDOW
+)
 
 async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка ответов админов (reply на сообщение)"""
+    """Обработка ответов админов (reply на сообщение): текст или вложения"""
     user = update.effective_user
+    message = update.message
+    
+    # Следующий элемент альбома-ответа, который уже собирается
+    if message.media_group_id and media_groups.pending(message):
+        media_groups.add(message)
+        return
     
     logger.info(f"🔍 Получено reply сообщение от пользователя {user.id}")
     
     # Проверяем, что это админ
     if user.id not in Config.ADMIN_IDS:
         logger.warning(f"⚠️ Неадмин {user.id} пытается ответить на вопрос")
-        await update.message.reply_text("❌ У вас нет прав для ответа на вопросы.")
+        await message.reply_text("❌ У вас нет прав для ответа на вопросы.")
         return
     
     logger.info(f"✅ Это админ {user.id} ({user.first_name})")
     
     # Проверяем, что это reply на сообщение
-    if not update.message.reply_to_message:
+    if not message.reply_to_message:
         logger.warning(f"⚠️ Админ {user.id} отправил не reply сообщение")
-        await update.message.reply_text("ℹ️ Чтобы ответить на вопрос, используйте reply на сообщение с вопросом.")
+        await message.reply_text("ℹ️ Чтобы ответить на вопрос, используйте reply на сообщение с вопросом.")
         return
     
-    admin_message_id = update.message.reply_to_message.message_id
-    answer_text = update.message.text
+    admin_message_id = message.reply_to_message.message_id
     
     logger.info(f"✅ Это reply на сообщение {admin_message_id}")
     
     # Проверяем длину ответа
-    if len(answer_text) > 4000:
-        await update.message.reply_text("❌ Слишком длинный ответ. Ограничьте 4000 символами.")
+    if message.text and len(message.text) > 4000:
+        await message.reply_text("❌ Слишком длинный ответ. Ограничьте 4000 символами.")
         return
     
-    # Ищем вопрос по ID сообщения админа
-    question = db.get_user_by_admin_message(admin_message_id)
+    # Ищем вопрос по копии, на которую ответил именно этот админ
+    question = await db.get_user_by_admin_message(update.effective_chat.id, admin_message_id)
     
     if not question:
         logger.error(f"❌ Вопрос не найден для admin_message_id: {admin_message_id}")
-        await update.message.reply_text("❌ Не удалось найти вопрос. Возможно, он был удален или уже отвечен.")
+        await message.reply_text("❌ Не удалось найти вопрос. Возможно, он был удален или уже отвечен.")
         return
     
+    bind_question(question['id'])
     logger.info(f"✅ Найден вопрос #{question['id']} для user_id: {question['user_id']}")
     
+    if message.media_group_id:
+        # Ответ альбомом: собираем элементы в фоне, как и вопрос-альбом
+        media_groups.add(message)
+        run_in_background(context, answer_with_album(update, context, question), update)
+        return
+    
+    media = message_media(message)
+    await send_answer(update, context, question, message.text or message.caption or "", [media] if media else [])
+
+async def answer_with_album(update: Update, context: ContextTypes.DEFAULT_TYPE, question: dict):
+    """Ответ-альбом: дождаться всех элементов и отправить их одним ответом"""
+    caption, media = messages_media(await media_groups.collect(update.message))
+    await send_answer(update, context, question, caption, media)
+
+async def send_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, question: dict, answer_text: str, media: list):
+    """Отправить ответ пользователю анонимно (вложения — без повторной загрузки) и отметить вопрос"""
+    user = update.effective_user
+    # В БД и в сообщении пользователю ответ с вложениями помечен их видом
+    answer_text = with_media_label(answer_text, media_type_of(media))
+    
     # Отправляем ответ пользователю
     try:
+        media_ids = await relay_media(
+            context.bot, question['user_id'], update.effective_chat.id, update.message.message_id, media
+        )
         response_to_user = (
             f"📨 <b>ОТВЕТ НА ВАШ ВОПРОС #{question['id']}</b>\n\n"
             f"━━━━━━━━━━━━━━━━━━━━\n"
@@ -276,16 +816,20 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         logger.info(f"📤 Пытаюсь отправить сообщение пользователю {question['user_id']}")
         
-        user_message = await context.bot.send_message(
-            chat_id=question['user_id'],
-            text=response_to_user,
-            parse_mode='HTML'
+        user_message = await sender.send_message(
+            context.bot, question['user_id'], response_to_user,
+            parse_mode='HTML',
+            reply_to_message_id=media_ids[0] if media_ids else None
         )
         
         logger.info(f"✅ Сообщение отправлено пользователю {question['user_id']}, message_id: {user_message.message_id}")
         
-        # Отмечаем в БД как отвеченный
-        db.mark_as_answered(question['id'], answer_text)
+        # Отмечаем в БД как отвеченный; повтор этого вопроса теперь станет новым вопросом
+        await db.mark_as_answered(question['id'], answer_text)
+        db.invalidate_user_questions(question['user_id'])
+        dedup.forget(question['id'])
+        if cluster:
+            run_in_background(context, cluster.publish("answered", id=question['id']), update)
         
         # Подтверждаем админу
         confirmation_to_admin = (
@@ -296,30 +840,18 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
             f"🕐 Время: {update.message.date.strftime('%H:%M:%S')}"
         )
         
-        await update.message.reply_text(
-            confirmation_to_admin,
-            parse_mode='HTML',
-            reply_to_message_id=update.message.message_id
+        # Вместо отдельного уведомления другим админам исправляем копии вопроса у всех:
+        # кнопки убираются, внизу видно, кто ответил
+        footer = f"✅ <b>Ответил {html.escape(user.first_name)}</b> {update.message.date.strftime('%d.%m.%Y %H:%M')}"
+        await asyncio.gather(
+            update.message.reply_text(
+                confirmation_to_admin,
+                parse_mode='HTML',
+                reply_to_message_id=update.message.message_id
+            ),
+            close_admin_copies(context.bot, question['id'], footer)
         )
         
-        # Уведомляем других админов
-        for admin_id in Config.ADMIN_IDS:
-            if admin_id != user.id:
-                try:
-                    notification_text = (
-                        f"📤 <b>Админ ответил на вопрос</b>\n"
-                        f"👤 Админ: {user.first_name}\n"
-                        f"🆔 Вопрос: #{question['id']}\n"
-                        f"🕐 {update.message.date.strftime('%H:%M')}"
-                    )
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=notification_text,
-                        parse_mode='HTML'
-                    )
-                except Exception as e:
-                    logger.error(f"Не удалось уведомить админа {admin_id}: {e}")
-        
         logger.info(f"✅ Админ {user.id} ответил на вопрос #{question['id']}")
                     
     except Exception as e:
@@ -346,16 +878,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith('seen_'):
         question_id = data.split('_')[1]
         # Просто убираем кнопку "Просмотрено"
-        keyboard = [
-            [
-                InlineKeyboardButton("📝 Ответить", callback_data=f"reply_{question_id}"),
-                InlineKeyboardButton("✅ Отвечено", callback_data=f"done_{question_id}")
-            ],
-            [
-                InlineKeyboardButton("📊 Статистика", callback_data="stats")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = question_keyboard(question_id, seen=True)
         
         # Обновляем текст сообщения
         original_text = query.message.text_html
@@ -368,13 +891,53 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
     elif data.startswith('done_'):
-        question_id = data.split('_')[1]
+        question_id = int(data.split('_')[1])
+        bind_question(question_id)
+        closed = await db.close_question(question_id)
+        if closed is None:
+            await query.message.reply_text(f"❌ Не удалось отметить вопрос #{question_id}, попробуйте еще раз.")
+            return
+        if not closed:
+            # Вопрос уже отвечен: его карточки исправил тот, кто ответил
+            await query.edit_message_reply_markup(reply_markup=None)
+            await query.message.reply_text(f"ℹ️ Вопрос #{question_id} уже отвечен.")
+            return
+        # close_question вернул автора вопроса: его /myquestions покажет вопрос отвеченным
+        db.invalidate_user_questions(closed)
+        dedup.forget(question_id)
+        if cluster:
+            run_in_background(context, cluster.publish("answered", id=question_id), update)
+        footer = f"✅ <b>Отмечен отвеченным: {html.escape(user.first_name)}</b> {datetime.utcnow():%d.%m.%Y %H:%M}"
+        await close_admin_copies(
+            context.bot, question_id, footer, extra_target=(query.message.chat_id, query.message.message_id)
+        )
+        logger.info(f"✅ Админ {user.id} отметил вопрос #{question_id} отвеченным")
+        
+    elif data.startswith('claim_'):
+        question_id = int(data.split('_')[1])
+        if not await db.claim_question(question_id, user.id):
+            await query.message.reply_text(f"❌ Вопрос #{question_id} уже взят другим админом или отвечен.")
+            return
         await query.edit_message_text(
-            f"✅ <b>Вопрос #{question_id} отмечен как отвеченный</b>\n\n"
-            f"Админ: {user.first_name}\n"
-            f"Время: {query.message.date.strftime('%H:%M:%S')}",
+            text=query.message.text_html + f"\n\n🙋 <i>Взят в работу: {user.first_name}</i>",
+            parse_mode='HTML',
+            reply_markup=query.message.reply_markup
+        )
+        
+    elif data.startswith('release_'):
+        question_id = int(data.split('_')[1])
+        if not await db.release_question(question_id, user.id):
+            await query.message.reply_text(f"❌ Вопрос #{question_id} не закреплен за вами.")
+            return
+        await query.edit_message_text(
+            text=query.message.text_html + f"\n\n↩️ <i>{user.first_name} отказался от вопроса</i>",
             parse_mode='HTML'
         )
+        # Сразу передаем вопрос другому админу
+        if router.assigns:
+            new_admin_id = await router.pick(exclude=[user.id])
+            if new_admin_id is not None and await db.reassign_question(question_id, None, new_admin_id):
+                delivery.wake()
         
     elif data.startswith('reply_'):
         question_id = data.split('_')[1]
@@ -388,12 +951,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
     elif data == "stats":
-        stats = db.get_stats()
+        stats = await db.get_stats()
         stats_text = (
             f"📊 <b>СТАТИСТИКА БОТА</b>\n\n"
             f"📈 Всего вопросов: {stats['total']}\n"
             f"✅ Отвечено: {stats['answered']}\n"
             f"⏳ Ожидают ответа: {stats['pending']}\n"
+            f"🖼 С вложениями: {stats['media']}\n"
             f"📅 Процент ответов: {(stats['answered']/stats['total']*100 if stats['total'] > 0 else 0):.1f}%\n\n"
             f"<i>Обновлено: {query.message.date.strftime('%d.%m.%Y %H:%M')}</i>"
         )
@@ -403,12 +967,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     
     elif data == "refresh_stats":
-        stats = db.get_stats()
+        stats = await db.get_stats()
         stats_text = (
             f"📊 <b>СТАТИСТИКА БОТА</b>\n\n"
             f"📈 Всего вопросов: {stats['total']}\n"
             f"✅ Отвечено: {stats['answered']}\n"
             f"⏳ Ожидают ответа: {stats['pending']}\n"
+            f"🖼 С вложениями: {stats['media']}\n"
             f"📅 Процент ответов: {(stats['answered']/stats['total']*100 if stats['total'] > 0 else 0):.1f}%\n\n"
             f"<i>Обновлено: {query.message.date.strftime('%d.%m.%Y %H:%M')}</i>"
         )
@@ -428,35 +993,27 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     
     elif data == "show_pending":
-        pending_questions = db.get_pending_questions()
-        
-        if not pending_questions:
-            await query.edit_message_text("✅ <b>Нет неотвеченных вопросов!</b>\n\nВсе вопросы обработаны.", parse_mode='HTML')
+        page = await db.get_pending_page(limit=PENDING_PAGE_SIZE)
+        text, reply_markup = render_pending_page(page, 0)
+        await query.edit_message_text(text=text, parse_mode='HTML', reply_markup=reply_markup)
+    
+    elif data.startswith('search_'):
+        # search_<ключ запроса>_<номер страницы>
+        _, key, page_number = data.split('_', 2)
+        search_query = search_queries.get(key)
+        if search_query is None:
+            await query.edit_message_text("⌛ Результаты поиска устарели, повторите /search.")
             return
-        
-        pending_text = f"⏳ <b>НЕОТВЕЧЕННЫЕ ВОПРОСЫ</b> ({len(pending_questions)})\n\n"
-        
-        for i, question in enumerate(pending_questions[:10], 1):  # Ограничиваем 10 вопросами
-            question_preview = question['question_text'][:100] + "..." if len(question['question_text']) > 100 else question['question_text']
-            pending_text += (
-                f"{i}. <b>#{question['id']}</b>\n"
-                f"📝 {html.escape(question_preview)}\n"
-                f"🕐 {question['asked_at'].strftime('%d.%m %H:%M')}\n\n"
-            )
-        
-        if len(pending_questions) > 10:
-            pending_text += f"\n<i>... и еще {len(pending_questions) - 10} вопросов</i>"
-        
-        keyboard = [
-            [InlineKeyboardButton("📊 Назад к статистике", callback_data="refresh_stats")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            text=pending_text,
-            parse_mode='HTML',
-            reply_markup=reply_markup
-        )
+        result = await db.search_questions(search_query, page=int(page_number), limit=SEARCH_PAGE_SIZE)
+        text, reply_markup = render_search_page(key, search_query, result, int(page_number))
+        await query.edit_message_text(text=text, parse_mode='HTML', reply_markup=reply_markup)
+    
+    elif data.startswith('pending_'):
+        # pending_<older|newer>_<номер страницы>_<курсор>
+        _, direction, page_number, cursor = data.split('_', 3)
+        page = await db.get_pending_page(cursor=cursor, newer=(direction == 'newer'), limit=PENDING_PAGE_SIZE)
+        text, reply_markup = render_pending_page(page, int(page_number))
+        await query.edit_message_text(text=text, parse_mode='HTML', reply_markup=reply_markup)
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Статистика (только для админов)"""
@@ -465,14 +1022,15 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Эта команда только для администраторов.")
         return
     
-    stats = db.get_stats()
+    stats = await db.get_stats()
     
     stats_text = (
         f"📊 <b>СТАТИСТИКА АНОНИМНОГО БОТА</b>\n\n"
         f"👥 Администраторов: {len(Config.ADMIN_IDS)}\n"
         f"📈 Всего вопросов: <b>{stats['total']}</b>\n"
         f"✅ Отвечено: <b>{stats['answered']}</b>\n"
-        f"⏳ Ожидают ответа: <b>{stats['pending']}</b>\n\n"
+        f"⏳ Ожидают ответа: <b>{stats['pending']}</b>\n"
+        f"🖼 С вложениями: <b>{stats['media']}</b>\n\n"
         f"📅 Процент ответов: <b>{(stats['answered']/stats['total']*100 if stats['total'] > 0 else 0):.1f}%</b>\n"
         f"📆 Дата: {update.message.date.strftime('%d.%m.%Y')}\n"
         f"🕐 Время: {update.message.date.strftime('%H:%M:%S')}"
@@ -496,26 +1054,182 @@ async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Эта команда только для администраторов.")
         return
     
-    pending_questions = db.get_pending_questions()
+    page = await db.get_pending_page(limit=PENDING_PAGE_SIZE)
+    text, reply_markup = render_pending_page(page, 0)
+    await update.message.reply_html(text, reply_markup=reply_markup)
+
+async def myquestions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """История вопросов пользователя: статус и ответы"""
+    page = await db.get_user_questions(
+        update.effective_user.id, limit=HISTORY_PAGE_SIZE, preview_length=HISTORY_PREVIEW_LENGTH
+    )
+    if page is None:
+        await update.message.reply_text("❌ Не удалось загрузить ваши вопросы, попробуйте позже.")
+        return
+    text, reply_markup = render_history_page(page, 0)
+    await update.message.reply_html(text, reply_markup=reply_markup)
+
+async def history_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание истории вопросов (кнопки доступны всем: каждый видит только свои вопросы)"""
+    query = update.callback_query
+    await query.answer()
+    
+    # history_<older|newer>_<номер страницы>_<курсор>
+    _, direction, page_number, cursor = query.data.split('_', 3)
+    page = await db.get_user_questions(
+        query.from_user.id, cursor=cursor, newer=(direction == 'newer'),
+        limit=HISTORY_PAGE_SIZE, preview_length=HISTORY_PREVIEW_LENGTH
+    )
+    if page is None:
+        await query.message.reply_text("❌ Не удалось загрузить ваши вопросы, попробуйте позже.")
+        return
+    text, reply_markup = render_history_page(page, int(page_number))
+    await query.edit_message_text(text=text, parse_mode='HTML', reply_markup=reply_markup)
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Полнотекстовый поиск по вопросам и ответам (только для админов)"""
+    user = update.effective_user
+    if user.id not in Config.ADMIN_IDS:
+        await update.message.reply_text("❌ Эта команда только для администраторов.")
+        return
     
-    if not pending_questions:
-        await update.message.reply_text("✅ <b>Нет неотвеченных вопросов!</b>\n\nВсе вопросы обработаны.", parse_mode='HTML')
+    query = " ".join(context.args).strip()
+    if not query:
+        await update.message.reply_text(
+            "Использование: /search <слова>\n\n"
+            "Ищет по тексту вопросов и ответов, включая архив."
+        )
         return
     
-    pending_text = f"⏳ <b>НЕОТВЕЧЕННЫЕ ВОПРОСЫ</b> ({len(pending_questions)})\n\n"
+    key = secrets.token_hex(4)
+    search_queries.put(key, query)
+    result = await db.search_questions(query, limit=SEARCH_PAGE_SIZE)
+    text, reply_markup = render_search_page(key, query, result, 0)
+    await update.message.reply_html(text, reply_markup=reply_markup)
+
+# Выгрузка архива: одна за раз; Bot API не принимает от ботов файлы больше 50 МБ
+export_lock = asyncio.Lock()
+EXPORT_MAX_SIZE = 50 * 1024 * 1024
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка вопросов и ответов сжатым файлом (только для админов)"""
+    user = update.effective_user
+    if user.id not in Config.ADMIN_IDS:
+        await update.message.reply_text("❌ Эта команда только для администраторов.")
+        return
     
-    for i, question in enumerate(pending_questions[:10], 1):  # Ограничиваем 10 вопросами
-        question_preview = question['question_text'][:100] + "..." if len(question['question_text']) > 100 else question['question_text']
-        pending_text += (
-            f"{i}. <b>#{question['id']}</b>\n"
-            f"📝 {html.escape(question_preview)}\n"
-            f"🕐 {question['asked_at'].strftime('%d.%m %H:%M')}\n\n"
+    try:
+        options = parse_export_args(context.args)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ {e}\n\n"
+            "Использование: /export [csv|jsonl] [all|answered|pending] [ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]]"
         )
+        return
     
-    if len(pending_questions) > 10:
-        pending_text += f"\n<i>... и еще {len(pending_questions) - 10} вопросов</i>"
+    if export_lock.locked():
+        await update.message.reply_text("⏳ Выгрузка уже готовится, дождитесь файла.")
+        return
+    await export_lock.acquire()
+    # Файл готовится в фоне: обновления этого чата не ждут окончания выгрузки
+    run_in_background(context, run_export(context.bot, update.effective_chat.id, options), update)
+    await update.message.reply_text("⏳ Готовлю выгрузку, файл придет отдельным сообщением.")
+
+async def run_export(bot, chat_id: int, options: dict):
+    """Выгрузить вопросы во временный файл (в памяти до EXPORT_SPOOL_SIZE, дальше на диске) и отправить его"""
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=Config.EXPORT_SPOOL_SIZE) as spool:
+            writer = ExportWriter(spool, options["fmt"])
+            exported = await db.export_questions(
+                writer.write_rows,
+                since=options["since"],
+                until=options["until"],
+                answered=options["answered"],
+                batch_size=Config.EXPORT_BATCH_SIZE
+            )
+            writer.close()
+            if exported is None:
+                await sender.send_message(bot, chat_id, "❌ Не удалось выгрузить вопросы. Попробуйте позже.")
+                return
+            
+            size = spool.tell()
+            if size > EXPORT_MAX_SIZE:
+                await sender.send_message(
+                    bot, chat_id,
+                    f"❌ Файл выгрузки слишком большой ({size / 1024 / 1024:.0f} МБ). Укажите период покороче."
+                )
+                return
+            
+            filename = f"questions_{datetime.utcnow():%Y%m%d_%H%M%S}{writer.filename_suffix}"
+            # PTB (load_file) берет Path(obj.name) даже при явном filename, а у файла в памяти
+            # name is None: переносим файл на диск в пуле потоков, не блокируя event loop
+            await asyncio.get_running_loop().run_in_executor(None, spool.rollover)
+            
+            async def send_file():
+                # InputFile читает файл целиком в байты на каждой попытке (повтор после RetryAfter),
+                # поэтому перед каждой попыткой файл перематывается; между попытками копии нет
+                spool.seek(0)
+                return await bot.send_document(
+                    chat_id=chat_id,
+                    document=spool,
+                    filename=filename,
+                    caption=f"📦 Выгрузка: {describe_filters(options)}\nВопросов: {exported}",
+                    write_timeout=120
+                )
+            
+            await sender.call(chat_id, send_file)
+        logger.info(f"📦 Выгрузка отправлена в чат {chat_id}: {exported} вопросов, {size} байт")
+    finally:
+        export_lock.release()
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Профилирование обработки обновлений и отчет о горячих местах (только для админов)"""
+    user = update.effective_user
+    if user.id not in Config.ADMIN_IDS:
+        await update.message.reply_text("❌ Эта команда только для администраторов.")
+        return
+    
+    chat_id = update.effective_chat.id
+    arg = context.args[0].lower() if context.args else ''
+    if not arg:
+        # Отчет без новой выборки: этапы, медленные обновления и последняя выборка cProfile
+        await send_profile_report(context.bot, chat_id, profiler.report())
+        return
+    if arg == 'stop':
+        if not profiler.sampling:
+            await update.message.reply_text("ℹ️ Профилирование сейчас не идет.")
+            return
+        # Отчет по уже обработанным обновлениям придет файлом
+        profiler.stop_sampling()
+        return
+    if not arg.isdigit() or not 1 <= int(arg) <= PROFILE_MAX_UPDATES:
+        await update.message.reply_text(
+            "Использование:\n"
+            "/profile — отчет о времени обработки и медленных обновлениях\n"
+            f"/profile N — профилировать следующие N обновлений (до {PROFILE_MAX_UPDATES}), отчет придет файлом\n"
+            "/profile stop — закончить профилирование досрочно"
+        )
+        return
     
-    await update.message.reply_html(pending_text)
+    updates = int(arg)
+    if not profiler.start_sampling(updates, functools.partial(send_profile_report, context.bot, chat_id)):
+        await update.message.reply_text("⏳ Профилирование уже идет, дождитесь отчета или остановите его: /profile stop")
+        return
+    logger.info(f"🔬 Админ {user.id} включил профилирование следующих {updates} обновлений")
+    await update.message.reply_text(f"🔬 Профилирую следующие обновления: {updates}. Отчет придет файлом.")
+
+async def send_profile_report(bot, chat_id: int, report: str):
+    """Отправить отчет профилирования файлом"""
+    try:
+        await sender.call(
+            chat_id, bot.send_document,
+            chat_id=chat_id,
+            document=report.encode(),
+            filename=f"profile_{datetime.utcnow():%Y%m%d_%H%M%S}.txt",
+            caption="🔬 Профиль обработки обновлений"
+        )
+    except Exception as e:
+        logger.error(f"❌ Не удалось отправить отчет профилирования в чат {chat_id}: {e}")
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
@@ -531,44 +1245,299 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
 
-def main():
-    """Запуск бота"""
-    # Создаем Application
-    application = Application.builder().token(Config.BOT_TOKEN).build()
+def leader_only(callback):
+    """В кластере периодическую задачу выполняет только лидер (владелец слота 0)"""
+    @functools.wraps(callback)
+    async def wrapper(context: ContextTypes.DEFAULT_TYPE):
+        if cluster is None or cluster.is_leader:
+            await callback(context)
+    return wrapper
+
+async def reconcile_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая сверка счетчиков статистики с таблицей вопросов"""
+    await db.reconcile_stats()
+    if cluster:
+        await cluster.publish("stats")
+
+async def replay_spool_job(context: ContextTypes.DEFAULT_TYPE):
+    """Перенос вопросов из локального журнала в БД, когда она снова доступна"""
+    await replay_spool(context.application)
+
+async def replay_spool(application: Application):
+    if not db.spool.pending or db.breaker.rejecting:
+        return
+    saved = await db.replay_spool(Config.SPOOL_REPLAY_BATCH)
+    if not saved:
+        return
+    # Дальше — как после обычного сохранения вопроса
+    for question in saved:
+        if not question['media_type']:
+            dedup.add(question['id'], question['user_id'], question['question_text'])
+    intake_rate.add(len(saved))
+    delivery.wake()
+    if cluster:
+        for question in saved:
+            await cluster.publish(
+                "question", id=question['id'], user_id=question['user_id'],
+                text="" if question['media_type'] else question['question_text'][:CLUSTER_EVENT_TEXT_LENGTH]
+            )
+
+async def reassign_overdue_job(context: ContextTypes.DEFAULT_TYPE):
+    """Переназначение вопросов, которые назначенный админ не взял и не ответил вовремя"""
+    overdue = await db.get_overdue_assignments(Config.ASSIGNMENT_TIMEOUT)
+    if not overdue:
+        return
+    
+    loads = await db.get_admin_loads()
+    reassigned = 0
+    for question in overdue:
+        current_admin_id = question['assigned_admin_id']
+        new_admin_id = await router.pick(exclude=[current_admin_id], loads=loads)
+        if new_admin_id is None:
+            continue
+        if await db.reassign_question(question['id'], current_admin_id, new_admin_id):
+            loads[new_admin_id] = loads.get(new_admin_id, 0) + 1
+            if current_admin_id in loads:
+                loads[current_admin_id] -= 1
+            reassigned += 1
+    
+    if reassigned:
+        logger.info(f"🔀 Переназначено вопросов: {reassigned}")
+        delivery.wake()
+
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    """Перенос старых отвеченных вопросов в архив (или удаление) и очистка архива по сроку"""
+    keep_archive = Config.RETENTION_MODE != 'delete'
+    moved = 0
+    # Пачками: каждая — короткая транзакция, запросы бота выполняются между ними
+    while True:
+        batch = await db.archive_questions(
+            Config.RETENTION_DAYS * 86400,
+            keep_archive=keep_archive,
+            limit=Config.RETENTION_BATCH_SIZE
+        )
+        moved += batch
+        if batch < Config.RETENTION_BATCH_SIZE:
+            break
+    
+    if moved:
+        logger.info(f"🗄 {'Перенесено в архив' if keep_archive else 'Удалено'} отвеченных вопросов: {moved}")
+        if cluster:
+            await cluster.publish("archived")
+    if keep_archive and Config.ARCHIVE_RETENTION_DAYS:
+        await db.purge_archive(Config.ARCHIVE_RETENTION_DAYS * 86400)
+
+async def save_state_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодический снимок состояния: после падения перезапуск начнется с него"""
+    await warm_state.save()
+
+async def post_init(application: Application):
+    """Прогрев пула соединений, восстановление состояния и запуск доставки накопившихся вопросов"""
+    loop_monitor.start()
+    if metrics_server:
+        await metrics_server.start()
+    if warm_state:
+        await warm_state.load()
+        if recent_updates:
+            logger.info(f"⏭ Последнее обработанное обновление: {recent_updates.last}")
+    await db.connect()
+    if db.spool:
+        await db.spool.open()
+        await replay_spool(application)
+    if cluster:
+        await cluster.start(application)
+    delivery.start(application.bot)
+
+async def post_stop(application: Application):
+    """
+    Обработка обновлений уже остановлена: доставка дописывает текущую пачку,
+    пока бот еще может отправлять сообщения, а слоты кластера отдаются другим узлам
+    """
+    await delivery.stop()
+    if cluster:
+        await cluster.stop()
+
+async def post_shutdown(application: Application):
+    """Снимок состояния и закрытие пула соединений"""
+    if db.spool:
+        await db.spool.close()
+    if warm_state:
+        # Обновления и доставка уже остановлены: снимок больше не изменится
+        await warm_state.save()
+    await db.close()
+    if metrics_server:
+        await metrics_server.stop()
+    await loop_monitor.stop()
+
+def build_application(base_url: str = None) -> Application:
+    """
+    Собрать Application со всеми обработчиками и фоновыми задачами.
+
+    base_url позволяет направить запросы к Bot API на другой сервер
+    (например, на локальную заглушку в нагрузочном тесте).
+    """
+    builder = (
+        Application.builder()
+        .token(Config.BOT_TOKEN)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .concurrent_updates(ChatOrderedUpdateProcessor(
+            Config.MAX_CONCURRENT_UPDATES,
+            on_processed=cluster.processed if cluster else None,
+            recent=recent_updates,
+            profiler=profiler
+        ))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    
+    # Повторы уже обработанных обновлений отбрасываются раньше всех обработчиков
+    if recent_updates is not None:
+        application.add_handler(TypeHandler(Update, instrumented(skip_processed)), group=-3)
+    
+    # Кластер: в группе -2 принятые обновления уходят в inbox узла-владельца чата
+    if cluster:
+        application.add_handler(TypeHandler(Update, instrumented(cluster_ingest)), group=-2)
+    
+    # Контроль допуска в группе -1: отклоненные сообщения не доходят до БД и Telegram
+    application.add_handler(MessageHandler(
+        (filters.TEXT | MEDIA_FILTER) & ~filters.COMMAND & filters.ChatType.PRIVATE,
+        instrumented(admission_control)
+    ), group=-1)
     
     # СНАЧАЛА регистрируем обработчик ответов админов (REPLY)
     # Это должно быть ПЕРВЫМ, так как имеет более специфичные фильтры
     application.add_handler(MessageHandler(
-        filters.TEXT & filters.ChatType.PRIVATE & filters.REPLY,
-        handle_admin_reply
+        (filters.TEXT | MEDIA_FILTER) & filters.ChatType.PRIVATE & filters.REPLY,
+        instrumented(handle_admin_reply)
     ))
     
     # ЗАТЕМ регистрируем обработчики команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("rules", rules_command))
-    application.add_handler(CommandHandler("stats", stats_command))
-    application.add_handler(CommandHandler("pending", pending_command))
+    application.add_handler(CommandHandler("start", instrumented(start)))
+    application.add_handler(CommandHandler("help", instrumented(help_command)))
+    application.add_handler(CommandHandler("rules", instrumented(rules_command)))
+    application.add_handler(CommandHandler("myquestions", instrumented(myquestions_command)))
+    application.add_handler(CommandHandler("stats", instrumented(stats_command)))
+    application.add_handler(CommandHandler("pending", instrumented(pending_command)))
+    application.add_handler(CommandHandler("search", instrumented(search_command)))
+    application.add_handler(CommandHandler("export", instrumented(export_command)))
+    application.add_handler(CommandHandler("profile", instrumented(profile_command)))
+    application.add_handler(MessageHandler(
+        filters.Regex(r'^/q(\d+)(@\w+)?$') & filters.ChatType.PRIVATE,
+        instrumented(open_question_command)
+    ))
     
-    # Регистрируем обработчик inline-кнопок
-    application.add_handler(CallbackQueryHandler(button_callback))
+    # Регистрируем обработчики inline-кнопок: листание истории доступно пользователям, остальное — админам
+    application.add_handler(CallbackQueryHandler(instrumented(history_callback), pattern=r'^history_'))
+    application.add_handler(CallbackQueryHandler(instrumented(button_callback)))
     
-    # ПОСЛЕДНИМ регистрируем общий обработчик текстовых сообщений
+    # ПОСЛЕДНИМ регистрируем общий обработчик текстовых сообщений и вложений
     # Он должен быть ПОСЛЕДНИМ, так как перехватывает все остальное
     application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE,
-        handle_message
+        (filters.TEXT | MEDIA_FILTER) & ~filters.COMMAND & filters.ChatType.PRIVATE,
+        instrumented(handle_message)
     ))
     
     # Обработчик ошибок
     application.add_error_handler(error_handler)
     
+    # Фоновые задачи
+    application.job_queue.run_repeating(
+        leader_only(reconcile_stats_job),
+        interval=Config.STATS_RECONCILE_INTERVAL,
+        first=Config.STATS_RECONCILE_INTERVAL
+    )
+    if router.assigns:
+        application.job_queue.run_repeating(
+            leader_only(reassign_overdue_job),
+            interval=min(60, Config.ASSIGNMENT_TIMEOUT / 4),
+            first=60
+        )
+    if db.spool:
+        # Журнал у каждого узла свой, поэтому переносит его каждый узел, а не только лидер
+        application.job_queue.run_repeating(
+            replay_spool_job,
+            interval=Config.SPOOL_REPLAY_INTERVAL,
+            first=Config.SPOOL_REPLAY_INTERVAL
+        )
+    if warm_state:
+        # Снимок у каждого узла свой
+        application.job_queue.run_repeating(
+            save_state_job,
+            interval=Config.STATE_SAVE_INTERVAL,
+            first=Config.STATE_SAVE_INTERVAL
+        )
+    if Config.RETENTION_DAYS > 0:
+        application.job_queue.run_repeating(
+            leader_only(retention_job),
+            interval=Config.RETENTION_INTERVAL,
+            first=60
+        )
+    
+    return application
+
+def install_stop_signals(application: Application):
+    """
+    Остановка по SIGINT/SIGTERM: новые обновления больше не принимаются, а начатые
+    дорабатываются не дольше SHUTDOWN_TIMEOUT сек (повторный сигнал прерывает их сразу).
+    Затем останавливается доставка и записывается снимок состояния.
+    """
+    stopping = False
+
+    def on_signal():
+        nonlocal stopping
+        if not application.running:
+            # Бот еще запускается: останавливаемся так же, как это делает PTB
+            raise SystemExit
+        processor = application.update_processor
+        if stopping:
+            logger.warning("🛑 Повторный сигнал: начатые обновления прерываются")
+            processor.cancel_after(0)
+            return
+        stopping = True
+        logger.info(
+            f"🛑 Остановка: дорабатываем начатые обновления ({processor.inflight}), "
+            f"не дольше {Config.SHUTDOWN_TIMEOUT:g} с"
+        )
+        processor.cancel_after(Config.SHUTDOWN_TIMEOUT)
+        application.stop_running()
+
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        loop.add_signal_handler(sig, on_signal)
+
+def main():
+    """Запуск бота"""
+    if cluster and (Config.BOT_MODE != 'webhook' or not Config.WEBHOOK_SECRET):
+        # Каждый узел вызывает setWebhook: секрет должен быть общим, а polling — только у одного процесса
+        logger.error("❌ Кластерный режим требует BOT_MODE=webhook и общий для всех узлов WEBHOOK_SECRET")
+        return
+    
+    application = build_application()
+    install_stop_signals(application)
+    
     # Запуск бота
     logger.info("🤖 Бот запускается...")
     logger.info(f"👥 Администраторов: {len(Config.ADMIN_IDS)}")
     logger.info("✅ Бот готов к работе!")
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if Config.BOT_MODE == 'webhook':
+        secret_token = Config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        logger.info(f"🌐 Режим webhook: {Config.WEBHOOK_URL}/{Config.WEBHOOK_PATH}")
+        application.run_webhook(
+            listen=Config.WEBHOOK_LISTEN,
+            port=Config.PORT,
+            url_path=Config.WEBHOOK_PATH,
+            webhook_url=f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.WEBHOOK_PATH}",
+            secret_token=secret_token,
+            allowed_updates=ALLOWED_UPDATES,
+            stop_signals=None
+        )
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES, stop_signals=None)
 
 if __name__ == '__main__':
     main()
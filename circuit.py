@@ -0,0 +1,74 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Значения для метрики состояния
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitBreaker:
+    """
+    Автомат защиты для зависимости, которая может стать недоступной (БД).
+
+    После failure_threshold отказов подряд автомат размыкается: вызовы сразу
+    отклоняются, не дожидаясь таймаута соединения. Через reset_timeout секунд
+    пропускается один пробный вызов (half-open): успех замыкает автомат,
+    отказ размыкает его снова, а отмененный пробный вызов освобождает место
+    для следующего. Работает в потоке event loop, без блокировок.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def rejecting(self) -> bool:
+        """allow() сейчас отклонит вызов"""
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at < self.reset_timeout
+        return self.state == HALF_OPEN and self._probing
+
+    def allow(self) -> bool:
+        """Можно ли выполнить вызов; каждый разрешенный вызов завершается success() или failure()"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self._probing = False
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        if self.state != CLOSED:
+            self.state = CLOSED
+            self._probing = False
+            logger.info(f"✅ {self.name}: доступна снова, автомат замкнут")
+
+    def cancelled(self):
+        """Разрешенный вызов отменен до результата: о БД он ничего не говорит, но пробный вызов нужно отпустить"""
+        if self.state == HALF_OPEN:
+            self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self._probing = False
+            logger.warning(
+                f"⚡ {self.name}: {self.failures} отказов подряд, вызовы отклоняются {self.reset_timeout:g} с"
+            )
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from telegram import Update
+
+from updates import chat_key
+
+logger = logging.getLogger(__name__)
+
+class ClusterCoordinator:
+    """
+    Координация нескольких экземпляров бота (узлов) на общей БД.
+
+    Балансировщик отдает обновление любому узлу, а тот только записывает его
+    в общий inbox. Обновления чата попадают в слот chat_id % slots, и обрабатывает
+    их узел-владелец слота: забирает из inbox по возрастанию update_id и передает
+    в свой ChatOrderedUpdateProcessor. Поэтому порядок внутри чата сохраняется
+    и между узлами, а состояние по пользователю (лимит частоты, кнопки /search)
+    живет на одном узле.
+
+    Слоты арендуются на lease_seconds и продлеваются каждые lease_seconds / 3.
+    Узел держит справедливую долю ceil(slots / узлов): лишние слоты отдает, когда
+    в них нет обновлений в обработке, а слоты упавшего узла другие забирают после
+    истечения аренды. Из inbox обновление удаляется только после обработки,
+    так что при падении узла его подхватит новый владелец (хотя бы один раз).
+
+    События (новый вопрос, ответ, сверка статистики, архив) рассылаются через
+    LISTEN/NOTIFY (в SQLite — журнал cluster_events); обработчики регистрируются
+    через on(). Лидер — владелец слота 0: только он выполняет периодические задачи.
+    """
+
+    def __init__(self, db, node_id: str = '', slots: int = 64, lease_seconds: float = 15.0,
+                 max_inflight: int = 128, poll_interval: float = 1.0,
+                 on_resize: Optional[Callable[[int], None]] = None):
+        if not db.supports_cluster:
+            raise ValueError("Кластерный режим требует PostgreSQL или файла SQLite в DATABASE_URL")
+        self.db = db
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.slots = slots
+        self.lease_seconds = lease_seconds
+        self.max_inflight = max_inflight
+        self.poll_interval = poll_interval
+        self.on_resize = on_resize
+        self.owned: Set[int] = set()
+        self.nodes = 1
+        self._lease_deadline = 0.0
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+        # update_id -> (обновление из inbox, слот): до удаления из inbox, а не только до конца обработки,
+        # иначе выборка, начатая до удаления, вернула бы обработанное обновление еще раз
+        self._inflight: Dict[int, Tuple[Update, int]] = {}
+        self._processed: List[int] = []
+        self._application = None
+        self._pump_wakeup = asyncio.Event()
+        self._heartbeat_wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    @property
+    def is_leader(self) -> bool:
+        return 0 in self.owned and time.monotonic() < self._lease_deadline
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def on(self, event_type: str, handler: Callable[[Dict[str, Any]], None]):
+        """
+        Обработчик событий event_type от других узлов. Событие "reset" приходит,
+        когда события могли потеряться (переподключение): кэши нужно сбросить целиком.
+        """
+        self._handlers[event_type] = handler
+
+    def slot_of(self, update: object) -> int:
+        key = chat_key(update)
+        return key % self.slots if key is not None else 0
+
+    def is_replay(self, update: object) -> bool:
+        """Обновление забрано из inbox этим узлом (а не только что принято по webhook)"""
+        entry = self._inflight.get(getattr(update, 'update_id', None))
+        return entry is not None and entry[0] is update
+
+    async def ingest(self, update: Update) -> bool:
+        """Записать принятое обновление в inbox; False — записать не удалось"""
+        slot = self.slot_of(update)
+        stored = await self.db.put_inbox(update.update_id, slot, update.to_json())
+        if stored is None:
+            return False
+        # Повтор от Telegram (stored=False) уже лежит в inbox или обработан
+        if stored:
+            if slot in self.owned:
+                self._pump_wakeup.set()
+            else:
+                await self.publish("inbox", slot=slot)
+        return True
+
+    def processed(self, update: object):
+        """Хук ChatOrderedUpdateProcessor: обновление из inbox обработано и может быть удалено"""
+        if self.is_replay(update):
+            self._processed.append(update.update_id)
+            self._pump_wakeup.set()
+
+    async def publish(self, event_type: str, **data):
+        """Разослать событие другим узлам"""
+        # ensure_ascii=False: кириллица вдвое короче, а NOTIFY ограничен 8000 байт
+        await self.db.publish(json.dumps({"type": event_type, "node": self.node_id, **data}, ensure_ascii=False))
+
+    def _on_event(self, payload: Optional[str]):
+        if payload is None:
+            self._dispatch("reset", {})
+            self._pump_wakeup.set()
+            self._heartbeat_wakeup.set()
+            return
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning(f"⚠️ Непонятное событие кластера: {payload[:100]}")
+            return
+        if event.get("node") == self.node_id:
+            return
+        event_type = event.get("type")
+        if event_type == "inbox":
+            if event.get("slot") in self.owned:
+                self._pump_wakeup.set()
+        elif event_type == "rebalance":
+            self._heartbeat_wakeup.set()
+        else:
+            self._dispatch(event_type, event)
+
+    def _dispatch(self, event_type: str, event: Dict[str, Any]):
+        handler = self._handlers.get(event_type)
+        if handler is None:
+            return
+        try:
+            handler(event)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки события кластера {event_type}: {e}", exc_info=True)
+
+    # --- Запуск и остановка ---
+
+    async def start(self, application):
+        """Подписаться на события, занять слоты и запустить фоновые задачи узла"""
+        self._application = application
+        self._stopping = False
+        await self.db.listen(self._on_event)
+        await self._heartbeat()
+        # Остальные узлы сразу отдадут лишние слоты, не дожидаясь своего продления аренды
+        await self.publish("rebalance")
+        self._tasks = [
+            asyncio.create_task(self._heartbeat_loop()),
+            asyncio.create_task(self._pump_loop()),
+        ]
+        logger.info(f"🕸 Узел {self.node_id} в кластере: слотов {len(self.owned)}/{self.slots}, узлов {self.nodes}")
+
+    async def stop(self):
+        """
+        Выйти из кластера и отдать слоты. Вызывается после остановки Application:
+        все переданные в обработку обновления уже обработаны, а необработанные
+        остаются в inbox для нового владельца слота.
+        """
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._pump_wakeup.set()
+        self._heartbeat_wakeup.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.owned = set()
+        await self._delete_processed()
+        await self.db.release_slots(self.node_id, [], leave=True)
+        await self.publish("rebalance")
+        await self.db.unlisten()
+        logger.info(f"🕸 Узел {self.node_id} вышел из кластера")
+
+    # --- Аренда слотов ---
+
+    async def _heartbeat_loop(self):
+        while not self._stopping:
+            self._heartbeat_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._heartbeat_wakeup.wait(), timeout=self.lease_seconds / 3)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                break
+            try:
+                await self._heartbeat()
+            except Exception as e:
+                logger.error(f"❌ Ошибка продления аренды слотов: {e}", exc_info=True)
+
+    async def _heartbeat(self):
+        started = time.monotonic()
+        result = await self.db.cluster_heartbeat(self.node_id, self.slots, self.lease_seconds)
+        if result is None:
+            # Аренда истечет сама: после _lease_deadline узел перестает забирать обновления
+            return
+        # Локальный срок на треть короче: узел перестает забирать обновления раньше,
+        # чем другие узлы увидят его слоты свободными
+        self._lease_deadline = started + self.lease_seconds * 2 / 3
+        owned = set(result["owned"])
+        nodes = result["nodes"]
+        fair = -(-self.slots // max(nodes, 1))
+        if len(owned) > fair:
+            busy = {slot for _, slot in self._inflight.values()}
+            extra = [slot for slot in sorted(owned, reverse=True) if slot not in busy][:len(owned) - fair]
+            if extra:
+                # Сначала перестаем забирать обновления этих слотов, потом отдаем их
+                owned.difference_update(extra)
+                self.owned = owned
+                await self.db.release_slots(self.node_id, extra)
+                await self.publish("rebalance")
+        if owned - self.owned:
+            self._pump_wakeup.set()
+        self.owned = owned
+        if nodes != self.nodes:
+            logger.info(f"🕸 Узлов в кластере: {nodes}, слотов у {self.node_id}: {len(owned)}")
+            self.nodes = nodes
+            if self.on_resize:
+                self.on_resize(nodes)
+
+    # --- Inbox ---
+
+    async def _pump_loop(self):
+        while not self._stopping:
+            # Сбрасываем флаг до выборки: пробуждение во время запроса не потеряется
+            self._pump_wakeup.clear()
+            try:
+                await self._delete_processed()
+                if await self._pump():
+                    continue
+            except Exception as e:
+                logger.error(f"❌ Ошибка выборки обновлений из inbox: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._pump_wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _delete_processed(self):
+        if not self._processed:
+            return
+        done, self._processed = self._processed, []
+        if await self.db.delete_inbox(done) is None:
+            # Повторим в следующий раз; до тех пор обновления остаются в _inflight
+            self._processed.extend(done)
+            return
+        for update_id in done:
+            self._inflight.pop(update_id, None)
+
+    async def _pump(self) -> bool:
+        """Передать в обработку обновления своих слотов; True — в inbox могли остаться еще"""
+        room = self.max_inflight - len(self._inflight)
+        if (room <= 0 or not self.owned or time.monotonic() >= self._lease_deadline
+                or not self._application.running):
+            return False
+        rows = await self.db.get_inbox(sorted(self.owned), list(self._inflight), room)
+        bot = self._application.bot
+        for update_id, slot, payload in rows:
+            # Пока шел запрос, слот могли отдать, а обновление — уже забрать
+            if slot not in self.owned or update_id in self._inflight:
+                continue
+            update = Update.de_json(json.loads(payload), bot)
+            self._inflight[update_id] = (update, slot)
+            self._application.update_queue.put_nowait(update)
+        return len(rows) == room
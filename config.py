@@ -3,6 +3,19 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+def parse_admin_weights(value: str) -> dict:
+    """Веса админов из строки "id:вес,id:вес"; вес должен быть положительным (на него делится нагрузка)"""
+    weights = {}
+    for item in value.split(','):
+        if ':' not in item:
+            continue
+        admin_id, weight = item.split(':', 1)
+        admin_id, weight = int(admin_id.strip()), float(weight)
+        if not weight > 0:
+            raise ValueError(f"ADMIN_WEIGHTS: вес админа {admin_id} должен быть больше нуля, указано {weight:g}")
+        weights[admin_id] = weight
+    return weights
+
 class Config:
     # Токен бота (получите у @BotFather)
     BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -15,3 +28,139 @@ class Config:
     
     # ID канала (если нужно, например: -1001234567890)
     CHANNEL_ID = os.getenv('CHANNEL_ID', '')
+    
+    # Пул соединений с БД
+    DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+    
+    # Как давно должно простаивать соединение, чтобы перед выдачей проверить его SELECT 1 (сек)
+    DB_HEALTHCHECK_INTERVAL = float(os.getenv('DB_HEALTHCHECK_INTERVAL', '30'))
+    
+    # Недоступная БД: таймаут подключения к PostgreSQL (сек); после DB_BREAKER_THRESHOLD отказов
+    # подряд запросы отклоняются сразу, а через DB_BREAKER_RESET сек пробуется один запрос
+    DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '5'))
+    DB_BREAKER_THRESHOLD = int(os.getenv('DB_BREAKER_THRESHOLD', '5'))
+    DB_BREAKER_RESET = float(os.getenv('DB_BREAKER_RESET', '10'))
+    
+    # Локальный журнал вопросов, принятых при недоступной БД (пусто — не вести), период
+    # попыток переноса в БД (сек) и сколько вопросов переносить одной транзакцией
+    SPOOL_PATH = os.getenv('SPOOL_PATH', 'question_spool.jsonl')
+    SPOOL_REPLAY_INTERVAL = float(os.getenv('SPOOL_REPLAY_INTERVAL', '5'))
+    SPOOL_REPLAY_BATCH = int(os.getenv('SPOOL_REPLAY_BATCH', '500'))
+    
+    # Сколько соответствий "сообщение у админа -> вопрос" держать в памяти
+    REPLY_CACHE_SIZE = int(os.getenv('REPLY_CACHE_SIZE', '10000'))
+    
+    # Лимиты исходящих сообщений Telegram: всего в секунду, в один чат в секунду и запас на всплеск
+    TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', '30'))
+    TG_CHAT_RATE = float(os.getenv('TG_CHAT_RATE', '1'))
+    TG_CHAT_BURST = float(os.getenv('TG_CHAT_BURST', '3'))
+    
+    # Сколько раз повторять отправку при временных ошибках и RetryAfter
+    TG_MAX_RETRIES = int(os.getenv('TG_MAX_RETRIES', '3'))
+    
+    # Статистика: время жизни кэша в памяти и период сверки счетчиков с таблицей (сек)
+    STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '2'))
+    STATS_RECONCILE_INTERVAL = float(os.getenv('STATS_RECONCILE_INTERVAL', '3600'))
+    
+    # История вопросов пользователя (/myquestions): сколько секунд держать страницы в памяти
+    HISTORY_CACHE_TTL = float(os.getenv('HISTORY_CACHE_TTL', '30'))
+    
+    # Режим получения обновлений: polling или webhook
+    BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+    
+    # Настройки webhook (публичный адрес, путь, секрет и адрес встроенного сервера)
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    PORT = int(os.getenv('PORT', '8443'))
+    
+    # Сколько обновлений обрабатывать одновременно (порядок внутри чата сохраняется)
+    MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+    
+    # Остановка по SIGTERM/SIGINT: сколько секунд ждать начатые обновления и фоновые задачи
+    # обработчиков (альбомы, /export, публикации в кластер), прежде чем прервать их
+    SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '20'))
+    
+    # Теплый перезапуск: файл снимка состояния в памяти (пусто — не сохранять), период
+    # сохранения и возраст, после которого снимок не загружается (сек)
+    STATE_PATH = os.getenv('STATE_PATH', 'bot_state.json')
+    STATE_SAVE_INTERVAL = float(os.getenv('STATE_SAVE_INTERVAL', '30'))
+    STATE_MAX_AGE = float(os.getenv('STATE_MAX_AGE', '600'))
+    
+    # Outbox: размер пачки доставок, период опроса очереди (сек) и число попыток доставки
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '50'))
+    OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+    
+    # Маршрутизация вопросов: broadcast (всем админам), round_robin, least_loaded или weighted
+    ROUTING_MODE = os.getenv('ROUTING_MODE', 'broadcast').lower()
+    
+    # Веса админов для режима weighted (через запятую: "id:вес")
+    ADMIN_WEIGHTS = parse_admin_weights(os.getenv('ADMIN_WEIGHTS', ''))
+    
+    # Через сколько секунд невзятый и неотвеченный вопрос передается другому админу
+    ASSIGNMENT_TIMEOUT = float(os.getenv('ASSIGNMENT_TIMEOUT', '3600'))
+    
+    # Режим дайджеста: с какой частоты вопросов в минуту он включается (0 — никогда)
+    # и сколько секунд копить вопросы перед отправкой сводки
+    DIGEST_THRESHOLD = float(os.getenv('DIGEST_THRESHOLD', '0'))
+    DIGEST_WINDOW = float(os.getenv('DIGEST_WINDOW', '10'))
+    
+    # Лимит вопросов от одного пользователя: в минуту, запас на всплеск и пауза после превышения (сек)
+    USER_RATE_PER_MINUTE = float(os.getenv('USER_RATE_PER_MINUTE', '5'))
+    USER_BURST = float(os.getenv('USER_BURST', '3'))
+    USER_COOLDOWN = float(os.getenv('USER_COOLDOWN', '60'))
+    RATE_LIMITER_MAX_USERS = int(os.getenv('RATE_LIMITER_MAX_USERS', '100000'))
+    
+    # Сброс нагрузки: при какой длине очереди исходящих сообщений / запросов к БД отклонять новые вопросы
+    MAX_OUTBOUND_QUEUE = int(os.getenv('MAX_OUTBOUND_QUEUE', '1000'))
+    MAX_DB_QUEUE = int(os.getenv('MAX_DB_QUEUE', '200'))
+    
+    # Поиск повторов: сколько недавних вопросов держать в окне, как долго (сек)
+    # и с какой оценкой сходства (0..1) вопрос считается похожим
+    DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', '20000'))
+    DEDUP_TTL = float(os.getenv('DEDUP_TTL', '86400'))
+    DEDUP_SIMILARITY = float(os.getenv('DEDUP_SIMILARITY', '0.7'))
+    
+    # Метрики в формате Prometheus: адрес HTTP-эндпоинта /metrics (порт 0 — выключено)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+    
+    # Медленные обновления: порог в мс (0 — не отслеживать), после которого обновление пишется
+    # в лог с разбивкой по этапам, и сколько последних таких обновлений держать для отчета /profile
+    SLOW_UPDATE_MS = float(os.getenv('SLOW_UPDATE_MS', '1000'))
+    SLOW_UPDATES_KEPT = int(os.getenv('SLOW_UPDATES_KEPT', '100'))
+    
+    # Выгрузка /export: строк в пачке из БД и сколько байт файла держать в памяти до сброса на диск
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+    EXPORT_SPOOL_SIZE = int(os.getenv('EXPORT_SPOOL_SIZE', str(8 * 1024 * 1024)))
+    
+    # Хранение: через сколько дней отвеченные вопросы уходят из рабочей таблицы (0 — никогда);
+    # archive — переносятся в архив, delete — удаляются; сколько дней хранить архив (0 — всегда)
+    RETENTION_DAYS = float(os.getenv('RETENTION_DAYS', '0'))
+    RETENTION_MODE = os.getenv('RETENTION_MODE', 'archive').lower()
+    ARCHIVE_RETENTION_DAYS = float(os.getenv('ARCHIVE_RETENTION_DAYS', '0'))
+    RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', '3600'))
+    RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '1000'))
+    
+    # Кластер: несколько экземпляров бота за одним webhook на общей БД (PostgreSQL или файл SQLite).
+    # Обновления чата обрабатывает узел-владелец его слота; аренда слотов продлевается каждые CLUSTER_LEASE/3 сек
+    CLUSTER_ENABLED = os.getenv('CLUSTER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    CLUSTER_SLOTS = int(os.getenv('CLUSTER_SLOTS', '64'))
+    CLUSTER_LEASE = float(os.getenv('CLUSTER_LEASE', '15'))
+    # Имя узла (по умолчанию — имя хоста и PID)
+    NODE_ID = os.getenv('NODE_ID', '')
+    
+    # Альбомы: элементы приходят отдельными сообщениями; альбом считается собранным,
+    # когда новых элементов нет MEDIA_GROUP_WINDOW сек
+    MEDIA_GROUP_WINDOW = float(os.getenv('MEDIA_GROUP_WINDOW', '1.0'))
+    
+    # Логи: уровень, формат (json — одна строка JSON с полями update_id, question_id, elapsed_ms; text),
+    # доля сохраняемых INFO-записей обработки обновлений (предупреждения и ошибки пишутся всегда)
+    # и размер очереди фонового потока записи (при переполнении записи отбрасываются)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
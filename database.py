@@ -1,19 +1,149 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import asyncio
+import functools
 import logging
-from typing import Optional, Dict, Any
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Callable, List, Tuple, Union
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+from storage import SEARCH_RANK_WINDOW, Storage, admin_message_rows
 
 logger = logging.getLogger(__name__)
 
-class Database:
-    def __init__(self, connection_string: str):
+_ARCHIVE_PARTITION = re.compile(r'^questions_archive_(\d{4}_\d{2})$')
+
+# Канал LISTEN/NOTIFY для событий кластера
+EVENTS_CHANNEL = 'bot_events'
+
+class Database(Storage):
+    """Хранилище в PostgreSQL: пул соединений и пул потоков того же размера"""
+
+    def __init__(self, connection_string: str, min_size: int = 2, max_size: int = 10,
+                 healthcheck_interval: float = 30.0, reply_cache_size: int = 10000,
+                 stats_cache_ttl: float = 2.0, connect_timeout: int = 5,
+                 breaker_threshold: int = 5, breaker_reset_timeout: float = 10.0,
+                 history_cache_ttl: float = 30.0):
+        super().__init__(reply_cache_size=reply_cache_size, stats_cache_ttl=stats_cache_ttl,
+                         breaker_threshold=breaker_threshold, breaker_reset_timeout=breaker_reset_timeout,
+                         history_cache_ttl=history_cache_ttl)
         self.conn_string = connection_string
-        self.init_db()
-    
+        self.min_size = min_size
+        self.max_size = max_size
+        self.healthcheck_interval = healthcheck_interval
+        self.connect_timeout = connect_timeout
+        self._pool: Optional[pool.ThreadedConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        self._last_used: Dict[int, float] = {}
+        # Потоков ровно столько, сколько соединений в пуле: запрос никогда
+        # не упрется в PoolError, а лишние запросы подождут в очереди executor'а
+        self._executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix='db')
+        self._listen_task: Optional[asyncio.Task] = None
+
+    @property
+    def supports_cluster(self) -> bool:
+        return True
+
+    @property
+    def supports_spool(self) -> bool:
+        return True
+
+    def _is_outage(self, error: Exception) -> bool:
+        # Соединение оборвалось, не открылось за connect_timeout или пул исчерпан
+        return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError))
+
+    async def connect(self):
+        """Открыть пул соединений (с прогревом) и создать таблицы"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._open_pool)
+        await loop.run_in_executor(self._executor, self.init_db)
+
+    async def close(self):
+        """Закрыть пул соединений"""
+        await self.unlisten()
+        self._executor.shutdown(wait=True)
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+        logger.info("🔌 Пул соединений с БД закрыт")
+
+    def _open_pool(self) -> pool.ThreadedConnectionPool:
+        """Создать пул; ThreadedConnectionPool сразу открывает min_size соединений"""
+        with self._pool_lock:
+            if self._pool is None:
+                # sslmode из строки подключения имеет приоритет (например, локальная БД без SSL)
+                ssl = {} if 'sslmode' in self.conn_string else {'sslmode': 'require'}
+                # Недоступная БД не должна задерживать запрос на системный таймаут TCP
+                timeout = {} if 'connect_timeout' in self.conn_string else {'connect_timeout': self.connect_timeout}
+                self._pool = pool.ThreadedConnectionPool(
+                    self.min_size, self.max_size, self.conn_string, **ssl, **timeout
+                )
+                logger.info(f"✅ Пул соединений с БД открыт ({self.min_size}-{self.max_size})")
+            return self._pool
+
+    def _is_healthy(self, conn) -> bool:
+        """Проверить соединение, если оно долго простаивало"""
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
     def get_connection(self):
-        """Получить соединение с базой данных"""
-        return psycopg2.connect(self.conn_string, sslmode='require')
-    
+        """Взять проверенное соединение из пула и вернуть его обратно"""
+        db_pool = self._pool or self._open_pool()
+        conn = db_pool.getconn()
+        while not self._is_healthy(conn):
+            logger.warning("⚠️ Соединение с БД неисправно, переподключаемся")
+            self._last_used.pop(id(conn), None)
+            db_pool.putconn(conn, close=True)
+            conn = db_pool.getconn()
+
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if broken or conn.closed:
+                self._last_used.pop(id(conn), None)
+                db_pool.putconn(conn, close=True)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                db_pool.putconn(conn)
+
+    def _execute(self, func: Callable, *args):
+        """Выполнить синхронную функцию func(conn, *args) в одной транзакции"""
+        with self.get_connection() as conn:
+            return func(conn, *args)
+
+    async def _submit(self, func: Callable, *args):
+        """Выполнить запрос в пуле потоков, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self._execute, func, *args)
+        )
+
     def init_db(self):
         """Создание таблиц в базе данных"""
         commands = (
@@ -30,124 +160,796 @@ class Database:
                 is_answered BOOLEAN DEFAULT FALSE
             )
             """,
+            """
+            CREATE TABLE IF NOT EXISTS admin_messages (
+                admin_chat_id BIGINT NOT NULL,
+                admin_message_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+                PRIMARY KEY (admin_chat_id, admin_message_id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_admin_messages_question ON admin_messages (question_id)",
+            # Счетчики ведутся в тех же транзакциях, что и изменения вопросов
+            """
+            CREATE TABLE IF NOT EXISTS question_stats (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                total BIGINT NOT NULL,
+                answered BIGINT NOT NULL
+            )
+            """,
+            """
+            INSERT INTO question_stats (id, total, answered)
+            SELECT TRUE, COUNT(*), COUNT(*) FILTER (WHERE is_answered = TRUE) FROM questions
+            ON CONFLICT (id) DO NOTHING
+            """,
+            # Частичный индекс только по неотвеченным: очередь листается по нему без сортировки
+            """
+            CREATE INDEX IF NOT EXISTS idx_questions_pending
+            ON questions (asked_at DESC, id DESC) WHERE is_answered = FALSE
+            """,
+            # Outbox: доставки вопросов админам, записываются в одной транзакции с вопросом
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id BIGSERIAL PRIMARY KEY,
+                question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+                chat_id BIGINT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                last_error TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_outbox_next_attempt ON outbox (next_attempt_at, id)",
+            # Назначение вопроса одному админу (режимы маршрутизации кроме broadcast)
+            "ALTER TABLE questions ADD COLUMN IF NOT EXISTS assigned_admin_id BIGINT",
+            "ALTER TABLE questions ADD COLUMN IF NOT EXISTS assigned_at TIMESTAMP",
+            "ALTER TABLE questions ADD COLUMN IF NOT EXISTS claimed BOOLEAN NOT NULL DEFAULT FALSE",
+            # Похожий недавний вопрос другого пользователя (пометка для админов)
+            "ALTER TABLE questions ADD COLUMN IF NOT EXISTS duplicate_of INTEGER",
+            """
+            CREATE INDEX IF NOT EXISTS idx_questions_assigned
+            ON questions (assigned_admin_id, assigned_at) WHERE is_answered = FALSE
+            """,
+            # Хранение: старые отвеченные вопросы уходят из рабочей таблицы в архив,
+            # секционированный по месяцам asked_at; счетчик archived учитывает их в сверке статистики
+            "ALTER TABLE question_stats ADD COLUMN IF NOT EXISTS archived BIGINT NOT NULL DEFAULT 0",
+            """
+            CREATE INDEX IF NOT EXISTS idx_questions_answered
+            ON questions (asked_at) WHERE is_answered = TRUE
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS questions_archive (
+                id INTEGER NOT NULL,
+                user_id BIGINT NOT NULL,
+                message_id INTEGER,
+                question_text TEXT NOT NULL,
+                answer_text TEXT,
+                asked_at TIMESTAMP NOT NULL,
+                answered_at TIMESTAMP,
+                duplicate_of INTEGER,
+                PRIMARY KEY (id, asked_at)
+            ) PARTITION BY RANGE (asked_at)
+            """,
+            # Полнотекстовый поиск: вектор хранится в строке и пересчитывается при записи
+            # (вопрос — вес A, ответ — вес B); GIN-индекс находит совпадения без сканирования
+            """
+            ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('russian', question_text), 'A') ||
+                setweight(to_tsvector('russian', coalesce(answer_text, '')), 'B')
+            ) STORED
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_questions_search ON questions USING GIN (search_vector)",
+            """
+            ALTER TABLE questions_archive ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('russian', question_text), 'A') ||
+                setweight(to_tsvector('russian', coalesce(answer_text, '')), 'B')
+            ) STORED
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_questions_archive_search ON questions_archive USING GIN (search_vector)",
+            # Кластер: живые узлы, аренда слотов (слот = ID чата по модулю числа слотов)
+            # и общий inbox принятых по webhook обновлений, которые обрабатывает владелец слота
+            """
+            CREATE TABLE IF NOT EXISTS cluster_nodes (
+                node_id TEXT PRIMARY KEY,
+                heartbeat_at TIMESTAMP NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS cluster_slots (
+                slot INTEGER PRIMARY KEY,
+                owner TEXT,
+                lease_until TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS inbox (
+                update_id BIGINT PRIMARY KEY,
+                slot INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # Вложения: вид ('photo', ..., 'album') и file_id для повторной отправки без загрузки;
+            # колонки родителя questions_archive появляются и во всех его секциях
+            "ALTER TABLE questions ADD COLUMN IF NOT EXISTS media_type TEXT",
+            "ALTER TABLE questions ADD COLUMN IF NOT EXISTS media JSONB",
+            "ALTER TABLE questions_archive ADD COLUMN IF NOT EXISTS media_type TEXT",
+            "ALTER TABLE questions_archive ADD COLUMN IF NOT EXISTS media JSONB",
+            "ALTER TABLE question_stats ADD COLUMN IF NOT EXISTS media BIGINT NOT NULL DEFAULT 0",
+            # Сколько из ушедших из рабочей таблицы вопросов было с вложениями (для сверки media)
+            "ALTER TABLE question_stats ADD COLUMN IF NOT EXISTS archived_media BIGINT NOT NULL DEFAULT 0",
+            # Карточка вопроса (ее правят после ответа) или копия вложения
+            "ALTER TABLE admin_messages ADD COLUMN IF NOT EXISTS is_card BOOLEAN NOT NULL DEFAULT TRUE",
+            # Ключ записи локального журнала: повторный перенос того же вопроса не создаст дубль.
+            # В частичный индекс попадают только перенесенные из журнала вопросы
+            "ALTER TABLE questions ADD COLUMN IF NOT EXISTS spool_key TEXT",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_spool_key ON questions (spool_key) WHERE spool_key IS NOT NULL",
+            # История вопросов пользователя (/myquestions): страница выбирается index-only scan
+            "CREATE INDEX IF NOT EXISTS idx_questions_user ON questions (user_id, asked_at DESC, id DESC)",
+            # Ответ reply на копию, отправленную до таблицы admin_messages, ищется по старой колонке;
+            # в индекс попадают только такие вопросы
+            # Копии вложений, уже отправленные при неудачной попытке доставки: повтор шлет только карточку
+            "ALTER TABLE outbox ADD COLUMN IF NOT EXISTS sent_message_ids INTEGER[] NOT NULL DEFAULT '{}'",
+            """
+            CREATE INDEX IF NOT EXISTS idx_questions_admin_message
+            ON questions (admin_message_id) WHERE admin_message_id IS NOT NULL
+            """,
         )
-        
+
         try:
-            conn = self.get_connection()
-            cur = conn.cursor()
-            for command in commands:
-                cur.execute(command)
-            conn.commit()
-            cur.close()
-            conn.close()
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    for command in commands:
+                        cur.execute(command)
             logger.info("✅ База данных инициализирована успешно")
         except Exception as e:
             logger.error(f"❌ Ошибка инициализации БД: {e}")
-    
-    def save_question(self, user_id: int, message_id: int, question_text: str) -> Optional[int]:
-        """Сохранить вопрос от пользователя"""
-        try:
-            conn = self.get_connection()
-            cur = conn.cursor()
+
+    def _save_question(self, conn, user_id: int, message_id: int, question_text: str,
+                       recipients: List[int], assigned_admin_id: Optional[int], duplicate_of: Optional[int],
+                       media_type: Optional[str], media: Optional[List[Dict[str, str]]]) -> int:
+        with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO questions (user_id, message_id, question_text) VALUES (%s, %s, %s) RETURNING id",
-                (user_id, message_id, question_text)
+                "INSERT INTO questions (user_id, message_id, question_text, assigned_admin_id, assigned_at, duplicate_of, "
+                "media_type, media) "
+                "VALUES (%s, %s, %s, %s, CASE WHEN %s IS NULL THEN NULL ELSE CURRENT_TIMESTAMP END, %s, %s, %s) RETURNING id",
+                (user_id, message_id, question_text, assigned_admin_id, assigned_admin_id, duplicate_of,
+                 media_type, Json(media) if media else None)
             )
             question_id = cur.fetchone()[0]
-            conn.commit()
-            cur.close()
-            conn.close()
-            logger.info(f"✅ Вопрос сохранен с ID: {question_id}")
-            return question_id
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения вопроса: {e}")
-            return None
-    
-    def get_user_by_admin_message(self, admin_message_id: int) -> Optional[Dict[str, Any]]:
-        """Найти пользователя по ID сообщения админа"""
-        try:
-            conn = self.get_connection()
-            cur = conn.cursor(cursor_factory=RealDictCursor)
+            if media_type:
+                cur.execute("UPDATE question_stats SET total = total + 1, media = media + 1")
+            else:
+                cur.execute("UPDATE question_stats SET total = total + 1")
+            if recipients:
+                execute_values(
+                    cur,
+                    "INSERT INTO outbox (question_id, chat_id) VALUES %s",
+                    [(question_id, chat_id) for chat_id in recipients]
+                )
+        logger.debug(f"✅ Вопрос сохранен с ID: {question_id}")
+        return question_id
+
+    def _save_spooled_questions(self, conn, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            saved = execute_values(
+                cur,
+                """
+                INSERT INTO questions (user_id, message_id, question_text, asked_at, assigned_admin_id, assigned_at,
+                                       duplicate_of, media_type, media, spool_key)
+                SELECT v.user_id, v.message_id, v.question_text, v.asked_at, v.assigned_admin_id,
+                       CASE WHEN v.assigned_admin_id IS NULL THEN NULL ELSE v.asked_at END,
+                       v.duplicate_of, v.media_type, v.media, v.spool_key
+                FROM (VALUES %s) AS v(user_id, message_id, question_text, asked_at, assigned_admin_id,
+                                      duplicate_of, media_type, media, spool_key)
+                ON CONFLICT DO NOTHING
+                RETURNING id, user_id, question_text, media_type, spool_key
+                """,
+                [
+                    (record["user_id"], record["message_id"], record["question_text"], record["asked_at"],
+                     record["assigned_admin_id"], record["duplicate_of"], record["media_type"],
+                     Json(record["media"]) if record["media"] else None, record["key"])
+                    for record in records
+                ],
+                template="(%s::bigint, %s::integer, %s::text, to_timestamp(%s)::timestamp, %s::bigint, "
+                         "%s::integer, %s::text, %s::jsonb, %s::text)",
+                fetch=True
+            )
+            if not saved:
+                return []
+            recipients = {record["key"]: record["recipients"] for record in records}
+            outbox = [(row["id"], chat_id) for row in saved for chat_id in recipients[row["spool_key"]]]
+            if outbox:
+                execute_values(cur, "INSERT INTO outbox (question_id, chat_id) VALUES %s", outbox)
+            cur.execute(
+                "UPDATE question_stats SET total = total + %s, media = media + %s",
+                (len(saved), sum(1 for row in saved if row["media_type"]))
+            )
+        return [{key: row[key] for key in ("id", "user_id", "question_text", "media_type")} for row in saved]
+
+    def _get_question(self, conn, question_id: int) -> Optional[Dict[str, Any]]:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
-                "SELECT * FROM questions WHERE admin_message_id = %s",
-                (admin_message_id,)
+                "SELECT id, user_id, message_id, question_text, asked_at, is_answered, duplicate_of, media_type, media "
+                "FROM questions WHERE id = %s",
+                (question_id,)
             )
             result = cur.fetchone()
-            cur.close()
-            conn.close()
-            return dict(result) if result else None
-        except Exception as e:
-            logger.error(f"❌ Ошибка поиска пользователя: {e}")
-            return None
-    
-    def save_admin_message_id(self, question_id: int, admin_message_id: int):
-        """Сохранить ID сообщения админа"""
-        try:
-            conn = self.get_connection()
-            cur = conn.cursor()
+        return dict(result) if result else None
+
+    def _get_user_by_admin_message(self, conn, admin_chat_id: int, admin_message_id: int) -> Optional[Dict[str, Any]]:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
-                "UPDATE questions SET admin_message_id = %s WHERE id = %s",
-                (admin_message_id, question_id)
+                """
+                SELECT q.id, q.user_id, q.is_answered
+                FROM admin_messages m
+                JOIN questions q ON q.id = m.question_id
+                WHERE m.admin_chat_id = %s AND m.admin_message_id = %s
+                """,
+                (admin_chat_id, admin_message_id)
             )
-            conn.commit()
-            cur.close()
-            conn.close()
-            logger.info(f"✅ Сохранен admin_message_id {admin_message_id} для вопроса {question_id}")
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения ID админа: {e}")
-    
-    def mark_as_answered(self, question_id: int, answer_text: str):
-        """Отметить вопрос как отвеченный"""
-        try:
-            conn = self.get_connection()
-            cur = conn.cursor()
+            result = cur.fetchone()
+            if result is None:
+                # Вопросы до таблицы admin_messages: ID копии хранился в самом вопросе без ID чата
+                cur.execute(
+                    "SELECT id, user_id, is_answered FROM questions WHERE admin_message_id = %s ORDER BY id DESC LIMIT 1",
+                    (admin_message_id,)
+                )
+                result = cur.fetchone()
+        return dict(result) if result else None
+
+    def _save_admin_messages(self, conn, rows: List[Tuple[int, int, int, bool]]):
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO admin_messages (admin_chat_id, admin_message_id, question_id, is_card) VALUES %s "
+                "ON CONFLICT DO NOTHING",
+                rows
+            )
+        logger.debug(f"✅ Сохранено {len(rows)} сообщений админов")
+
+    def _get_question_cards(self, conn, question_id: int) -> List[Tuple[int, int]]:
+        with conn.cursor() as cur:
             cur.execute(
-                "UPDATE questions SET answer_text = %s, is_answered = TRUE, answered_at = CURRENT_TIMESTAMP WHERE id = %s",
+                "SELECT admin_chat_id, admin_message_id FROM admin_messages WHERE question_id = %s AND is_card",
+                (question_id,)
+            )
+            return [tuple(row) for row in cur.fetchall()]
+
+    def _claim_deliveries(self, conn, batch_size: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                WITH claimed AS (
+                    SELECT id FROM outbox
+                    WHERE next_attempt_at <= CURRENT_TIMESTAMP
+                    ORDER BY next_attempt_at, id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE outbox o
+                SET attempts = o.attempts + 1,
+                    next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                FROM claimed, questions q
+                WHERE o.id = claimed.id AND q.id = o.question_id
+                RETURNING o.id, o.question_id, o.chat_id, o.attempts, o.sent_message_ids,
+                          q.user_id, q.message_id, q.question_text, q.asked_at, q.duplicate_of,
+                          q.media_type, q.media
+                """,
+                (batch_size, lease_seconds)
+            )
+            return [dict(row) for row in cur.fetchall()]
+
+    def _complete_deliveries(self, conn, delivered: List[Dict[str, Any]]):
+        rows = admin_message_rows(delivered)
+        if rows:
+            self._save_admin_messages(conn, rows)
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM outbox WHERE id = ANY(%s)", ([item["id"] for item in delivered],))
+
+    def _reschedule_deliveries(self, conn, failed: List[Tuple[int, float, str, List[int]]]):
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                UPDATE outbox o
+                SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => v.delay),
+                    last_error = v.error,
+                    sent_message_ids = v.sent_message_ids
+                FROM (VALUES %s) AS v(id, delay, error, sent_message_ids)
+                WHERE o.id = v.id
+                """,
+                failed,
+                template="(%s::bigint, %s::double precision, %s::text, %s::integer[])"
+            )
+
+    def _drop_deliveries(self, conn, outbox_ids: List[int]):
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM outbox WHERE id = ANY(%s)", (outbox_ids,))
+
+    def _mark_as_answered(self, conn, question_id: int, answer_text: str):
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE questions SET answer_text = %s, is_answered = TRUE, answered_at = CURRENT_TIMESTAMP "
+                "WHERE id = %s AND is_answered = FALSE",
                 (answer_text, question_id)
             )
-            conn.commit()
-            cur.close()
-            conn.close()
-            logger.info(f"✅ Вопрос {question_id} отмечен как отвеченный")
-        except Exception as e:
-            logger.error(f"❌ Ошибка отметки ответа: {e}")
-    
-    def get_stats(self) -> Dict[str, int]:
-        """Получить статистику вопросов"""
-        try:
-            conn = self.get_connection()
-            cur = conn.cursor()
-            
-            cur.execute("SELECT COUNT(*) FROM questions")
-            total = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM questions WHERE is_answered = TRUE")
-            answered = cur.fetchone()[0]
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                "total": total,
-                "answered": answered,
-                "pending": total - answered
-            }
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения статистики: {e}")
-            return {"total": 0, "answered": 0, "pending": 0}
-    
-    def get_pending_questions(self):
-        """Получить все неотвеченные вопросы"""
-        try:
-            conn = self.get_connection()
-            cur = conn.cursor(cursor_factory=RealDictCursor)
+            if cur.rowcount:
+                cur.execute("UPDATE question_stats SET answered = answered + 1")
+            else:
+                # Повторный ответ: обновляем только текст, счетчики не трогаем
+                cur.execute(
+                    "UPDATE questions SET answer_text = %s WHERE id = %s",
+                    (answer_text, question_id)
+                )
+        logger.debug(f"✅ Вопрос {question_id} отмечен как отвеченный")
+
+    def _close_question(self, conn, question_id: int) -> Union[int, bool]:
+        with conn.cursor() as cur:
             cur.execute(
-                "SELECT * FROM questions WHERE is_answered = FALSE ORDER BY asked_at DESC"
+                "UPDATE questions SET is_answered = TRUE, answered_at = CURRENT_TIMESTAMP "
+                "WHERE id = %s AND is_answered = FALSE RETURNING user_id",
+                (question_id,)
             )
-            results = cur.fetchall()
-            cur.close()
-            conn.close()
-            return [dict(row) for row in results]
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения неотвеченных вопросов: {e}")
-            return []
+            row = cur.fetchone()
+            if row is None:
+                return False
+            cur.execute("UPDATE question_stats SET answered = answered + 1")
+        logger.debug(f"✅ Вопрос {question_id} закрыт без ответа")
+        return row[0]
+
+    def _get_admin_loads(self, conn) -> Dict[int, int]:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT assigned_admin_id, COUNT(*) FROM questions "
+                "WHERE is_answered = FALSE AND assigned_admin_id IS NOT NULL GROUP BY assigned_admin_id"
+            )
+            return dict(cur.fetchall())
+
+    def _claim_question(self, conn, question_id: int, admin_id: int) -> bool:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE questions
+                SET assigned_admin_id = %s, assigned_at = CURRENT_TIMESTAMP, claimed = TRUE
+                WHERE id = %s AND is_answered = FALSE
+                  AND (claimed = FALSE OR assigned_admin_id = %s)
+                """,
+                (admin_id, question_id, admin_id)
+            )
+            return cur.rowcount > 0
+
+    def _release_question(self, conn, question_id: int, admin_id: int) -> bool:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE questions
+                SET assigned_admin_id = NULL, claimed = FALSE
+                WHERE id = %s AND is_answered = FALSE AND assigned_admin_id = %s
+                """,
+                (question_id, admin_id)
+            )
+            return cur.rowcount > 0
+
+    def _get_overdue_assignments(self, conn, timeout_seconds: float, limit: int) -> List[Dict[str, Any]]:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT id, assigned_admin_id FROM questions
+                WHERE is_answered = FALSE AND claimed = FALSE
+                  AND assigned_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                ORDER BY assigned_at
+                LIMIT %s
+                """,
+                (timeout_seconds, limit)
+            )
+            return [dict(row) for row in cur.fetchall()]
+
+    def _reassign_question(self, conn, question_id: int, from_admin_id: Optional[int], to_admin_id: int) -> bool:
+        with conn.cursor() as cur:
+            # Условие на прежнего админа защищает от гонки с claim и другим переназначением
+            cur.execute(
+                """
+                UPDATE questions
+                SET assigned_admin_id = %s, assigned_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND is_answered = FALSE AND claimed = FALSE
+                  AND assigned_admin_id IS NOT DISTINCT FROM %s
+                """,
+                (to_admin_id, question_id, from_admin_id)
+            )
+            if not cur.rowcount:
+                return False
+            cur.execute(
+                "INSERT INTO outbox (question_id, chat_id) VALUES (%s, %s)",
+                (question_id, to_admin_id)
+            )
+        logger.info(f"🔀 Вопрос #{question_id} переназначен: {from_admin_id} -> {to_admin_id}")
+        return True
+
+    def _search_questions(self, conn, query: str, limit: int, offset: int,
+                          preview_length: int) -> List[Dict[str, Any]]:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # websearch_to_tsquery понимает "фразы", OR и -исключения и не падает на любом вводе.
+            # Ранжируются только SEARCH_RANK_WINDOW самых новых совпадений из каждой таблицы
+            cur.execute(
+                """
+                WITH search AS (SELECT websearch_to_tsquery('russian', %s) AS query)
+                SELECT id, asked_at, is_answered, media_type,
+                       LEFT(question_text, %s) AS preview, LEFT(answer_text, %s) AS answer_preview
+                FROM (
+                    (SELECT id, asked_at, is_answered, media_type, question_text, answer_text, search_vector
+                     FROM questions, search WHERE search_vector @@ search.query
+                     ORDER BY id DESC LIMIT %s)
+                    UNION ALL
+                    (SELECT id, asked_at, TRUE, media_type, question_text, answer_text, search_vector
+                     FROM questions_archive, search WHERE search_vector @@ search.query
+                     ORDER BY id DESC LIMIT %s)
+                ) hits, search
+                ORDER BY ts_rank_cd(hits.search_vector, search.query) DESC, id DESC
+                LIMIT %s OFFSET %s
+                """,
+                (query, preview_length, preview_length, SEARCH_RANK_WINDOW, SEARCH_RANK_WINDOW, limit, offset)
+            )
+            return [dict(row) for row in cur.fetchall()]
+
+    def _archive_questions(self, conn, age_seconds: float, keep_archive: bool, limit: int) -> int:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, media_type IS NOT NULL FROM questions
+                WHERE is_answered = TRUE AND asked_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                ORDER BY asked_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+                """,
+                (age_seconds, limit)
+            )
+            rows = cur.fetchall()
+            question_ids = [row[0] for row in rows]
+            if not question_ids:
+                return 0
+
+            if keep_archive:
+                cur.execute(
+                    "SELECT DISTINCT date_trunc('month', asked_at) FROM questions WHERE id = ANY(%s)",
+                    (question_ids,)
+                )
+                for (month,) in cur.fetchall():
+                    self._create_archive_partition(cur, month)
+                cur.execute(
+                    """
+                    WITH moved AS (
+                        DELETE FROM questions WHERE id = ANY(%s)
+                        RETURNING id, user_id, message_id, question_text, answer_text, asked_at, answered_at, duplicate_of,
+                                  media_type, media
+                    )
+                    INSERT INTO questions_archive
+                        (id, user_id, message_id, question_text, answer_text, asked_at, answered_at, duplicate_of,
+                         media_type, media)
+                    SELECT id, user_id, message_id, question_text, answer_text, asked_at, answered_at, duplicate_of,
+                           media_type, media
+                    FROM moved
+                    """,
+                    (question_ids,)
+                )
+            else:
+                # Копии у админов и доставки удаляются каскадом
+                cur.execute("DELETE FROM questions WHERE id = ANY(%s)", (question_ids,))
+            cur.execute(
+                "UPDATE question_stats SET archived = archived + %s, archived_media = archived_media + %s",
+                (len(question_ids), sum(has_media for _, has_media in rows))
+            )
+        return len(question_ids)
+
+    def _create_archive_partition(self, cur, month: datetime):
+        """
+        Секция архива за месяц. Строки в архиве не меняются: fillfactor 100 не
+        оставляет места под обновления, а низкий toast_tuple_target сжимает
+        (TOAST) уже тексты длиннее ~128 байт, а не только больше 2 КБ.
+        """
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS questions_archive_{month:%Y_%m} PARTITION OF questions_archive "
+            "FOR VALUES FROM (%s) TO (%s) WITH (fillfactor = 100, toast_tuple_target = 128)",
+            (month, next_month)
+        )
+
+    def _purge_archive(self, conn, age_seconds: float):
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT date_trunc('month', CURRENT_TIMESTAMP - make_interval(secs => %s))::timestamp",
+                (age_seconds,)
+            )
+            cutoff_month = cur.fetchone()[0]
+            cur.execute(
+                """
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = 'questions_archive'::regclass
+                """
+            )
+            # Секция удаляется целиком, когда весь ее месяц старше срока: без VACUUM и без сканирования
+            expired = []
+            for (name,) in cur.fetchall():
+                match = _ARCHIVE_PARTITION.match(name)
+                if match and datetime.strptime(match.group(1), '%Y_%m') < cutoff_month:
+                    expired.append(name)
+            expired.sort()
+            for name in expired:
+                cur.execute(f"DROP TABLE {name}")
+        if expired:
+            logger.info(f"🗑 Удалены секции архива: {', '.join(expired)}")
+
+    def _get_stats(self, conn) -> Dict[str, int]:
+        with conn.cursor() as cur:
+            cur.execute("SELECT total, answered, media FROM question_stats")
+            total, answered, media = cur.fetchone()
+
+        return {
+            "total": total,
+            "answered": answered,
+            "pending": total - answered,
+            "media": media
+        }
+
+    def _reconcile_stats(self, conn):
+        with conn.cursor() as cur:
+            # Блокировка строки-счетчика ждет текущие вставки и не пускает новые до конца пересчета
+            cur.execute("SELECT total, answered, media, archived, archived_media FROM question_stats FOR UPDATE")
+            old_total, old_answered, old_media, archived, archived_media = cur.fetchone()
+            cur.execute(
+                "SELECT COUNT(*), COUNT(*) FILTER (WHERE is_answered = TRUE), "
+                "COUNT(*) FILTER (WHERE media_type IS NOT NULL) FROM questions"
+            )
+            total, answered, media = cur.fetchone()
+            # Перенесенные в архив (или удаленные по сроку) вопросы были отвеченными
+            total, answered, media = total + archived, answered + archived, media + archived_media
+            if (total, answered, media) != (old_total, old_answered, old_media):
+                cur.execute(
+                    "UPDATE question_stats SET total = %s, answered = %s, media = %s",
+                    (total, answered, media)
+                )
+                logger.warning(
+                    f"⚠️ Счетчики статистики исправлены: {old_total}/{old_answered}/{old_media} "
+                    f"-> {total}/{answered}/{media}"
+                )
+
+    def _get_pending_page(self, conn, cursor: Optional[Tuple[datetime, int]], newer: bool,
+                          limit: int, preview_length: int) -> List[Dict[str, Any]]:
+        query = (
+            "SELECT id, asked_at, media_type, LEFT(question_text, %s) AS preview "
+            "FROM questions WHERE is_answered = FALSE"
+        )
+        params: List[Any] = [preview_length]
+        if cursor:
+            query += " AND (asked_at, id) > (%s, %s)" if newer else " AND (asked_at, id) < (%s, %s)"
+            params.extend(cursor)
+        query += " ORDER BY asked_at ASC, id ASC" if newer else " ORDER BY asked_at DESC, id DESC"
+        query += " LIMIT %s"
+        params.append(limit)
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, params)
+            return [dict(row) for row in cur.fetchall()]
+
+    def _get_user_questions(self, conn, user_id: int, cursor: Optional[Tuple[datetime, int]], newer: bool,
+                            limit: int, preview_length: int) -> List[Dict[str, Any]]:
+        # Сначала ID страницы только по индексу, затем тексты только этих строк
+        page = "SELECT id, asked_at FROM questions WHERE user_id = %s"
+        params: List[Any] = [user_id]
+        if cursor:
+            page += " AND (asked_at, id) > (%s, %s)" if newer else " AND (asked_at, id) < (%s, %s)"
+            params.extend(cursor)
+        direction = "ASC" if newer else "DESC"
+        page += f" ORDER BY asked_at {direction}, id {direction} LIMIT %s"
+        params.append(limit)
+        query = (
+            "SELECT q.id, q.asked_at, q.is_answered, q.media_type, LEFT(q.question_text, %s) AS preview, "
+            "LEFT(q.answer_text, %s) AS answer_preview "
+            f"FROM ({page}) page JOIN questions q ON q.id = page.id "
+            f"ORDER BY q.asked_at {direction}, q.id {direction}"
+        )
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, [preview_length, preview_length] + params)
+            return [dict(row) for row in cur.fetchall()]
+
+    def _export_questions(self, conn, write_rows: Callable[[List[Tuple]], None], since: Optional[datetime],
+                          until: Optional[datetime], answered: Optional[bool], batch_size: int) -> int:
+        period = ""
+        period_params: List[Any] = []
+        if since:
+            period += " AND asked_at >= %s"
+            period_params.append(since)
+        if until:
+            period += " AND asked_at < %s"
+            period_params.append(until)
+
+        query = (
+            "SELECT id, asked_at, is_answered, answered_at, question_text, answer_text, duplicate_of, media_type "
+            "FROM questions WHERE TRUE" + period
+        )
+        params = list(period_params)
+        if answered is not None:
+            query += " AND is_answered = %s"
+            params.append(answered)
+        # В архиве только отвеченные вопросы; секции вне периода отсекаются планировщиком
+        if answered is not False:
+            query += (
+                " UNION ALL SELECT id, asked_at, TRUE, answered_at, question_text, answer_text, duplicate_of, media_type "
+                "FROM questions_archive WHERE TRUE" + period
+            )
+            params.extend(period_params)
+        query += " ORDER BY id"
+
+        # Именованный курсор живет на сервере: клиент получает строки пачками
+        # по batch_size, а весь результат видит один снимок (DECLARE в транзакции)
+        exported = 0
+        with conn.cursor(name='questions_export') as cur:
+            cur.itersize = batch_size
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                write_rows(rows)
+                exported += len(rows)
+        logger.info(f"📦 Выгружено вопросов: {exported}")
+        return exported
+
+    # --- Кластер ---
+
+    def _cluster_heartbeat(self, conn, node_id: str, slots: int, lease_seconds: float) -> Dict[str, Any]:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO cluster_nodes (node_id, heartbeat_at) VALUES (%s, CURRENT_TIMESTAMP) "
+                "ON CONFLICT (node_id) DO UPDATE SET heartbeat_at = EXCLUDED.heartbeat_at",
+                (node_id,)
+            )
+            # Узлы, упавшие без выхода из кластера, забываются после нескольких сроков аренды
+            cur.execute(
+                "DELETE FROM cluster_nodes WHERE heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                (lease_seconds * 4,)
+            )
+            cur.execute(
+                "SELECT COUNT(*) FROM cluster_nodes WHERE heartbeat_at >= CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                (lease_seconds,)
+            )
+            nodes = cur.fetchone()[0]
+            cur.execute(
+                "INSERT INTO cluster_slots (slot) SELECT generate_series(0, %s - 1) ON CONFLICT DO NOTHING",
+                (slots,)
+            )
+            cur.execute(
+                """
+                UPDATE cluster_slots SET lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE owner = %s AND slot < %s
+                RETURNING slot
+                """,
+                (lease_seconds, node_id, slots)
+            )
+            owned = [row[0] for row in cur.fetchall()]
+            want = -(-slots // max(nodes, 1)) - len(owned)
+            if want > 0:
+                # SKIP LOCKED: одновременно стартующие узлы разбирают разные слоты, не дожидаясь друг друга
+                cur.execute(
+                    """
+                    WITH free AS (
+                        SELECT slot FROM cluster_slots
+                        WHERE slot < %s AND (owner IS NULL OR lease_until < CURRENT_TIMESTAMP)
+                        ORDER BY slot
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE cluster_slots s
+                    SET owner = %s, lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                    FROM free
+                    WHERE s.slot = free.slot
+                    RETURNING s.slot
+                    """,
+                    (slots, want, node_id, lease_seconds)
+                )
+                owned.extend(row[0] for row in cur.fetchall())
+        return {"owned": sorted(owned), "nodes": nodes}
+
+    def _release_slots(self, conn, node_id: str, slots: List[int], leave: bool):
+        with conn.cursor() as cur:
+            if leave:
+                cur.execute("UPDATE cluster_slots SET owner = NULL, lease_until = NULL WHERE owner = %s", (node_id,))
+                cur.execute("DELETE FROM cluster_nodes WHERE node_id = %s", (node_id,))
+            elif slots:
+                cur.execute(
+                    "UPDATE cluster_slots SET owner = NULL, lease_until = NULL WHERE owner = %s AND slot = ANY(%s)",
+                    (node_id, slots)
+                )
+
+    def _put_inbox(self, conn, update_id: int, slot: int, payload: str) -> bool:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO inbox (update_id, slot, payload) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                (update_id, slot, payload)
+            )
+            return cur.rowcount > 0
+
+    def _get_inbox(self, conn, slots: List[int], exclude: List[int], limit: int) -> List[Tuple[int, int, str]]:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT update_id, slot, payload FROM inbox
+                WHERE slot = ANY(%s) AND NOT (update_id = ANY(%s::bigint[]))
+                ORDER BY update_id
+                LIMIT %s
+                """,
+                (slots, exclude, limit)
+            )
+            return cur.fetchall()
+
+    def _delete_inbox(self, conn, update_ids: List[int]) -> int:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM inbox WHERE update_id = ANY(%s)", (update_ids,))
+            return cur.rowcount
+
+    def _publish(self, conn, payload: str):
+        with conn.cursor() as cur:
+            # NOTIFY уходит подписчикам при COMMIT транзакции
+            cur.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, payload))
+
+    async def listen(self, callback: Callable[[Optional[str]], None]):
+        """
+        LISTEN на отдельном соединении вне пула (autocommit): event loop следит
+        за его сокетом и читает уведомления без потоков. При обрыве соединение
+        открывается заново, а callback(None) сообщает о возможно пропущенных событиях.
+        """
+        if self._listen_task is None:
+            self._listen_task = asyncio.create_task(self._listen_loop(callback))
+
+    async def unlisten(self):
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+            try:
+                await self._listen_task
+            except asyncio.CancelledError:
+                pass
+            self._listen_task = None
+
+    def _open_listen_connection(self):
+        ssl = {} if 'sslmode' in self.conn_string else {'sslmode': 'require'}
+        # Keepalive: без него молча оборванное соединение так и ждало бы уведомлений
+        conn = psycopg2.connect(
+            self.conn_string, keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3, **ssl
+        )
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {EVENTS_CHANNEL}")
+        return conn
+
+    async def _listen_loop(self, callback: Callable[[Optional[str]], None]):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                conn = await loop.run_in_executor(self._executor, self._open_listen_connection)
+            except psycopg2.Error as e:
+                logger.error(f"❌ Не удалось открыть соединение LISTEN: {e}")
+                await asyncio.sleep(5)
+                continue
+
+            lost = asyncio.Event()
+
+            def on_readable():
+                try:
+                    conn.poll()
+                except psycopg2.Error as e:
+                    logger.warning(f"⚠️ Соединение LISTEN оборвалось: {e}")
+                    lost.set()
+                    return
+                while conn.notifies:
+                    callback(conn.notifies.pop(0).payload)
+
+            loop.add_reader(conn.fileno(), on_readable)
+            logger.info(f"📡 Подписка на события кластера ({EVENTS_CHANNEL})")
+            callback(None)
+            try:
+                await lost.wait()
+            finally:
+                loop.remove_reader(conn.fileno())
+                conn.close()
+            await asyncio.sleep(1)
@@ -0,0 +1,156 @@
+import hashlib
+import re
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Set
+
+_NON_WORD = re.compile(r'[^\w]+', re.UNICODE)
+
+_MASK32 = (1 << 32) - 1
+_EMPTY = _MASK32
+
+def normalize(text: str) -> str:
+    """Нормализовать текст: регистр, ё/е, пунктуация, эмодзи и лишние пробелы не важны"""
+    return _NON_WORD.sub(' ', text.lower().replace('ё', 'е')).strip()
+
+def minhash(normalized: str, size: int = 64) -> array:
+    """
+    MinHash-сигнатура по символьным 3-граммам (one permutation hashing).
+
+    Каждая 3-грамма хэшируется один раз и попадает в одну из size корзин,
+    в корзине остается минимум. Пустые корзины (у коротких текстов) заполняются
+    из ближайшей непустой справа, чтобы сигнатуры оставались сравнимыми.
+    Использует встроенный hash(): сигнатуры сравнимы только внутри одного процесса.
+    """
+    signature = array('I', [_EMPTY]) * size
+    for i in range(max(1, len(normalized) - 2)):
+        h = hash(normalized[i:i + 3]) & 0xFFFFFFFFFFFFFFFF
+        slot = h % size
+        value = (h // size) & _MASK32
+        if value < signature[slot]:
+            signature[slot] = value
+
+    filled = [i for i in range(size) if signature[i] != _EMPTY]
+    if filled and len(filled) < size:
+        source = list(signature)
+        for i in range(size):
+            if source[i] == _EMPTY:
+                offset = next(d for d in range(1, size) if source[(i + d) % size] != _EMPTY)
+                # Сдвиг смешивается в значение, чтобы заполненные корзины не совпадали "бесплатно"
+                signature[i] = (source[(i + offset) % size] + offset * 0x9E3779B1) & _MASK32
+    return signature
+
+
+class Duplicate(NamedTuple):
+    question_id: int
+    user_id: int
+    exact: bool
+
+
+class _Entry(NamedTuple):
+    question_id: int
+    user_id: int
+    key: bytes
+    signature: Optional[array]
+    added_at: float
+
+
+class DuplicateDetector:
+    """
+    Индекс недавних вопросов для поиска повторов.
+
+    Точные повторы ищутся по хэшу нормализованного текста, похожие — по MinHash
+    с LSH-полосами: сигнатура режется на полосы по rows значений, вопросы
+    с совпавшей полосой становятся кандидатами и проверяются оценкой сходства
+    Жаккара. Полоса хранит только последний вопрос с таким значением: для
+    похожих вопросов достаточно найти один, а память на запись остается
+    постоянной. В окне хранятся не больше max_entries вопросов не старше
+    ttl секунд, поэтому и память, и время поиска ограничены.
+    """
+
+    def __init__(self, max_entries: int = 20000, ttl: float = 86400.0, similarity: float = 0.7,
+                 signature_size: int = 64, rows: int = 8, min_length: int = 20):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.signature_size = signature_size
+        self.rows = rows
+        self.min_length = min_length
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._exact: Dict[bytes, Set[int]] = {}
+        self._bands: List[Dict[int, int]] = [{} for _ in range(signature_size // rows)]
+
+    def _fingerprint(self, text: str):
+        normalized = normalize(text)
+        key = hashlib.blake2b(normalized.encode(), digest_size=16).digest()
+        # Короткие тексты слишком легко совпадают по 3-граммам — для них только точное совпадение
+        signature = minhash(normalized, self.signature_size) if len(normalized) >= self.min_length else None
+        return key, signature
+
+    def _band_keys(self, signature: array):
+        return [hash(tuple(signature[i:i + self.rows])) for i in range(0, len(self._bands) * self.rows, self.rows)]
+
+    def _similar(self, a: array, b: array) -> bool:
+        equal = sum(x == y for x, y in zip(a, b))
+        return equal >= self.similarity * self.signature_size
+
+    def find(self, text: str, user_id: int) -> Optional[Duplicate]:
+        """Найти повтор вопроса; повтор от того же пользователя предпочтительнее"""
+        self._expire()
+        key, signature = self._fingerprint(text)
+
+        exact_ids = self._exact.get(key, ())
+        matches = [Duplicate(qid, self._entries[qid].user_id, True) for qid in exact_ids]
+        if signature is not None:
+            seen = set(exact_ids)
+            for band, band_key in zip(self._bands, self._band_keys(signature)):
+                qid = band.get(band_key)
+                if qid is None or qid in seen:
+                    continue
+                seen.add(qid)
+                entry = self._entries[qid]
+                if self._similar(entry.signature, signature):
+                    matches.append(Duplicate(qid, entry.user_id, False))
+
+        if not matches:
+            return None
+        # Сначала свой вопрос, затем точный повтор, затем самый свежий
+        return max(matches, key=lambda m: (m.user_id == user_id, m.exact, m.question_id))
+
+    def add(self, question_id: int, user_id: int, text: str):
+        """Добавить вопрос в окно"""
+        key, signature = self._fingerprint(text)
+        self.forget(question_id)
+        self._entries[question_id] = _Entry(question_id, user_id, key, signature, time.monotonic())
+        self._exact.setdefault(key, set()).add(question_id)
+        if signature is not None:
+            for band, band_key in zip(self._bands, self._band_keys(signature)):
+                band[band_key] = question_id
+        self._expire()
+
+    def forget(self, question_id: int):
+        """Убрать вопрос из окна (например, после ответа)"""
+        entry = self._entries.pop(question_id, None)
+        if entry is None:
+            return
+        ids = self._exact.get(entry.key)
+        if ids is not None:
+            ids.discard(question_id)
+            if not ids:
+                del self._exact[entry.key]
+        if entry.signature is not None:
+            for band, band_key in zip(self._bands, self._band_keys(entry.signature)):
+                if band.get(band_key) == question_id:
+                    del band[band_key]
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self._entries:
+            question_id, entry = next(iter(self._entries.items()))
+            if entry.added_at > deadline and len(self._entries) <= self.max_entries:
+                break
+            self.forget(question_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
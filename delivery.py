@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden
+
+logger = logging.getLogger(__name__)
+
+class DeliveryWorker:
+    """
+    Фоновая доставка вопросов админам из таблицы outbox.
+
+    Работает в event loop бота: забирает готовые доставки пачками, отправляет
+    их параллельно через deliver(bot, item) -> [message_id, ...] (последний —
+    карточка вопроса, предыдущие — копии вложений), записывает
+    ID сообщений и удаляет доставку. Временные ошибки откладываются
+    с экспоненциальной задержкой, постоянные (бот заблокирован, чат не найден)
+    и исчерпавшие попытки доставки снимаются с очереди. Если у ошибки есть
+    sent_message_ids (копии вложений ушли, карточка — нет), они сохраняются
+    в доставке и приходят в item при следующей попытке.
+
+    Если задан rate_meter и поток вопросов превысил digest_threshold в минуту,
+    воркер переходит в режим дайджеста: копит доставки digest_window секунд
+    и отправляет каждому админу одно сводное сообщение через
+    deliver_digest(bot, chat_id, items) -> [[] или исключение для каждой доставки]:
+    сводка может уйти несколькими сообщениями, и повторяются только доставки
+    из неотправленных частей. Когда поток спадает, возвращается к отправке
+    по одному вопросу.
+    """
+
+    def __init__(self, db, deliver: Callable[[Any, Dict[str, Any]], Awaitable[List[int]]],
+                 batch_size: int = 50, poll_interval: float = 5.0, lease_seconds: float = 60.0,
+                 max_attempts: int = 10, base_delay: float = 2.0, max_delay: float = 600.0,
+                 deliver_digest: Optional[Callable[[Any, int, List[Dict[str, Any]]], Awaitable[List[Any]]]] = None,
+                 rate_meter=None, digest_threshold: float = 0, digest_window: float = 10.0,
+                 digest_max_items: int = 500):
+        self.db = db
+        self.deliver = deliver
+        self.deliver_digest = deliver_digest
+        self.rate_meter = rate_meter
+        self.digest_threshold = digest_threshold
+        self.digest_window = digest_window
+        self.digest_max_items = digest_max_items
+        self.digest_mode = False
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._bot = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def wake(self):
+        """Разбудить воркер сразу после записи новых доставок"""
+        self._wakeup.set()
+
+    def start(self, bot):
+        self._bot = bot
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info("📮 Воркер доставки запущен")
+
+    async def stop(self):
+        """Остановить воркер, дождавшись текущей пачки"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        logger.info("📮 Воркер доставки остановлен")
+
+    async def _run(self):
+        while not self._stopping:
+            # Сбрасываем флаг до выборки: wake() во время отправки не потеряется
+            self._wakeup.clear()
+            try:
+                if self._update_digest_mode():
+                    # Даем вопросам накопиться, затем отправляем их дайджестом
+                    await self._sleep(self.digest_window)
+                    items = await self.db.claim_deliveries(self.digest_max_items, self.lease_seconds)
+                    if items:
+                        await self._process_digest(items)
+                    continue
+
+                items = await self.db.claim_deliveries(self.batch_size, self.lease_seconds)
+                if items:
+                    await self._process(items)
+                    # Пачка была полной — вероятно, в очереди есть еще
+                    if len(items) == self.batch_size:
+                        continue
+            except Exception as e:
+                logger.error(f"❌ Ошибка воркера доставки: {e}", exc_info=True)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _update_digest_mode(self) -> bool:
+        """Переключить режим дайджеста по текущей частоте вопросов"""
+        if not (self.deliver_digest and self.rate_meter and self.digest_threshold > 0):
+            return False
+        rate = self.rate_meter.per_minute()
+        # Выходим из режима при заметно меньшей частоте, чтобы не переключаться туда-обратно
+        enabled = rate >= self.digest_threshold if not self.digest_mode else rate >= self.digest_threshold / 2
+        if enabled != self.digest_mode:
+            self.digest_mode = enabled
+            if enabled:
+                logger.warning(f"📚 Режим дайджеста включен: {rate:.0f} вопросов в минуту")
+            else:
+                logger.info(f"📨 Режим дайджеста выключен: {rate:.0f} вопросов в минуту")
+        return self.digest_mode
+
+    async def _sleep(self, seconds: float):
+        """Пауза, которую прерывает только остановка воркера"""
+        deadline = asyncio.get_running_loop().time() + seconds
+        while not self._stopping:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+
+    async def _process_digest(self, items: List[Dict[str, Any]]):
+        by_chat = defaultdict(list)
+        for item in items:
+            by_chat[item["chat_id"]].append(item)
+        chat_ids = list(by_chat)
+        results = await asyncio.gather(
+            *(self.deliver_digest(self._bot, chat_id, by_chat[chat_id]) for chat_id in chat_ids),
+            return_exceptions=True
+        )
+
+        # Дайджест не привязывается к вопросам: ответ идет через открытие вопроса по ссылке
+        outcome = {}
+        for chat_id, result in zip(chat_ids, results):
+            for item, item_result in zip(by_chat[chat_id], self._digest_results(by_chat[chat_id], result)):
+                outcome[item["id"]] = item_result
+        await self._finish(items, [outcome[item["id"]] for item in items])
+
+    @staticmethod
+    def _digest_results(items: List[Dict[str, Any]], result: Any) -> List[Any]:
+        """Результаты доставок одного чата: исключение вне отправки частей относится ко всем"""
+        if isinstance(result, Exception):
+            return [result] * len(items)
+        return result
+
+    async def _process(self, items: List[Dict[str, Any]]):
+        results = await asyncio.gather(
+            *(self.deliver(self._bot, item) for item in items),
+            return_exceptions=True
+        )
+        await self._finish(items, results)
+
+    async def _finish(self, items: List[Dict[str, Any]], results: List[Any]):
+        delivered, failed, dropped = [], [], []
+        for item, result in zip(items, results):
+            if not isinstance(result, Exception):
+                delivered.append({**item, "message_ids": result})
+            elif isinstance(result, (Forbidden, BadRequest)):
+                logger.error(f"❌ Вопрос #{item['question_id']} не доставлен в чат {item['chat_id']}: {result}")
+                dropped.append(item["id"])
+            elif item["attempts"] >= self.max_attempts:
+                logger.critical(
+                    f"❌ Вопрос #{item['question_id']} не доставлен в чат {item['chat_id']} "
+                    f"после {item['attempts']} попыток: {result}"
+                )
+                dropped.append(item["id"])
+            else:
+                delay = min(self.max_delay, self.base_delay * 2 ** (item["attempts"] - 1))
+                logger.warning(
+                    f"⚠️ Доставка вопроса #{item['question_id']} в чат {item['chat_id']} "
+                    f"отложена на {delay:.0f} с: {result}"
+                )
+                failed.append((item["id"], delay, str(result), getattr(result, "sent_message_ids", [])))
+
+        await self.db.complete_deliveries(delivered)
+        await self.db.reschedule_deliveries(failed)
+        await self.db.drop_deliveries(dropped)
+        if delivered:
+            logger.info(f"✅ Доставлено {len(delivered)} из {len(items)} сообщений админам")
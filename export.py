@@ -0,0 +1,100 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, IO, List, Sequence
+
+# Поля выгрузки; user_id не выгружается: анонимность сохраняется и в архиве
+EXPORT_COLUMNS = ("id", "asked_at", "is_answered", "answered_at", "question_text", "answer_text", "duplicate_of",
+                  "media_type")
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+_STATUSES = {'all': None, 'answered': True, 'pending': False}
+
+def parse_export_args(args: Sequence[str]) -> Dict[str, Any]:
+    """
+    Разобрать аргументы /export: формат (csv/jsonl), статус (all/answered/pending)
+    и до двух дат ГГГГ-ММ-ДД — начало и конец периода (включительно, UTC).
+    Аргументы можно указывать в любом порядке.
+    """
+    options: Dict[str, Any] = {"fmt": 'csv', "answered": None, "since": None, "until": None}
+    dates: List[datetime] = []
+    for arg in args:
+        value = arg.lower()
+        if value in EXPORT_FORMATS:
+            options["fmt"] = value
+        elif value in _STATUSES:
+            options["answered"] = _STATUSES[value]
+        else:
+            try:
+                dates.append(datetime.strptime(value, '%Y-%m-%d'))
+            except ValueError:
+                raise ValueError(f"Непонятный аргумент: {arg}")
+    if len(dates) > 2:
+        raise ValueError("Укажите не больше двух дат: начало и конец периода")
+    if dates:
+        options["since"] = dates[0]
+    if len(dates) == 2:
+        if dates[1] < dates[0]:
+            raise ValueError("Конец периода раньше начала")
+        # Конец периода включительно: до начала следующего дня
+        options["until"] = dates[1] + timedelta(days=1)
+    return options
+
+def _format_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    return value
+
+class ExportWriter:
+    """
+    Потоковая запись выгрузки в gzip: CSV (с BOM, чтобы Excel понял UTF-8) или JSONL.
+
+    write_rows вызывается хранилищем пачками строк в порядке EXPORT_COLUMNS
+    из потока БД, поэтому сжатие не занимает event loop, а в памяти держится
+    только одна пачка.
+    """
+
+    def __init__(self, fileobj: IO[bytes], fmt: str = 'csv'):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        self.fmt = fmt
+        self.rows = 0
+        self._gzip = gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6)
+        self._text = io.TextIOWrapper(self._gzip, encoding='utf-8-sig' if fmt == 'csv' else 'utf-8', newline='')
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(EXPORT_COLUMNS)
+
+    def write_rows(self, rows: List[Sequence[Any]]):
+        if self._csv is not None:
+            self._csv.writerows([[_format_value(value) for value in row] for row in rows])
+        else:
+            self._text.write("".join(
+                json.dumps({column: _format_value(value) for column, value in zip(EXPORT_COLUMNS, row)},
+                           ensure_ascii=False) + "\n"
+                for row in rows
+            ))
+        self.rows += len(rows)
+
+    def close(self):
+        """Дописать хвост gzip; сам fileobj остается открытым"""
+        self._text.flush()
+        self._text.detach()
+        self._gzip.close()
+
+    @property
+    def filename_suffix(self) -> str:
+        return f".{self.fmt}.gz"
+
+def describe_filters(options: Dict[str, Any]) -> str:
+    """Описание фильтров выгрузки для подписи к файлу"""
+    parts = [{None: "все вопросы", True: "отвеченные", False: "неотвеченные"}[options["answered"]]]
+    if options["since"]:
+        parts.append(f"с {options['since']:%d.%m.%Y}")
+    if options["until"]:
+        parts.append(f"по {options['until'] - timedelta(days=1):%d.%m.%Y}")
+    return ", ".join(parts)
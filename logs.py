@@ -0,0 +1,136 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from metrics import LOG_RECORDS_DROPPED
+
+# Контекст обновления для записей лога: задача обработки обновления (и созданные
+# из нее задачи) видят свои значения, поэтому их не нужно передавать в каждый вызов
+_update_id: ContextVar[Optional[int]] = ContextVar('log_update_id', default=None)
+_update_started: ContextVar[Optional[float]] = ContextVar('log_update_started', default=None)
+_question_id: ContextVar[Optional[int]] = ContextVar('log_question_id', default=None)
+
+# Поля LogRecord, которые не выводятся как дополнительные (extra=...) поля
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+def bind_update(update_id: Optional[int]):
+    """Начать обработку обновления: его ID и время от начала попадут в записи лога"""
+    _update_id.set(update_id)
+    _update_started.set(time.perf_counter())
+    _question_id.set(None)
+
+def bind_question(question_id: Optional[int]):
+    """Вопрос, с которым работает текущее обновление или доставка"""
+    _question_id.set(question_id)
+
+class UpdateContextFilter(logging.Filter):
+    """Добавить к записи update_id, question_id и elapsed_ms из контекста (в потоке event loop)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        update_id = _update_id.get()
+        if update_id is not None and not hasattr(record, 'update_id'):
+            record.update_id = update_id
+            record.elapsed_ms = round((time.perf_counter() - _update_started.get()) * 1000, 1)
+        question_id = _question_id.get()
+        if question_id is not None and not hasattr(record, 'question_id'):
+            record.question_id = question_id
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Оставить долю rate записей уровня INFO и ниже, сделанных при обработке обновлений
+    и доставке вопросов.
+
+    Решение принимается по update_id (для доставки — по question_id), а не по каждой
+    записи: от обновления остаются либо все строки, либо ни одной. Предупреждения
+    и ошибки, а также прочие записи (запуск, фоновые задачи) не отбрасываются.
+    """
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.threshold = int(max(0.0, min(rate, 1.0)) * 2 ** 32)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = getattr(record, 'update_id', None)
+        if key is None:
+            key = getattr(record, 'question_id', None)
+            if key is None:
+                return True
+        # Мультипликативный хеш: соседние ID равномерно попадают в выборку
+        return (key * 2654435761) % 2 ** 32 < self.threshold
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON: время, уровень, логгер, сообщение и поля из extra/контекста"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Передать запись в ограниченную очередь фонового потока, не дожидаясь вывода.
+
+    При переполненной очереди запись отбрасывается (и считается в метрике),
+    а не блокирует event loop. Форматирование тоже выполняет поток слушателя:
+    сообщения бота — уже готовые f-строки, а аргументы библиотек неизменяемы.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(record.levelname).inc()
+
+def setup_logging(level: str = 'INFO', fmt: str = 'json', sample_rate: float = 1.0,
+                  queue_size: int = 10000) -> QueueListener:
+    """
+    Настроить корневой логгер: записи уходят в очередь, а форматирует и пишет
+    их в stderr фоновый поток. Очередь дописывается при выходе из процесса.
+    """
+    output = logging.StreamHandler(sys.stderr)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(UpdateContextFilter())
+    if sample_rate < 1.0:
+        handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
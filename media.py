@@ -0,0 +1,111 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo, Message
+
+# Виды вложений в порядке проверки: у GIF-анимации заполнено и поле document
+MEDIA_TYPES = ('photo', 'video', 'animation', 'document', 'audio', 'voice', 'video_note', 'sticker')
+
+# Вложения, у которых бывает подпись (у стикера и видеосообщения ее нет)
+CAPTION_TYPES = frozenset(('photo', 'video', 'animation', 'document', 'audio', 'voice'))
+
+# Несколько вложений одного сообщения (альбом) хранятся с типом 'album'
+ALBUM = 'album'
+
+MEDIA_LABELS = {
+    'photo': '🖼 Фото',
+    'video': '🎬 Видео',
+    'animation': '🎞 GIF',
+    'document': '📎 Файл',
+    'audio': '🎵 Аудио',
+    'voice': '🎤 Голосовое',
+    'video_note': '📹 Видеосообщение',
+    'sticker': '🏷 Стикер',
+    ALBUM: '🗂 Альбом',
+}
+
+_INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio,
+}
+
+def message_media(message: Message) -> Optional[Dict[str, str]]:
+    """Вложение сообщения: {"type", "file_id"} или None для текста"""
+    for media_type in MEDIA_TYPES:
+        attachment = getattr(message, media_type, None)
+        if attachment:
+            if media_type == 'photo':
+                # Фото приходит в нескольких размерах, последний — самый большой
+                attachment = attachment[-1]
+            return {"type": media_type, "file_id": attachment.file_id}
+    return None
+
+def media_type_of(media: List[Dict[str, str]]) -> Optional[str]:
+    """Тип вопроса или ответа по его вложениям"""
+    if not media:
+        return None
+    return ALBUM if len(media) > 1 else media[0]["type"]
+
+def with_media_label(text: str, media_type: Optional[str]) -> str:
+    """Текст с пометкой о вложении: для превью, дайджеста и сохраненного ответа"""
+    if not media_type:
+        return text
+    label = MEDIA_LABELS.get(media_type, '📎 Вложение')
+    return f"{label} {text}" if text else label
+
+def messages_media(messages: List[Message]) -> Tuple[str, List[Dict[str, str]]]:
+    """Подпись и вложения альбома: подпись бывает только у одного из элементов"""
+    caption = next((message.caption for message in messages if message.caption), "")
+    return caption, [item for item in map(message_media, messages) if item]
+
+def album_media(media: List[Dict[str, Any]]) -> list:
+    """
+    InputMedia для send_media_group по уже загруженным file_id: файлы не скачиваются
+    и не загружаются заново. Подписи не переносятся — текст идет отдельным сообщением.
+    """
+    return [_INPUT_MEDIA[item["type"]](media=item["file_id"]) for item in media]
+
+class MediaGroupCollector:
+    """
+    Сборка альбомов. Telegram присылает каждый элемент альбома отдельным сообщением
+    с общим media_group_id и не сообщает, сколько их будет: альбом считается
+    собранным, когда в течение window секунд не пришло новых элементов.
+    """
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        # (chat_id, media_group_id) -> (сообщения альбома, время последнего элемента)
+        self._groups: Dict[Tuple[int, str], Tuple[List[Message], float]] = {}
+
+    @staticmethod
+    def _key(message: Message) -> Tuple[int, str]:
+        return message.chat_id, message.media_group_id
+
+    def pending(self, message: Message) -> bool:
+        """Альбом этого сообщения уже собирается"""
+        return self._key(message) in self._groups
+
+    def add(self, message: Message) -> bool:
+        """Добавить элемент альбома; True — это первый элемент и альбом нужно собрать через collect()"""
+        key = self._key(message)
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = ([message], time.monotonic())
+            return True
+        group[0].append(message)
+        self._groups[key] = (group[0], time.monotonic())
+        return False
+
+    async def collect(self, message: Message) -> List[Message]:
+        """Дождаться паузы в элементах альбома и вернуть их по порядку"""
+        key = self._key(message)
+        while True:
+            quiet = self._groups[key][1] + self.window - time.monotonic()
+            if quiet <= 0:
+                break
+            await asyncio.sleep(quiet)
+        messages, _ = self._groups.pop(key)
+        return sorted(messages, key=lambda item: item.message_id)
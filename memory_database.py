@@ -0,0 +1,396 @@
+import heapq
+import itertools
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, Callable, List, Tuple, Union
+
+from storage import SEARCH_RANK_WINDOW, Storage, admin_message_rows, query_terms, search_terms
+
+logger = logging.getLogger(__name__)
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class MemoryDatabase(Storage):
+    """
+    Хранилище в памяти процесса (DATABASE_URL=memory://).
+
+    Для тестов, бенчмарков и одноразовых запусков: данные теряются при
+    перезапуске. Методы выполняются прямо в event loop без потоков: каждый
+    сначала проверяет условия и только потом меняет данные, поэтому
+    выполняется целиком, как транзакция.
+    """
+
+    def __init__(self, reply_cache_size: int = 10000, stats_cache_ttl: float = 2.0,
+                 history_cache_ttl: float = 30.0, **_):
+        super().__init__(reply_cache_size=reply_cache_size, stats_cache_ttl=stats_cache_ttl,
+                         history_cache_ttl=history_cache_ttl)
+        self._questions: Dict[int, Dict[str, Any]] = {}
+        self._question_ids = itertools.count(1)
+        # Неотвеченные вопросы, отсортированные по (asked_at, id), для keyset-пагинации
+        self._pending_keys: List[Tuple[datetime, int]] = []
+        # Вопросы каждого пользователя по (asked_at, id) — для истории /myquestions
+        self._user_keys: Dict[int, List[Tuple[datetime, int]]] = {}
+        self._admin_messages: Dict[Tuple[int, int], int] = {}
+        # ID вопроса -> его карточки у админов [(admin_chat_id, admin_message_id), ...]
+        self._question_cards: Dict[int, List[Tuple[int, int]]] = {}
+        self._outbox: Dict[int, Dict[str, Any]] = {}
+        self._outbox_ids = itertools.count(1)
+        # Куча (next_attempt_at, id); устаревшие записи пропускаются при выборке
+        self._outbox_queue: List[Tuple[datetime, int]] = []
+        # Архив старых отвеченных вопросов и сколько вопросов ушло из рабочего словаря
+        self._archive: Dict[int, Dict[str, Any]] = {}
+        self._archived = 0
+        self._archived_media = 0
+        self._total = 0
+        self._answered = 0
+        self._media = 0
+        self._last_time = datetime.min
+
+    @property
+    def persistent(self) -> bool:
+        return False
+
+    async def connect(self):
+        logger.info("✅ Хранилище в памяти готово (данные не сохраняются между запусками)")
+
+    async def close(self):
+        pass
+
+    async def _submit(self, func: Callable, *args):
+        return func(None, *args)
+
+    def _now(self) -> datetime:
+        # Монотонное время (UTC): порядок asked_at совпадает с порядком вставки
+        now = max(_utcnow(), self._last_time + timedelta(microseconds=1))
+        self._last_time = now
+        return now
+
+    def _enqueue(self, question_id: int, chat_id: int, now: datetime):
+        outbox_id = next(self._outbox_ids)
+        self._outbox[outbox_id] = {
+            "id": outbox_id, "question_id": question_id, "chat_id": chat_id,
+            "attempts": 0, "next_attempt_at": now, "last_error": None, "sent_message_ids": [],
+        }
+        heapq.heappush(self._outbox_queue, (now, outbox_id))
+
+    def _save_question(self, conn, user_id: int, message_id: int, question_text: str,
+                       recipients: List[int], assigned_admin_id: Optional[int], duplicate_of: Optional[int],
+                       media_type: Optional[str], media: Optional[List[Dict[str, str]]]) -> int:
+        now = self._now()
+        question_id = next(self._question_ids)
+        self._questions[question_id] = {
+            "id": question_id, "user_id": user_id, "message_id": message_id,
+            "question_text": question_text, "answer_text": None,
+            "asked_at": now, "answered_at": None, "is_answered": False,
+            "assigned_admin_id": assigned_admin_id,
+            "assigned_at": now if assigned_admin_id is not None else None,
+            "claimed": False, "duplicate_of": duplicate_of,
+            "media_type": media_type, "media": list(media) if media else None,
+        }
+        self._pending_keys.append((now, question_id))
+        self._user_keys.setdefault(user_id, []).append((now, question_id))
+        self._total += 1
+        self._media += media_type is not None
+        for chat_id in recipients:
+            self._enqueue(question_id, chat_id, now)
+        logger.debug(f"✅ Вопрос сохранен с ID: {question_id}")
+        return question_id
+
+    def _get_question(self, conn, question_id: int) -> Optional[Dict[str, Any]]:
+        question = self._questions.get(question_id)
+        if question is None:
+            return None
+        return {
+            key: question[key]
+            for key in ("id", "user_id", "message_id", "question_text", "asked_at", "is_answered", "duplicate_of",
+                        "media_type", "media")
+        }
+
+    def _get_user_by_admin_message(self, conn, admin_chat_id: int, admin_message_id: int) -> Optional[Dict[str, Any]]:
+        question = self._questions.get(self._admin_messages.get((admin_chat_id, admin_message_id)))
+        if question is None:
+            return None
+        return {"id": question["id"], "user_id": question["user_id"], "is_answered": question["is_answered"]}
+
+    def _save_admin_messages(self, conn, rows: List[Tuple[int, int, int, bool]]):
+        for admin_chat_id, admin_message_id, question_id, is_card in rows:
+            key = (admin_chat_id, admin_message_id)
+            if question_id in self._questions and key not in self._admin_messages:
+                self._admin_messages[key] = question_id
+                if is_card:
+                    self._question_cards.setdefault(question_id, []).append(key)
+        logger.debug(f"✅ Сохранено {len(rows)} сообщений админов")
+
+    def _get_question_cards(self, conn, question_id: int) -> List[Tuple[int, int]]:
+        return list(self._question_cards.get(question_id, ()))
+
+    def _claim_deliveries(self, conn, batch_size: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        now = self._now()
+        lease_until = now + timedelta(seconds=lease_seconds)
+        items = []
+        while self._outbox_queue and len(items) < batch_size and self._outbox_queue[0][0] <= now:
+            due, outbox_id = heapq.heappop(self._outbox_queue)
+            row = self._outbox.get(outbox_id)
+            if row is None or row["next_attempt_at"] != due:
+                continue
+            question = self._questions[row["question_id"]]
+            row["attempts"] += 1
+            items.append({
+                "id": outbox_id, "question_id": row["question_id"], "chat_id": row["chat_id"],
+                "attempts": row["attempts"], "sent_message_ids": list(row["sent_message_ids"]),
+                "user_id": question["user_id"], "message_id": question["message_id"],
+                "question_text": question["question_text"], "asked_at": question["asked_at"],
+                "duplicate_of": question["duplicate_of"],
+                "media_type": question["media_type"], "media": question["media"],
+            })
+        for item in items:
+            self._outbox[item["id"]]["next_attempt_at"] = lease_until
+            heapq.heappush(self._outbox_queue, (lease_until, item["id"]))
+        return items
+
+    def _complete_deliveries(self, conn, delivered: List[Dict[str, Any]]):
+        rows = admin_message_rows(delivered)
+        if rows:
+            self._save_admin_messages(conn, rows)
+        for item in delivered:
+            self._outbox.pop(item["id"], None)
+
+    def _reschedule_deliveries(self, conn, failed: List[Tuple[int, float, str, List[int]]]):
+        now = self._now()
+        for outbox_id, delay, error, sent_message_ids in failed:
+            row = self._outbox.get(outbox_id)
+            if row is None:
+                continue
+            row["next_attempt_at"] = now + timedelta(seconds=delay)
+            row["last_error"] = error
+            row["sent_message_ids"] = list(sent_message_ids)
+            heapq.heappush(self._outbox_queue, (row["next_attempt_at"], outbox_id))
+
+    def _drop_deliveries(self, conn, outbox_ids: List[int]):
+        for outbox_id in outbox_ids:
+            self._outbox.pop(outbox_id, None)
+
+    def _mark_as_answered(self, conn, question_id: int, answer_text: str):
+        question = self._questions.get(question_id)
+        if question is None:
+            return
+        question["answer_text"] = answer_text
+        if not question["is_answered"]:
+            self._set_answered(question)
+        logger.debug(f"✅ Вопрос {question_id} отмечен как отвеченный")
+
+    def _close_question(self, conn, question_id: int) -> Union[int, bool]:
+        question = self._questions.get(question_id)
+        if question is None or question["is_answered"]:
+            return False
+        self._set_answered(question)
+        logger.debug(f"✅ Вопрос {question_id} закрыт без ответа")
+        return question["user_id"]
+
+    def _set_answered(self, question: Dict[str, Any]):
+        question["is_answered"] = True
+        question["answered_at"] = self._now()
+        self._answered += 1
+        key = (question["asked_at"], question["id"])
+        index = bisect_left(self._pending_keys, key)
+        if index < len(self._pending_keys) and self._pending_keys[index] == key:
+            del self._pending_keys[index]
+
+    def _get_admin_loads(self, conn) -> Dict[int, int]:
+        loads: Dict[int, int] = {}
+        for _, question_id in self._pending_keys:
+            admin_id = self._questions[question_id]["assigned_admin_id"]
+            if admin_id is not None:
+                loads[admin_id] = loads.get(admin_id, 0) + 1
+        return loads
+
+    def _claim_question(self, conn, question_id: int, admin_id: int) -> bool:
+        question = self._questions.get(question_id)
+        if question is None or question["is_answered"]:
+            return False
+        if question["claimed"] and question["assigned_admin_id"] != admin_id:
+            return False
+        question.update(assigned_admin_id=admin_id, assigned_at=self._now(), claimed=True)
+        return True
+
+    def _release_question(self, conn, question_id: int, admin_id: int) -> bool:
+        question = self._questions.get(question_id)
+        if question is None or question["is_answered"] or question["assigned_admin_id"] != admin_id:
+            return False
+        question.update(assigned_admin_id=None, claimed=False)
+        return True
+
+    def _get_overdue_assignments(self, conn, timeout_seconds: float, limit: int) -> List[Dict[str, Any]]:
+        deadline = _utcnow() - timedelta(seconds=timeout_seconds)
+        overdue = [
+            self._questions[question_id] for _, question_id in self._pending_keys
+            if not self._questions[question_id]["claimed"]
+            and self._questions[question_id]["assigned_at"] is not None
+            and self._questions[question_id]["assigned_at"] < deadline
+        ]
+        overdue.sort(key=lambda q: q["assigned_at"])
+        return [{"id": q["id"], "assigned_admin_id": q["assigned_admin_id"]} for q in overdue[:limit]]
+
+    def _reassign_question(self, conn, question_id: int, from_admin_id: Optional[int], to_admin_id: int) -> bool:
+        question = self._questions.get(question_id)
+        if (question is None or question["is_answered"] or question["claimed"]
+                or question["assigned_admin_id"] != from_admin_id):
+            return False
+        now = self._now()
+        question.update(assigned_admin_id=to_admin_id, assigned_at=now)
+        self._enqueue(question_id, to_admin_id, now)
+        logger.info(f"🔀 Вопрос #{question_id} переназначен: {from_admin_id} -> {to_admin_id}")
+        return True
+
+    def _get_stats(self, conn) -> Dict[str, int]:
+        return {
+            "total": self._total,
+            "answered": self._answered,
+            "pending": self._total - self._answered,
+            "media": self._media
+        }
+
+    def _reconcile_stats(self, conn):
+        total = len(self._questions) + self._archived
+        answered = sum(1 for question in self._questions.values() if question["is_answered"]) + self._archived
+        media = sum(1 for question in self._questions.values() if question["media_type"] is not None)
+        media += self._archived_media
+        if (total, answered, media) != (self._total, self._answered, self._media):
+            logger.warning(
+                f"⚠️ Счетчики статистики исправлены: {self._total}/{self._answered}/{self._media} "
+                f"-> {total}/{answered}/{media}"
+            )
+            self._total, self._answered, self._media = total, answered, media
+
+    def _search_questions(self, conn, query: str, limit: int, offset: int,
+                          preview_length: int) -> List[Dict[str, Any]]:
+        terms = set(query_terms(query))
+        if not terms:
+            return []
+        # Полный перебор от новых к старым: все слова должны встретиться,
+        # вхождения в вопрос весят вдвое больше; ранжируются самые новые совпадения
+        matches = []
+        questions = sorted(itertools.chain(self._questions.values(), self._archive.values()),
+                           key=lambda question: question["id"], reverse=True)
+        for question in questions:
+            text = search_terms(question["question_text"])
+            answer = search_terms(question["answer_text"] or "")
+            if terms <= set(text) | set(answer):
+                rank = sum(2 * text.count(term) + answer.count(term) for term in terms)
+                matches.append((-rank, -question["id"], question))
+                if len(matches) == SEARCH_RANK_WINDOW:
+                    break
+        matches.sort(key=lambda match: match[:2])
+        return [
+            {"id": question["id"], "asked_at": question["asked_at"], "is_answered": question["is_answered"],
+             "media_type": question["media_type"],
+             "preview": question["question_text"][:preview_length],
+             "answer_preview": question["answer_text"] and question["answer_text"][:preview_length]}
+            for _, _, question in matches[offset:offset + limit]
+        ]
+
+    def _archive_questions(self, conn, age_seconds: float, keep_archive: bool, limit: int) -> int:
+        cutoff = _utcnow() - timedelta(seconds=age_seconds)
+        expired = sorted(
+            (question for question in self._questions.values()
+             if question["is_answered"] and question["asked_at"] < cutoff),
+            key=lambda question: (question["asked_at"], question["id"])
+        )[:limit]
+        if not expired:
+            return 0
+        moved = {question["id"] for question in expired}
+        for question in expired:
+            del self._questions[question["id"]]
+            if keep_archive:
+                self._archive[question["id"]] = question
+        for user_id in {question["user_id"] for question in expired}:
+            keys = [key for key in self._user_keys[user_id] if key[1] not in moved]
+            if keys:
+                self._user_keys[user_id] = keys
+            else:
+                del self._user_keys[user_id]
+        # Как каскадное удаление в БД: копии у админов и доставки уходят вместе с вопросом
+        self._admin_messages = {key: qid for key, qid in self._admin_messages.items() if qid not in moved}
+        for question_id in moved:
+            self._question_cards.pop(question_id, None)
+        self._outbox = {oid: row for oid, row in self._outbox.items() if row["question_id"] not in moved}
+        self._archived += len(moved)
+        self._archived_media += sum(question["media_type"] is not None for question in expired)
+        return len(moved)
+
+    def _purge_archive(self, conn, age_seconds: float):
+        cutoff = _utcnow() - timedelta(seconds=age_seconds)
+        expired = [qid for qid, question in self._archive.items() if question["asked_at"] < cutoff]
+        for question_id in expired:
+            del self._archive[question_id]
+        if expired:
+            logger.info(f"🗑 Из архива удалено вопросов: {len(expired)}")
+
+    def _get_pending_page(self, conn, cursor: Optional[Tuple[datetime, int]], newer: bool,
+                          limit: int, preview_length: int) -> List[Dict[str, Any]]:
+        keys = self._pending_keys
+        if newer:
+            start = bisect_right(keys, cursor) if cursor else 0
+            page = keys[start:start + limit]
+        else:
+            end = bisect_left(keys, cursor) if cursor else len(keys)
+            page = keys[max(0, end - limit):end][::-1]
+        return [
+            {"id": question_id, "asked_at": asked_at,
+             "media_type": self._questions[question_id]["media_type"],
+             "preview": self._questions[question_id]["question_text"][:preview_length]}
+            for asked_at, question_id in page
+        ]
+
+    def _get_user_questions(self, conn, user_id: int, cursor: Optional[Tuple[datetime, int]], newer: bool,
+                            limit: int, preview_length: int) -> List[Dict[str, Any]]:
+        keys = self._user_keys.get(user_id, [])
+        if newer:
+            start = bisect_right(keys, cursor) if cursor else 0
+            page = keys[start:start + limit]
+        else:
+            end = bisect_left(keys, cursor) if cursor else len(keys)
+            page = keys[max(0, end - limit):end][::-1]
+        rows = []
+        for _, question_id in page:
+            question = self._questions[question_id]
+            rows.append({
+                "id": question_id, "asked_at": question["asked_at"], "is_answered": question["is_answered"],
+                "media_type": question["media_type"], "preview": question["question_text"][:preview_length],
+                "answer_preview": question["answer_text"][:preview_length] if question["answer_text"] else None,
+            })
+        return rows
+
+    def _export_questions(self, conn, write_rows: Callable[[List[Tuple]], None], since: Optional[datetime],
+                          until: Optional[datetime], answered: Optional[bool], batch_size: int) -> int:
+        exported = 0
+        batch = []
+        # Рабочий словарь хранит вопросы в порядке вставки, то есть по возрастанию id;
+        # архив пополняется в другом порядке, поэтому сортируется
+        questions = heapq.merge(
+            sorted(self._archive.values(), key=lambda question: question["id"]) if answered is not False else (),
+            self._questions.values(),
+            key=lambda question: question["id"]
+        )
+        for question in questions:
+            if since and question["asked_at"] < since:
+                continue
+            if until and question["asked_at"] >= until:
+                continue
+            if answered is not None and question["is_answered"] != answered:
+                continue
+            batch.append((
+                question["id"], question["asked_at"], question["is_answered"], question["answered_at"],
+                question["question_text"], question["answer_text"], question["duplicate_of"],
+                question["media_type"],
+            ))
+            if len(batch) == batch_size:
+                write_rows(batch)
+                exported += len(batch)
+                batch = []
+        if batch:
+            write_rows(batch)
+            exported += len(batch)
+        return exported
@@ -0,0 +1,343 @@
+import asyncio
+import functools
+import logging
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин задержек (секунды): от быстрых запросов из кэша до ожидания flood control
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+class Registry:
+    """Набор метрик, который отдается одним текстом в формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+
+    def register(self, metric: "_Metric"):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class _Metric:
+    """
+    Метрика с необязательными метками.
+
+    Значения меняются без блокировок: записывать их нужно из потока event loop.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self.labels()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Получить (или создать) значение метрики для набора меток"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _label_text(self, values: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+class _CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}_total{self._label_text(values)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+class _GaugeValue:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Читать значение при каждом запросе метрик (например, глубину очереди)"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return math.nan
+        return self.value
+
+class Gauge(_Metric):
+    """Текущее значение, которое может расти и уменьшаться"""
+
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{self._label_text(values)} {_format_value(child.get())}"
+            for values, child in self._children.items()
+        ]
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Последняя корзина — +Inf; счетчики храним по корзинам, накопленные считаем при выдаче
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class Histogram(_Metric):
+    """Распределение значений по фиксированным корзинам"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_text(values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+# Метрики бота
+HANDLER_LATENCY = Histogram(
+    'bot_handler_duration_seconds', 'Время обработки обновления обработчиком', ['handler']
+)
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors', 'Исключения в обработчиках', ['handler']
+)
+DB_QUERY_LATENCY = Histogram(
+    'bot_db_query_duration_seconds', 'Время запроса к БД, включая ожидание соединения', ['method']
+)
+DB_QUERY_ERRORS = Counter(
+    'bot_db_query_errors', 'Ошибки запросов к БД', ['method']
+)
+DB_QUEUE_DEPTH = Gauge(
+    'bot_db_queue_depth', 'Запросы к БД, которые выполняются или ждут соединения'
+)
+DB_CIRCUIT_STATE = Gauge(
+    'bot_db_circuit_state', 'Автомат защиты БД: 0 — замкнут, 1 — пробный запрос, 2 — разомкнут'
+)
+DB_CIRCUIT_REJECTED = Counter(
+    'bot_db_circuit_rejected', 'Запросы к БД, отклоненные разомкнутым автоматом защиты', ['method']
+)
+SPOOL_PENDING = Gauge(
+    'bot_spool_pending', 'Вопросы в локальном журнале, еще не перенесенные в БД'
+)
+TG_API_LATENCY = Histogram(
+    'bot_telegram_api_duration_seconds', 'Время HTTP-запроса к Bot API', ['method']
+)
+TG_API_ERRORS = Counter(
+    'bot_telegram_api_errors', 'Сетевые ошибки запросов к Bot API', ['method']
+)
+TG_RETRY_AFTER = Counter(
+    'bot_telegram_retry_after', 'Ответы 429 (RetryAfter) от Bot API', ['method']
+)
+OUTBOUND_QUEUE_DEPTH = Gauge(
+    'bot_outbound_queue_depth', 'Исходящие вызовы, которые ждут лимита или выполняются'
+)
+CLUSTER_NODES = Gauge(
+    'bot_cluster_nodes', 'Живые узлы кластера по данным последнего продления аренды'
+)
+CLUSTER_SLOTS_OWNED = Gauge(
+    'bot_cluster_slots_owned', 'Слоты обновлений, которыми владеет этот узел'
+)
+INBOX_INFLIGHT = Gauge(
+    'bot_inbox_inflight', 'Обновления из общего inbox, переданные в обработку и еще не удаленные'
+)
+LOG_RECORDS_DROPPED = Counter(
+    'bot_log_records_dropped', 'Записи лога, отброшенные из-за переполненной очереди', ['level']
+)
+EVENT_LOOP_LAG = Histogram(
+    'bot_event_loop_lag_seconds', 'Задержка пробуждения event loop относительно расписания'
+)
+UPDATE_LATENCY = Histogram(
+    'bot_update_duration_seconds', 'Время обработки обновления целиком, включая ожидание очереди чата'
+)
+SLOW_UPDATES = Counter(
+    'bot_slow_updates', 'Обновления, обработка которых заняла больше SLOW_UPDATE_MS'
+)
+
+def timed(histogram: Histogram, errors: Counter, name: str, ignore: Tuple[type, ...] = ()):
+    """
+    Декоратор корутины: время выполнения в histogram, исключения в errors.
+
+    Исключения из ignore (управление потоком, а не ошибки) не считаются.
+    """
+    latency = histogram.labels(name)
+    failures = errors.labels(name)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except ignore:
+                raise
+            except Exception:
+                failures.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+class EventLoopMonitor:
+    """Периодически засыпает на interval и измеряет, насколько позже проснулся"""
+
+    def __init__(self, interval: float = 0.5, histogram: Histogram = EVENT_LOOP_LAG):
+        self.interval = interval
+        self.histogram = histogram
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.histogram.observe(max(0.0, loop.time() - start - self.interval))
+
+class MetricsServer:
+    """Минимальный HTTP-сервер, отдающий метрики на GET /metrics"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 9100, registry: Registry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"📈 Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=5)
+            parts = head.split(b' ', 2)
+            path = parts[1].split(b'?', 1)[0] if len(parts) > 1 else b''
+            if parts[0] == b'GET' and path == b'/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
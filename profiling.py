@@ -0,0 +1,248 @@
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from metrics import SLOW_UPDATES, UPDATE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Этапы обработки обновления, которые замеряются отдельно; остаток времени — обработчик
+STAGE_TITLES = {
+    'wait': 'очередь чата',
+    'db': 'БД',
+    'throttle': 'лимиты отправки',
+    'telegram': 'Telegram API',
+    'handler': 'обработчик',
+}
+
+# Сколько функций показывать в каждой таблице cProfile
+REPORT_FUNCTIONS = 40
+
+class UpdateTrace:
+    """Замер одного обновления: время начала, сумма по этапам и сработавшие обработчики"""
+
+    __slots__ = ('update_id', 'started', 'stages', 'handlers', 'session')
+
+    def __init__(self, update_id: Optional[int], session: int = 0):
+        self.update_id = update_id
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.handlers: List[str] = []
+        # Номер выборки cProfile, в которую попало обновление (0 — ни в какую)
+        self.session = session
+
+# Замер текущего обновления: задача обработки и запросы, сделанные из нее, видят один объект
+_trace: ContextVar[Optional[UpdateTrace]] = ContextVar('update_trace', default=None)
+
+def add_stage(stage: str, seconds: float):
+    """Добавить время этапа к замеру текущего обновления (вне обновления — ничего не делает)"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.stages[stage] = trace.stages.get(stage, 0.0) + seconds
+
+def traced(callback):
+    """Обернуть обработчик отметкой его имени в замере обновления"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        trace = _trace.get()
+        if trace is not None:
+            trace.handlers.append(name)
+        return await callback(*args, **kwargs)
+    return wrapper
+
+def describe_stages(stages: Dict[str, float]) -> str:
+    """Разбивка по этапам в мс: «БД 120, Telegram API 850, обработчик 30»"""
+    return ', '.join(f"{STAGE_TITLES[stage]} {ms:.0f}" for stage, ms in stages.items() if ms or stage == 'handler')
+
+class UpdateProfiler:
+    """
+    Время обработки каждого обновления с разбивкой по этапам.
+
+    begin()/finish() вызываются процессором обновлений вокруг обработки. Этапы
+    (ожидание очереди чата, запросы к БД, лимиты отправки и вызовы Bot API)
+    досчитываются через add_stage() из того же контекста, а время обработчика —
+    остаток от общего. Этапы — суммы длительностей: при параллельных запросах
+    внутри одного обновления они могут превышать общее время.
+
+    Обновления дольше slow_threshold секунд (0 — не отслеживать) пишутся в лог,
+    последние keep_slow из них попадают в отчет. start_sampling(n) включает
+    cProfile на время обработки следующих n обновлений; профилируется весь поток
+    event loop, поэтому в отчет попадают и параллельные обновления, и фоновые задачи.
+    Пока выборка не идет, замер обновления — это два вызова perf_counter и сложение по этапам.
+    """
+
+    def __init__(self, slow_threshold: float, keep_slow: int = 100):
+        self.slow_threshold = slow_threshold
+        self.slow: Deque[Dict[str, Any]] = deque(maxlen=keep_slow)
+        self.slow_total = 0
+        self.updates = 0
+        self.wall_total = 0.0
+        self.totals = dict.fromkeys(STAGE_TITLES, 0.0)
+        self.sampling = False
+        self._session = 0
+        self._to_start = 0
+        self._running = 0
+        self._sampled = 0
+        self._profile: Optional[cProfile.Profile] = None
+        self._profile_started = 0.0
+        self._on_done: Optional[Callable[[str], Awaitable[Any]]] = None
+        self._last_profile: Optional[cProfile.Profile] = None
+        self._last_profile_info = ''
+        self._tasks = set()
+
+    def begin(self, update_id: Optional[int]) -> UpdateTrace:
+        """Начать замер обновления в текущем контексте"""
+        session = 0
+        if self._to_start:
+            self._to_start -= 1
+            self._running += 1
+            session = self._session
+            if self._profile is None:
+                self._enable_profile()
+        trace = UpdateTrace(update_id, session)
+        _trace.set(trace)
+        return trace
+
+    def finish(self, trace: UpdateTrace):
+        """Закончить замер: метрики, итоги по этапам и запись медленного обновления"""
+        wall = time.perf_counter() - trace.started
+        UPDATE_LATENCY.observe(wall)
+        stages = trace.stages
+        handler = max(0.0, wall - sum(stages.values()))
+        self.updates += 1
+        self.wall_total += wall
+        for stage, seconds in stages.items():
+            self.totals[stage] += seconds
+        self.totals['handler'] += handler
+        if self.slow_threshold and wall >= self.slow_threshold:
+            self._record_slow(trace, wall, handler)
+        if trace.session and trace.session == self._session and self.sampling:
+            self._running -= 1
+            self._sampled += 1
+            if not self._to_start and not self._running:
+                self.stop_sampling()
+
+    def _record_slow(self, trace: UpdateTrace, wall: float, handler: float):
+        SLOW_UPDATES.inc()
+        self.slow_total += 1
+        breakdown = {
+            stage: round(trace.stages.get(stage, 0.0) * 1000, 1) for stage in STAGE_TITLES if stage != 'handler'
+        }
+        breakdown['handler'] = round(handler * 1000, 1)
+        handlers = list(dict.fromkeys(trace.handlers))
+        self.slow.append({
+            "update_id": trace.update_id,
+            "at": datetime.utcnow(),
+            "wall_ms": round(wall * 1000, 1),
+            "stages_ms": breakdown,
+            "handlers": handlers,
+        })
+        logger.warning(
+            f"🐢 Медленное обновление {trace.update_id}: {wall * 1000:.0f} мс "
+            f"({describe_stages(breakdown)}; {', '.join(handlers) or 'без обработчиков'})",
+            extra={"stages_ms": breakdown, "handlers": handlers}
+        )
+
+    def start_sampling(self, updates: int, on_done: Optional[Callable[[str], Awaitable[Any]]] = None) -> bool:
+        """
+        Профилировать обработку следующих updates обновлений; по окончании
+        вызвать on_done(отчет). False — выборка уже идет.
+        """
+        if self.sampling:
+            return False
+        self.sampling = True
+        self._session += 1
+        self._to_start = updates
+        self._running = 0
+        self._sampled = 0
+        self._on_done = on_done
+        return True
+
+    def stop_sampling(self):
+        """Закончить выборку досрочно или по числу обновлений и отправить отчет"""
+        if not self.sampling:
+            return
+        self.sampling = False
+        self._to_start = 0
+        self._running = 0
+        profile, self._profile = self._profile, None
+        if profile is not None:
+            profile.disable()
+            self._last_profile = profile
+            self._last_profile_info = (
+                f"обновлений {self._sampled}, {time.perf_counter() - self._profile_started:.1f} с, "
+                f"закончена {datetime.utcnow():%d.%m.%Y %H:%M:%S} UTC"
+            )
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            task = asyncio.get_running_loop().create_task(on_done(self.report()))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _enable_profile(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Уже работает другой профилировщик (например, запущенный вручную)
+            logger.warning(f"⚠️ Профилирование не включено: {e}")
+            self.stop_sampling()
+            return
+        self._profile = profile
+        self._profile_started = time.perf_counter()
+        logger.info(f"🔬 Профилирование включено для обновлений: {self._to_start + self._running}")
+
+    def report(self) -> str:
+        """Текстовый отчет: итоги по этапам, последние медленные обновления и горячие функции"""
+        lines = [f"Профиль обработки обновлений, {datetime.utcnow():%d.%m.%Y %H:%M:%S} UTC", ""]
+
+        if self.updates:
+            lines.append(
+                f"Обновлений с запуска: {self.updates}, "
+                f"в среднем {self.wall_total / self.updates * 1000:.1f} мс"
+            )
+            lines.append("Время по этапам (суммы; параллельные запросы одного обновления могут пересекаться):")
+            for stage, title in STAGE_TITLES.items():
+                seconds = self.totals[stage]
+                lines.append(f"  {title:<16} {seconds:10.2f} с  {seconds / self.wall_total * 100:5.1f}%")
+        else:
+            lines.append("Обновлений с запуска еще не было")
+        lines.append("")
+
+        if self.slow_threshold:
+            lines.append(
+                f"Медленные обновления (дольше {self.slow_threshold * 1000:g} мс): "
+                f"{self.slow_total}, последние {len(self.slow)}:"
+            )
+            for entry in reversed(self.slow):
+                lines.append(
+                    f"  {entry['at']:%d.%m %H:%M:%S} #{entry['update_id']} {entry['wall_ms']:.0f} мс: "
+                    f"{describe_stages(entry['stages_ms'])}; {', '.join(entry['handlers']) or '-'}"
+                )
+        else:
+            lines.append("Медленные обновления не отслеживаются (SLOW_UPDATE_MS=0)")
+        lines.append("")
+
+        if self._last_profile is None:
+            lines.append("Выборки cProfile еще не было: /profile N профилирует следующие N обновлений")
+            return '\n'.join(lines) + '\n'
+
+        lines.append(f"cProfile, весь поток event loop: {self._last_profile_info}")
+        for sort, title in (('cumulative', 'с вызываемыми функциями'), ('tottime', 'собственное время')):
+            stream = io.StringIO()
+            stats = pstats.Stats(self._last_profile, stream=stream)
+            stats.strip_dirs().sort_stats(sort).print_stats(REPORT_FUNCTIONS)
+            lines.append("")
+            lines.append(f"=== Горячие функции: {title} ===")
+            lines.append(stream.getvalue().strip('\n'))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Забрать токены (можно в долг) и вернуть, сколько секунд подождать до их появления"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= tokens
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """Дождаться токенов; ожидающие обслуживаются в порядке очереди"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class SlidingWindowRate:
+    """Скользящее окно событий: счетчики по корзинам фиксированной ширины, память O(buckets)"""
+
+    def __init__(self, window: float = 60.0, buckets: int = 60):
+        self.window = window
+        self.bucket_width = window / buckets
+        self._counts = [0] * buckets
+        self._stamps = [-1] * buckets
+
+    def _slot(self, now: float):
+        tick = int(now / self.bucket_width)
+        return tick, tick % len(self._counts)
+
+    def add(self, count: int = 1):
+        tick, slot = self._slot(time.monotonic())
+        if self._stamps[slot] != tick:
+            self._stamps[slot] = tick
+            self._counts[slot] = 0
+        self._counts[slot] += count
+
+    def count(self) -> int:
+        """Сколько событий было за последнее окно"""
+        tick, _ = self._slot(time.monotonic())
+        oldest = tick - len(self._counts) + 1
+        return sum(c for c, stamp in zip(self._counts, self._stamps) if stamp >= oldest)
+
+    def per_minute(self) -> float:
+        return self.count() * 60.0 / self.window
+
+class UserRateLimiter:
+    """
+    Per-user token bucket с ограниченной памятью.
+
+    Состояние пользователя — короткий список [токены, время обновления,
+    блокировка до, предупрежден ли]. Записи упорядочены по последней активности:
+    простаивающие дольше времени полного восстановления бакета удаляются
+    (для них бакет и так полон), а при переполнении max_users вытесняются
+    самые давно неактивные пользователи.
+    """
+
+    def __init__(self, rate_per_minute: float = 5.0, burst: float = 3.0, cooldown: float = 60.0,
+                 max_users: int = 100000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.cooldown = cooldown
+        self.max_users = max_users
+        self.idle_ttl = max(burst / self.rate, cooldown)
+        self._state: "OrderedDict[int, list]" = OrderedDict()
+
+    def _expire(self, now: float):
+        while self._state:
+            user_id, state = next(iter(self._state.items()))
+            if now - state[1] < self.idle_ttl and len(self._state) <= self.max_users:
+                break
+            self._state.popitem(last=False)
+
+    def _touch(self, user_id: int, now: float) -> list:
+        state = self._state.pop(user_id, None)
+        if state is None:
+            state = [self.burst, now, 0.0, False]
+        else:
+            state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+        self._state[user_id] = state
+        return state
+
+    def check(self, user_id: int) -> Tuple[bool, float, bool]:
+        """Пропустить сообщение? Возвращает (разрешено, сколько ждать, нужно ли предупредить)"""
+        now = time.monotonic()
+        self._expire(now)
+        state = self._touch(user_id, now)
+        if state[2] > now:
+            return False, state[2] - now, self._notify_once(state)
+        if state[0] >= 1:
+            state[0] -= 1
+            state[3] = False
+            return True, 0.0, False
+        state[2] = now + self.cooldown
+        return False, self.cooldown, self._notify_once(state)
+
+    def block(self, user_id: int, seconds: float) -> bool:
+        """Заблокировать пользователя на время; True, если его стоит предупредить"""
+        now = time.monotonic()
+        self._expire(now)
+        state = self._touch(user_id, now)
+        state[2] = max(state[2], now + seconds)
+        return self._notify_once(state)
+
+    def snapshot(self) -> List[list]:
+        """
+        Состояние для перезапуска: [user_id, токены, секунд с обновления, секунд до
+        конца блокировки, предупрежден ли] от давно неактивных к недавним
+        """
+        now = time.monotonic()
+        return [[user_id, state[0], now - state[1], max(0.0, state[2] - now), state[3]]
+                for user_id, state in self._state.items()]
+
+    def restore(self, items: List[list], elapsed: float = 0.0):
+        """Восстановить состояние из snapshot(), сделанного elapsed секунд назад"""
+        now = time.monotonic()
+        for user_id, tokens, idle, blocked, notified in items:
+            idle += elapsed
+            if idle >= self.idle_ttl:
+                continue
+            blocked_until = now + blocked - elapsed if blocked > elapsed else 0.0
+            self._state.pop(user_id, None)
+            self._state[user_id] = [tokens, now - idle, blocked_until, notified]
+        self._expire(now)
+
+    @staticmethod
+    def _notify_once(state: list) -> bool:
+        if state[3]:
+            return False
+        state[3] = True
+        return True
+
+    def __len__(self) -> int:
+        return len(self._state)
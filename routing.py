@@ -0,0 +1,61 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class AdminRouter:
+    """
+    Выбор получателей вопроса.
+
+    broadcast    — вопрос получают все админы (как раньше);
+    round_robin  — админы получают вопросы по очереди;
+    least_loaded — вопрос получает админ с наименьшим числом неотвеченных назначенных вопросов;
+    weighted     — как least_loaded, но нагрузка делится на вес админа.
+    """
+
+    MODES = ('broadcast', 'round_robin', 'least_loaded', 'weighted')
+
+    def __init__(self, db, admin_ids: List[int], mode: str = 'broadcast',
+                 weights: Optional[Dict[int, float]] = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Неизвестный режим маршрутизации: {mode}")
+        if any(not weight > 0 for weight in (weights or {}).values()):
+            raise ValueError("Веса админов должны быть больше нуля")
+        self.db = db
+        self.admin_ids = list(admin_ids)
+        self.mode = mode
+        self.weights = weights or {}
+        self._next = 0
+
+    @property
+    def assigns(self) -> bool:
+        """Назначается ли вопрос одному админу"""
+        return self.mode != 'broadcast'
+
+    async def route(self, exclude: Iterable[int] = ()) -> Tuple[List[int], Optional[int]]:
+        """Вернуть (получатели, назначенный админ или None для рассылки всем)"""
+        if not self.assigns:
+            return self.admin_ids, None
+        admin_id = await self.pick(exclude)
+        return ([admin_id], admin_id) if admin_id is not None else ([], None)
+
+    async def pick(self, exclude: Iterable[int] = (), loads: Optional[Dict[int, int]] = None) -> Optional[int]:
+        """Выбрать одного админа; loads можно передать, чтобы не читать нагрузку из БД"""
+        exclude = set(exclude)
+        candidates = [admin_id for admin_id in self.admin_ids if admin_id not in exclude]
+        if not candidates:
+            return None
+
+        if self.mode == 'round_robin':
+            admin_id = candidates[self._next % len(candidates)]
+            self._next += 1
+            return admin_id
+
+        if loads is None:
+            loads = await self.db.get_admin_loads()
+        # При равной нагрузке — по очереди, чтобы не отдавать все первому в списке
+        offset = self._next % len(candidates)
+        self._next += 1
+        ordered = candidates[offset:] + candidates[:offset]
+        return min(ordered, key=lambda admin_id: loads.get(admin_id, 0) / self.weights.get(admin_id, 1.0))
+
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from telegram import Message
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+
+from cache import LRUCache
+from metrics import TG_API_ERRORS, TG_API_LATENCY, TG_RETRY_AFTER
+from profiling import add_stage
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class OutboundSender:
+    """
+    Общая точка отправки исходящих сообщений.
+
+    Соблюдает глобальный лимит Telegram и лимит на отдельный чат (token bucket),
+    при RetryAfter приостанавливает все отправки на указанное время,
+    временные сетевые ошибки повторяет с экспоненциальной задержкой.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_retries: int = 3, max_chat_buckets: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.share = 1.0
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets = LRUCache(max_chat_buckets)
+        self._paused_until = 0.0
+        self._pending = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Сколько вызовов сейчас ждут лимита или выполняются"""
+        return self._pending
+
+    def set_share(self, share: float):
+        """
+        Доля лимитов для этого экземпляра бота (1 / число узлов кластера):
+        лимиты Telegram действуют на бота целиком, а отправляют все узлы сразу.
+        """
+        if share == self.share:
+            return
+        self.share = share
+        self.global_bucket.rate = self.global_rate * share
+        # Корзины чатов создаются заново уже с новым лимитом
+        self._chat_buckets.clear()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate * self.share, self.chat_burst)
+            self._chat_buckets.put(chat_id, bucket)
+        return bucket
+
+    async def _acquire(self, chat_id: int):
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    async def call(self, chat_id: int, func: Callable[..., Awaitable[Any]], /, *args, **kwargs) -> Any:
+        """Вызвать метод Bot API для чата chat_id с учетом лимитов и повторов"""
+        self._pending += 1
+        try:
+            attempt = 0
+            while True:
+                started = time.perf_counter()
+                await self._acquire(chat_id)
+                add_stage('throttle', time.perf_counter() - started)
+                try:
+                    return await func(*args, **kwargs)
+                except RetryAfter as e:
+                    # Flood control действует на весь бот: притормаживаем все отправки
+                    self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                    logger.warning(f"⏳ RetryAfter {e.retry_after} с для чата {chat_id}")
+                    if attempt >= self.max_retries:
+                        raise
+                except BadRequest:
+                    # BadRequest наследуется от NetworkError, но повторять его бессмысленно
+                    raise
+                except NetworkError as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = 0.5 * 2 ** attempt + random.uniform(0, 0.5)
+                    logger.warning(f"⚠️ Временная ошибка отправки в чат {chat_id}: {e}, повтор через {delay:.1f} с")
+                    await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            self._pending -= 1
+
+    async def send_message(self, bot, chat_id: int, text: str, **kwargs) -> Message:
+        """Отправить сообщение через общий лимитер"""
+        return await self.call(chat_id, bot.send_message, chat_id=chat_id, text=text, **kwargs)
+
+    async def broadcast(self, bot, chat_ids: Iterable[int], text: str, **kwargs) -> Dict[int, Optional[Message]]:
+        """Параллельно отправить сообщение в несколько чатов; для неудачных — None"""
+        chat_ids = list(chat_ids)
+        results = await asyncio.gather(
+            *(self.send_message(bot, chat_id, text, **kwargs) for chat_id in chat_ids),
+            return_exceptions=True
+        )
+        sent = {}
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Не удалось отправить сообщение в чат {chat_id}: {result}")
+                sent[chat_id] = None
+            else:
+                sent[chat_id] = result
+        return sent
+
+    async def edit_messages(self, bot, targets: Iterable[Tuple[int, int]], text: str, **kwargs) -> int:
+        """
+        Параллельно заменить текст сообщений [(chat_id, message_id), ...] с учетом лимитов;
+        возвращает, сколько сообщений исправлено. Кнопки убираются, если не передан reply_markup.
+        """
+        targets = list(targets)
+        results = await asyncio.gather(
+            *(self.call(chat_id, bot.edit_message_text, chat_id=chat_id, message_id=message_id, text=text, **kwargs)
+              for chat_id, message_id in targets),
+            return_exceptions=True
+        )
+        edited = 0
+        for (chat_id, message_id), result in zip(targets, results):
+            if not isinstance(result, Exception):
+                edited += 1
+            elif not (isinstance(result, BadRequest) and 'not modified' in str(result).lower()):
+                # "Message is not modified" — сообщение уже исправлено (повторный ответ)
+                logger.error(f"❌ Не удалось изменить сообщение {message_id} в чате {chat_id}: {result}")
+        return edited
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-транспорт Bot API, который пишет время каждого вызова и ответы 429 в метрики"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TG_API_ERRORS.labels(api_method).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            TG_API_LATENCY.labels(api_method).observe(elapsed)
+            add_stage('telegram', elapsed)
+        if code == 429:
+            TG_RETRY_AFTER.labels(api_method).inc()
+        return code, payload
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class QuestionSpool:
+    """
+    Локальный журнал вопросов на время недоступности БД.
+
+    Записи дописываются в файл строками JSON. Одновременные append() копятся,
+    пока идет предыдущая запись, и уходят в файл одной пачкой с одним fsync:
+    append() возвращается, только когда запись уже на диске. Оборванная при
+    падении последняя строка при открытии отрезается.
+
+    replay() переименовывает журнал в path.replay (новые записи идут в новый
+    файл), переносит записи в БД пачками и удаляет файл, когда перенесено все.
+    Если перенос прервался, файл .replay переносится заново при следующем
+    вызове: повторная вставка уже перенесенных записей отбрасывается БД по их ключу.
+    Методы вызываются из потока event loop; файловые операции идут в пуле потоков.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.replay_path = path + '.replay'
+        self.pending = 0
+        self._buffer: List[Tuple[bytes, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # Запись пачки и переименование журнала не должны пересекаться
+        self._lock = asyncio.Lock()
+        self._replaying = False
+
+    async def open(self):
+        """Восстановить журнал после падения и посчитать неперенесенные записи"""
+        loop = asyncio.get_running_loop()
+        self.pending = await loop.run_in_executor(None, self._recover)
+        if self.pending:
+            logger.warning(f"📼 В журнале {self.path} неперенесенных вопросов: {self.pending}")
+
+    def _recover(self) -> int:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        count = 0
+        for path in (self.replay_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb+') as file:
+                data = file.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    logger.warning(f"⚠️ Журнал {path}: отрезана оборванная запись ({len(data) - end} байт)")
+                    file.truncate(end)
+                    os.fsync(file.fileno())
+                count += data.count(b'\n', 0, end)
+        return count
+
+    async def append(self, record: Dict[str, Any]):
+        """Дописать запись и дождаться, пока она окажется на диске"""
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((line, future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+        await future
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        while self._buffer:
+            batch, self._buffer = self._buffer, []
+            try:
+                async with self._lock:
+                    await loop.run_in_executor(None, self._write, b''.join(line for line, _ in batch))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.pending += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    def _write(self, data: bytes):
+        with open(self.path, 'ab') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _rotate(self) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Перенести журнал в файл .replay (если прошлый перенос не завершен — дописать к нему)
+        и прочитать записи; возвращает записи и число строк в файле
+        """
+        if os.path.exists(self.path):
+            if os.path.exists(self.replay_path):
+                with open(self.path, 'rb') as source, open(self.replay_path, 'ab') as target:
+                    target.write(source.read())
+                    target.flush()
+                    os.fsync(target.fileno())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.replay_path)
+            self._sync_directory()
+        if not os.path.exists(self.replay_path):
+            return [], 0
+        records = []
+        lines = 0
+        with open(self.replay_path, 'rb') as file:
+            for lines, line in enumerate(file, 1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.error(f"❌ Журнал {self.replay_path}: нечитаемая запись в строке {lines} пропущена")
+        return records, lines
+
+    def _finish(self):
+        if os.path.exists(self.replay_path):
+            os.remove(self.replay_path)
+            self._sync_directory()
+
+    def _sync_directory(self):
+        # Переименование и удаление файла надежны только после fsync каталога
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    async def replay(self, save_batch: Callable[[List[Dict[str, Any]]], Awaitable[Optional[list]]],
+                     batch_size: int = 500) -> list:
+        """
+        Перенести записи журнала через save_batch(records) -> [результат, ...] или None
+        при ошибке. Возвращает результаты перенесенных пачек.
+        """
+        if self._replaying:
+            return []
+        self._replaying = True
+        loop = asyncio.get_running_loop()
+        saved = []
+        try:
+            # Запись в журнал ждет только переименования, а не всего переноса
+            async with self._lock:
+                records, lines = await loop.run_in_executor(None, self._rotate)
+            for start in range(0, len(records), batch_size):
+                result = await save_batch(records[start:start + batch_size])
+                if result is None:
+                    logger.warning(f"⚠️ Перенос журнала прерван: перенесено {start} из {len(records)}")
+                    return saved
+                saved.extend(result)
+            await loop.run_in_executor(None, self._finish)
+            self.pending = max(0, self.pending - lines)
+            if lines:
+                logger.info(f"📼 Из журнала перенесено вопросов: {len(records)} (новых в БД: {len(saved)})")
+        finally:
+            self._replaying = False
+        return saved
+
+    async def close(self):
+        """Дождаться записи накопленных строк"""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
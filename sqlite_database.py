@@ -0,0 +1,926 @@
+import asyncio
+import functools
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Callable, List, Tuple, Union
+
+from storage import SEARCH_RANK_WINDOW, Storage, admin_message_rows, query_terms, search_text
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Признаки недоступности базы в тексте sqlite3.OperationalError
+_OUTAGE_REASONS = ('locked', 'busy', 'disk', 'i/o', 'unable to open', 'readonly')
+
+def _now() -> int:
+    """Текущее время (UTC) в микросекундах: так время хранится в SQLite"""
+    return time.time_ns() // 1000
+
+def _to_datetime(micros: Optional[int]) -> Optional[datetime]:
+    return None if micros is None else _EPOCH + timedelta(microseconds=micros)
+
+def _to_micros(value: datetime) -> int:
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+def _from_json(value: Optional[str]) -> Any:
+    return None if value is None else json.loads(value)
+
+def read_only(func: Callable) -> Callable:
+    """Пометить метод как только читающий: он выполняется на соединении-читателе параллельно с записью"""
+    func.read_only = True
+    return func
+
+class SQLiteDatabase(Storage):
+    """
+    Встроенное хранилище в файле SQLite (WAL).
+
+    Все записи идут через один поток-писатель с одним соединением: он забирает
+    из очереди все накопившиеся запросы (до max_batch), выполняет каждый в своей
+    точке сохранения и фиксирует пачку одним COMMIT. Результат возвращается
+    только после фиксации, поэтому пакетная фиксация не ослабляет гарантий,
+    а под нагрузкой делит стоимость COMMIT между запросами. Чтения выполняются
+    параллельно на readers отдельных соединениях: в режиме WAL писатель их
+    не блокирует. Подготовленные выражения кэшируются на каждом соединении.
+
+    DATABASE_URL: sqlite:///bot.db (относительный путь), sqlite:////var/data/bot.db
+    (абсолютный) или sqlite:///:memory: (в памяти, все запросы через писателя).
+    """
+
+    def __init__(self, url: str, max_size: int = 4, reply_cache_size: int = 10000,
+                 stats_cache_ttl: float = 2.0, max_batch: int = 128,
+                 breaker_threshold: int = 5, breaker_reset_timeout: float = 10.0,
+                 history_cache_ttl: float = 30.0, **_):
+        super().__init__(reply_cache_size=reply_cache_size, stats_cache_ttl=stats_cache_ttl,
+                         breaker_threshold=breaker_threshold, breaker_reset_timeout=breaker_reset_timeout,
+                         history_cache_ttl=history_cache_ttl)
+        path = url.split('://', 1)[1]
+        self.path = path[1:] if path.startswith('/') else path
+        self.max_batch = max_batch
+        # Число читателей берем из DB_POOL_MAX_SIZE; у базы в памяти соединение одно
+        self.readers = 0 if self.path == ':memory:' else max_size
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_error: Optional[Exception] = None
+        self._reader_executor: Optional[ThreadPoolExecutor] = None
+        self._reader_local = threading.local()
+        self._reader_connections: List[sqlite3.Connection] = []
+        self._reader_lock = threading.Lock()
+        self._listen_task: Optional[asyncio.Task] = None
+
+    @property
+    def supports_cluster(self) -> bool:
+        # Несколько процессов могут работать только с общим файлом
+        return self.path != ':memory:'
+
+    @property
+    def persistent(self) -> bool:
+        return self.path != ':memory:'
+
+    @property
+    def supports_spool(self) -> bool:
+        return self.path != ':memory:'
+
+    def _is_outage(self, error: Exception) -> bool:
+        # Файл заблокирован другим процессом дольше busy_timeout, диск заполнен или недоступен;
+        # прочие OperationalError (нет такой колонки и т.п.) — ошибки самого запроса
+        return isinstance(error, sqlite3.OperationalError) and any(
+            reason in str(error).lower() for reason in _OUTAGE_REASONS
+        )
+
+    def _open_connection(self, writer: bool) -> sqlite3.Connection:
+        # isolation_level=None: транзакциями управляем сами (BEGIN/SAVEPOINT/COMMIT)
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        # Основы слов для поискового индекса: триггеры FTS вызывают search_text при записи
+        conn.create_function('search_text', 1, search_text, deterministic=True)
+        conn.execute("PRAGMA busy_timeout = 5000")
+        if writer:
+            conn.execute("PRAGMA journal_mode = WAL")
+            # В WAL synchronous=NORMAL не теряет целостность, а COMMIT не ждет fsync
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+        else:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def connect(self):
+        """Запустить поток-писатель, открыть читателей и создать таблицы"""
+        if self._writer is None:
+            ready = threading.Event()
+            self._writer = threading.Thread(target=self._write_loop, args=(ready,), name='sqlite-writer', daemon=True)
+            self._writer.start()
+            await asyncio.get_running_loop().run_in_executor(None, ready.wait)
+            if self._writer_error is not None:
+                self._writer = None
+                raise self._writer_error
+            if self.readers:
+                self._reader_executor = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix='sqlite-read')
+        await self._submit(self._init_db)
+        logger.info(f"✅ База SQLite открыта: {self.path}")
+
+    async def close(self):
+        """Дождаться записи накопившихся запросов и закрыть соединения"""
+        await self.unlisten()
+        if self._reader_executor is not None:
+            self._reader_executor.shutdown(wait=True)
+            self._reader_executor = None
+        with self._reader_lock:
+            for conn in self._reader_connections:
+                conn.close()
+            self._reader_connections.clear()
+        if self._writer is not None:
+            self._queue.put(None)
+            await asyncio.get_running_loop().run_in_executor(None, self._writer.join)
+            self._writer = None
+        logger.info("🔌 База SQLite закрыта")
+
+    async def _submit(self, func: Callable, *args):
+        if getattr(func, 'read_only', False) and self._reader_executor is not None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._reader_executor, functools.partial(self._read, func, *args))
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((loop, future, func, args))
+        return await future
+
+    def _read(self, func: Callable, *args):
+        conn = getattr(self._reader_local, 'conn', None)
+        if conn is None:
+            conn = self._reader_local.conn = self._open_connection(writer=False)
+            with self._reader_lock:
+                self._reader_connections.append(conn)
+        # Одна читающая транзакция: все запросы функции видят один снимок
+        conn.execute("BEGIN")
+        try:
+            return func(conn, *args)
+        finally:
+            conn.execute("COMMIT")
+
+    def _write_loop(self, ready: threading.Event):
+        try:
+            conn = self._open_connection(writer=True)
+        except Exception as e:
+            self._writer_error = e
+            ready.set()
+            return
+        ready.set()
+        running = True
+        while running:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    running = False
+                    break
+                batch.append(job)
+            self._write_batch(conn, batch)
+        conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: list):
+        """Выполнить пачку запросов в одной транзакции; ошибка одного запроса откатывает только его"""
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for _, _, func, args in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((True, func(conn, *args)))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(False, e)] * len(batch)
+
+        for (loop, future, _, _), (ok, value) in zip(batch, results):
+            loop.call_soon_threadsafe(_resolve, future, ok, value)
+
+    def _init_db(self, conn):
+        """Создание таблиц в базе данных"""
+        fts_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'").fetchone() is not None
+        commands = (
+            """
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                message_id INTEGER,
+                admin_message_id INTEGER,
+                question_text TEXT NOT NULL,
+                answer_text TEXT,
+                asked_at INTEGER NOT NULL,
+                answered_at INTEGER,
+                is_answered INTEGER NOT NULL DEFAULT 0,
+                assigned_admin_id INTEGER,
+                assigned_at INTEGER,
+                claimed INTEGER NOT NULL DEFAULT 0,
+                duplicate_of INTEGER,
+                media_type TEXT,
+                media TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS admin_messages (
+                admin_chat_id INTEGER NOT NULL,
+                admin_message_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+                is_card INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (admin_chat_id, admin_message_id)
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_admin_messages_question ON admin_messages (question_id)",
+            """
+            CREATE TABLE IF NOT EXISTS question_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total INTEGER NOT NULL,
+                answered INTEGER NOT NULL
+            )
+            """,
+            """
+            INSERT OR IGNORE INTO question_stats (id, total, answered)
+            SELECT 1, COUNT(*), COALESCE(SUM(is_answered), 0) FROM questions
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_questions_pending
+            ON questions (asked_at DESC, id DESC) WHERE is_answered = 0
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+                chat_id INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at INTEGER NOT NULL,
+                last_error TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_outbox_next_attempt ON outbox (next_attempt_at, id)",
+            """
+            CREATE INDEX IF NOT EXISTS idx_questions_assigned
+            ON questions (assigned_admin_id, assigned_at) WHERE is_answered = 0
+            """,
+            # Архив старых отвеченных вопросов (секций в SQLite нет — одна таблица)
+            """
+            CREATE INDEX IF NOT EXISTS idx_questions_answered
+            ON questions (asked_at) WHERE is_answered = 1
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS questions_archive (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                message_id INTEGER,
+                question_text TEXT NOT NULL,
+                answer_text TEXT,
+                asked_at INTEGER NOT NULL,
+                answered_at INTEGER,
+                duplicate_of INTEGER,
+                media_type TEXT,
+                media TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_questions_archive_asked_at ON questions_archive (asked_at)",
+            # История вопросов пользователя (/myquestions): id — rowid, поэтому индекс покрывающий
+            "CREATE INDEX IF NOT EXISTS idx_questions_user ON questions (user_id, asked_at DESC, id DESC)",
+            # Полнотекстовый поиск (FTS5): rowid = id вопроса, один индекс на рабочую таблицу и архив.
+            # В индексе — основы слов (search_text): запрос ищет точные токены, а не префиксы
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+                question_terms, answer_terms, tokenize = 'unicode61 remove_diacritics 2'
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+                INSERT INTO questions_fts (rowid, question_terms, answer_terms)
+                VALUES (new.id, search_text(new.question_text), search_text(new.answer_text));
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF question_text, answer_text ON questions BEGIN
+                UPDATE questions_fts
+                SET question_terms = search_text(new.question_text), answer_terms = search_text(new.answer_text)
+                WHERE rowid = new.id;
+            END
+            """,
+            # При переносе в архив строка уже скопирована туда, и запись индекса остается
+            """
+            CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions
+            WHEN NOT EXISTS (SELECT 1 FROM questions_archive WHERE id = old.id) BEGIN
+                DELETE FROM questions_fts WHERE rowid = old.id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS questions_archive_fts_delete AFTER DELETE ON questions_archive BEGIN
+                DELETE FROM questions_fts WHERE rowid = old.id;
+            END
+            """,
+            # Кластер (несколько процессов на одном файле): узлы, аренда слотов, общий inbox
+            # и журнал событий, который узлы опрашивают вместо LISTEN/NOTIFY
+            """
+            CREATE TABLE IF NOT EXISTS cluster_nodes (
+                node_id TEXT PRIMARY KEY,
+                heartbeat_at INTEGER NOT NULL
+            ) WITHOUT ROWID
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS cluster_slots (
+                slot INTEGER PRIMARY KEY,
+                owner TEXT,
+                lease_until INTEGER
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS inbox (
+                update_id INTEGER PRIMARY KEY,
+                slot INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                received_at INTEGER NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS cluster_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                created_at INTEGER NOT NULL
+            )
+            """,
+        )
+        for command in commands:
+            conn.execute(command)
+        if not fts_exists:
+            # Индекс поиска для вопросов, записанных до его появления
+            conn.execute(
+                "INSERT INTO questions_fts (rowid, question_terms, answer_terms) "
+                "SELECT id, search_text(question_text), search_text(answer_text) FROM questions "
+                "UNION ALL SELECT id, search_text(question_text), search_text(answer_text) FROM questions_archive"
+            )
+        # Колонки, появившиеся позже таблиц; media — JSON [{"type", "file_id"}, ...],
+        # is_card — карточка вопроса (ее правят после ответа), а не копия вложения
+        added_columns = (
+            ("question_stats", "archived", "INTEGER NOT NULL DEFAULT 0"),
+            ("question_stats", "media", "INTEGER NOT NULL DEFAULT 0"),
+            ("question_stats", "archived_media", "INTEGER NOT NULL DEFAULT 0"),
+            ("questions", "media_type", "TEXT"),
+            ("questions", "media", "TEXT"),
+            ("questions_archive", "media_type", "TEXT"),
+            ("questions_archive", "media", "TEXT"),
+            ("admin_messages", "is_card", "INTEGER NOT NULL DEFAULT 1"),
+            ("questions", "spool_key", "TEXT"),
+            # JSON-список копий вложений, уже отправленных при неудачной попытке доставки
+            ("outbox", "sent_message_ids", "TEXT"),
+        )
+        for table, column, definition in added_columns:
+            columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        # Ключ записи локального журнала: повторный перенос того же вопроса не создаст дубль
+        conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_spool_key ON questions (spool_key) "
+            "WHERE spool_key IS NOT NULL"
+        )
+        # Ответ reply на копию, отправленную до таблицы admin_messages, ищется по старой колонке
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_questions_admin_message ON questions (admin_message_id) "
+            "WHERE admin_message_id IS NOT NULL"
+        )
+
+    def _save_spooled_questions(self, conn, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        saved = []
+        outbox = []
+        for record in records:
+            asked_at = int(record["asked_at"] * 1_000_000)
+            cursor = conn.execute(
+                "INSERT INTO questions (user_id, message_id, question_text, asked_at, assigned_admin_id, assigned_at, "
+                "duplicate_of, media_type, media, spool_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
+                (record["user_id"], record["message_id"], record["question_text"], asked_at,
+                 record["assigned_admin_id"], asked_at if record["assigned_admin_id"] is not None else None,
+                 record["duplicate_of"], record["media_type"],
+                 json.dumps(record["media"]) if record["media"] else None, record["key"])
+            )
+            if not cursor.rowcount:
+                continue
+            question_id = cursor.lastrowid
+            saved.append({"id": question_id, "user_id": record["user_id"],
+                          "question_text": record["question_text"], "media_type": record["media_type"]})
+            outbox.extend((question_id, chat_id, asked_at) for chat_id in record["recipients"])
+        if outbox:
+            conn.executemany("INSERT INTO outbox (question_id, chat_id, next_attempt_at) VALUES (?, ?, ?)", outbox)
+        if saved:
+            conn.execute(
+                "UPDATE question_stats SET total = total + ?, media = media + ?",
+                (len(saved), sum(1 for question in saved if question["media_type"]))
+            )
+        return saved
+
+    def _save_question(self, conn, user_id: int, message_id: int, question_text: str,
+                       recipients: List[int], assigned_admin_id: Optional[int], duplicate_of: Optional[int],
+                       media_type: Optional[str], media: Optional[List[Dict[str, str]]]) -> int:
+        now = _now()
+        question_id = conn.execute(
+            "INSERT INTO questions (user_id, message_id, question_text, asked_at, assigned_admin_id, assigned_at, "
+            "duplicate_of, media_type, media) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, message_id, question_text, now, assigned_admin_id,
+             now if assigned_admin_id is not None else None, duplicate_of,
+             media_type, json.dumps(media) if media else None)
+        ).lastrowid
+        conn.execute("UPDATE question_stats SET total = total + 1, media = media + ?", (int(media_type is not None),))
+        if recipients:
+            conn.executemany(
+                "INSERT INTO outbox (question_id, chat_id, next_attempt_at) VALUES (?, ?, ?)",
+                [(question_id, chat_id, now) for chat_id in recipients]
+            )
+        logger.debug(f"✅ Вопрос сохранен с ID: {question_id}")
+        return question_id
+
+    @read_only
+    def _get_question(self, conn, question_id: int) -> Optional[Dict[str, Any]]:
+        row = conn.execute(
+            "SELECT id, user_id, message_id, question_text, asked_at, is_answered, duplicate_of, media_type, media "
+            "FROM questions WHERE id = ?",
+            (question_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        question = dict(row)
+        question["asked_at"] = _to_datetime(question["asked_at"])
+        question["media"] = _from_json(question["media"])
+        question["is_answered"] = bool(question["is_answered"])
+        return question
+
+    @read_only
+    def _get_user_by_admin_message(self, conn, admin_chat_id: int, admin_message_id: int) -> Optional[Dict[str, Any]]:
+        row = conn.execute(
+            """
+            SELECT q.id, q.user_id, q.is_answered
+            FROM admin_messages m
+            JOIN questions q ON q.id = m.question_id
+            WHERE m.admin_chat_id = ? AND m.admin_message_id = ?
+            """,
+            (admin_chat_id, admin_message_id)
+        ).fetchone()
+        if row is None:
+            # Вопросы до таблицы admin_messages: ID копии хранился в самом вопросе без ID чата
+            row = conn.execute(
+                "SELECT id, user_id, is_answered FROM questions WHERE admin_message_id = ? ORDER BY id DESC LIMIT 1",
+                (admin_message_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"id": row["id"], "user_id": row["user_id"], "is_answered": bool(row["is_answered"])}
+
+    def _save_admin_messages(self, conn, rows: List[Tuple[int, int, int, bool]]):
+        conn.executemany(
+            "INSERT OR IGNORE INTO admin_messages (admin_chat_id, admin_message_id, question_id, is_card) "
+            "VALUES (?, ?, ?, ?)",
+            rows
+        )
+        logger.debug(f"✅ Сохранено {len(rows)} сообщений админов")
+
+    @read_only
+    def _get_question_cards(self, conn, question_id: int) -> List[Tuple[int, int]]:
+        rows = conn.execute(
+            "SELECT admin_chat_id, admin_message_id FROM admin_messages WHERE question_id = ? AND is_card = 1",
+            (question_id,)
+        ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def _claim_deliveries(self, conn, batch_size: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        # Писатель один, поэтому выборка и сдвиг аренды не пересекаются с другими обработчиками
+        now = _now()
+        rows = conn.execute(
+            """
+            SELECT o.id, o.question_id, o.chat_id, o.attempts + 1 AS attempts, o.sent_message_ids,
+                   q.user_id, q.message_id, q.question_text, q.asked_at, q.duplicate_of, q.media_type, q.media
+            FROM outbox o JOIN questions q ON q.id = o.question_id
+            WHERE o.next_attempt_at <= ?
+            ORDER BY o.next_attempt_at, o.id
+            LIMIT ?
+            """,
+            (now, batch_size)
+        ).fetchall()
+        lease_until = now + int(lease_seconds * 1_000_000)
+        conn.executemany(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?",
+            [(lease_until, row["id"]) for row in rows]
+        )
+        items = [dict(row) for row in rows]
+        for item in items:
+            item["asked_at"] = _to_datetime(item["asked_at"])
+            item["media"] = _from_json(item["media"])
+            item["sent_message_ids"] = _from_json(item["sent_message_ids"]) or []
+        return items
+
+    def _complete_deliveries(self, conn, delivered: List[Dict[str, Any]]):
+        rows = admin_message_rows(delivered)
+        if rows:
+            self._save_admin_messages(conn, rows)
+        conn.executemany("DELETE FROM outbox WHERE id = ?", [(item["id"],) for item in delivered])
+
+    def _reschedule_deliveries(self, conn, failed: List[Tuple[int, float, str, List[int]]]):
+        now = _now()
+        conn.executemany(
+            "UPDATE outbox SET next_attempt_at = ?, last_error = ?, sent_message_ids = ? WHERE id = ?",
+            [
+                (now + int(delay * 1_000_000), error, json.dumps(sent_message_ids) if sent_message_ids else None, outbox_id)
+                for outbox_id, delay, error, sent_message_ids in failed
+            ]
+        )
+
+    def _drop_deliveries(self, conn, outbox_ids: List[int]):
+        conn.executemany("DELETE FROM outbox WHERE id = ?", [(outbox_id,) for outbox_id in outbox_ids])
+
+    def _mark_as_answered(self, conn, question_id: int, answer_text: str):
+        updated = conn.execute(
+            "UPDATE questions SET answer_text = ?, is_answered = 1, answered_at = ? "
+            "WHERE id = ? AND is_answered = 0",
+            (answer_text, _now(), question_id)
+        ).rowcount
+        if updated:
+            conn.execute("UPDATE question_stats SET answered = answered + 1")
+        else:
+            # Повторный ответ: обновляем только текст, счетчики не трогаем
+            conn.execute("UPDATE questions SET answer_text = ? WHERE id = ?", (answer_text, question_id))
+        logger.debug(f"✅ Вопрос {question_id} отмечен как отвеченный")
+
+    def _close_question(self, conn, question_id: int) -> Union[int, bool]:
+        row = conn.execute(
+            "SELECT user_id FROM questions WHERE id = ? AND is_answered = 0", (question_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        conn.execute("UPDATE questions SET is_answered = 1, answered_at = ? WHERE id = ?", (_now(), question_id))
+        conn.execute("UPDATE question_stats SET answered = answered + 1")
+        logger.debug(f"✅ Вопрос {question_id} закрыт без ответа")
+        return row[0]
+
+    @read_only
+    def _get_admin_loads(self, conn) -> Dict[int, int]:
+        rows = conn.execute(
+            "SELECT assigned_admin_id, COUNT(*) FROM questions "
+            "WHERE is_answered = 0 AND assigned_admin_id IS NOT NULL GROUP BY assigned_admin_id"
+        ).fetchall()
+        return {admin_id: count for admin_id, count in rows}
+
+    def _claim_question(self, conn, question_id: int, admin_id: int) -> bool:
+        return conn.execute(
+            """
+            UPDATE questions
+            SET assigned_admin_id = ?, assigned_at = ?, claimed = 1
+            WHERE id = ? AND is_answered = 0
+              AND (claimed = 0 OR assigned_admin_id = ?)
+            """,
+            (admin_id, _now(), question_id, admin_id)
+        ).rowcount > 0
+
+    def _release_question(self, conn, question_id: int, admin_id: int) -> bool:
+        return conn.execute(
+            """
+            UPDATE questions
+            SET assigned_admin_id = NULL, claimed = 0
+            WHERE id = ? AND is_answered = 0 AND assigned_admin_id = ?
+            """,
+            (question_id, admin_id)
+        ).rowcount > 0
+
+    @read_only
+    def _get_overdue_assignments(self, conn, timeout_seconds: float, limit: int) -> List[Dict[str, Any]]:
+        rows = conn.execute(
+            """
+            SELECT id, assigned_admin_id FROM questions
+            WHERE is_answered = 0 AND claimed = 0 AND assigned_at < ?
+            ORDER BY assigned_at
+            LIMIT ?
+            """,
+            (_now() - int(timeout_seconds * 1_000_000), limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _reassign_question(self, conn, question_id: int, from_admin_id: Optional[int], to_admin_id: int) -> bool:
+        now = _now()
+        # IS сравнивает и с NULL: условие на прежнего админа защищает от гонки с claim
+        updated = conn.execute(
+            """
+            UPDATE questions
+            SET assigned_admin_id = ?, assigned_at = ?
+            WHERE id = ? AND is_answered = 0 AND claimed = 0 AND assigned_admin_id IS ?
+            """,
+            (to_admin_id, now, question_id, from_admin_id)
+        ).rowcount
+        if not updated:
+            return False
+        conn.execute(
+            "INSERT INTO outbox (question_id, chat_id, next_attempt_at) VALUES (?, ?, ?)",
+            (question_id, to_admin_id, now)
+        )
+        logger.info(f"🔀 Вопрос #{question_id} переназначен: {from_admin_id} -> {to_admin_id}")
+        return True
+
+    @read_only
+    def _search_questions(self, conn, query: str, limit: int, offset: int,
+                          preview_length: int) -> List[Dict[str, Any]]:
+        # Из ввода берутся только слова в кавычках, поэтому синтаксис MATCH не ломается
+        terms = query_terms(query)
+        if not terms:
+            return []
+        match = " ".join(f'"{term}"' for term in terms)
+        # Ранжируются только SEARCH_RANK_WINDOW самых новых совпадений: граница по rowid
+        # находится по индексу без ранжирования
+        oldest = conn.execute(
+            "SELECT rowid FROM questions_fts WHERE questions_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+            (match, SEARCH_RANK_WINDOW - 1)
+        ).fetchone()
+        rows = conn.execute(
+            """
+            SELECT hits.id, COALESCE(q.asked_at, a.asked_at) AS asked_at, COALESCE(q.is_answered, 1) AS is_answered,
+                   COALESCE(q.media_type, a.media_type) AS media_type,
+                   substr(COALESCE(q.question_text, a.question_text), 1, ?) AS preview,
+                   substr(COALESCE(q.answer_text, a.answer_text), 1, ?) AS answer_preview
+            FROM (
+                SELECT rowid AS id, bm25(questions_fts, 2.0, 1.0) AS rank
+                FROM questions_fts WHERE questions_fts MATCH ? AND rowid >= ?
+                ORDER BY rank, rowid DESC
+                LIMIT ? OFFSET ?
+            ) hits
+            LEFT JOIN questions q ON q.id = hits.id
+            LEFT JOIN questions_archive a ON a.id = hits.id
+            ORDER BY hits.rank, hits.id DESC
+            """,
+            (preview_length, preview_length, match, oldest[0] if oldest else 0, limit, offset)
+        ).fetchall()
+        return [
+            {**dict(row), "asked_at": _to_datetime(row["asked_at"]), "is_answered": bool(row["is_answered"])}
+            for row in rows
+        ]
+
+    def _archive_questions(self, conn, age_seconds: float, keep_archive: bool, limit: int) -> int:
+        # Писатель один, поэтому подзапрос выбирает одни и те же строки для переноса и удаления
+        batch = (
+            "SELECT id FROM questions WHERE is_answered = 1 AND asked_at < ? "
+            "ORDER BY asked_at, id LIMIT ?"
+        )
+        params = (_now() - int(age_seconds * 1_000_000), limit)
+        if keep_archive:
+            conn.execute(
+                "INSERT INTO questions_archive "
+                "(id, user_id, message_id, question_text, answer_text, asked_at, answered_at, duplicate_of, media_type, media) "
+                "SELECT id, user_id, message_id, question_text, answer_text, asked_at, answered_at, duplicate_of, media_type, media "
+                f"FROM questions WHERE id IN ({batch})",
+                params
+            )
+        moved_media = conn.execute(
+            f"SELECT COUNT(*) FROM questions WHERE id IN ({batch}) AND media_type IS NOT NULL", params
+        ).fetchone()[0]
+        # Копии у админов и доставки удаляются каскадом
+        moved = conn.execute(f"DELETE FROM questions WHERE id IN ({batch})", params).rowcount
+        if moved:
+            conn.execute(
+                "UPDATE question_stats SET archived = archived + ?, archived_media = archived_media + ?",
+                (moved, moved_media)
+            )
+        return moved
+
+    def _purge_archive(self, conn, age_seconds: float):
+        purged = conn.execute(
+            "DELETE FROM questions_archive WHERE asked_at < ?",
+            (_now() - int(age_seconds * 1_000_000),)
+        ).rowcount
+        if purged:
+            logger.info(f"🗑 Из архива удалено вопросов: {purged}")
+
+    @read_only
+    def _get_stats(self, conn) -> Dict[str, int]:
+        total, answered, media = conn.execute("SELECT total, answered, media FROM question_stats").fetchone()
+        return {
+            "total": total,
+            "answered": answered,
+            "pending": total - answered,
+            "media": media
+        }
+
+    def _reconcile_stats(self, conn):
+        old_total, old_answered, old_media, archived, archived_media = conn.execute(
+            "SELECT total, answered, media, archived, archived_media FROM question_stats"
+        ).fetchone()
+        total, answered, media = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(is_answered), 0), COUNT(media_type) FROM questions"
+        ).fetchone()
+        total, answered, media = total + archived, answered + archived, media + archived_media
+        if (total, answered, media) != (old_total, old_answered, old_media):
+            conn.execute("UPDATE question_stats SET total = ?, answered = ?, media = ?", (total, answered, media))
+            logger.warning(
+                f"⚠️ Счетчики статистики исправлены: {old_total}/{old_answered}/{old_media} "
+                f"-> {total}/{answered}/{media}"
+            )
+
+    @read_only
+    def _get_pending_page(self, conn, cursor: Optional[Tuple[datetime, int]], newer: bool,
+                          limit: int, preview_length: int) -> List[Dict[str, Any]]:
+        query = (
+            "SELECT id, asked_at, media_type, substr(question_text, 1, ?) AS preview "
+            "FROM questions WHERE is_answered = 0"
+        )
+        params: List[Any] = [preview_length]
+        if cursor:
+            query += " AND (asked_at, id) > (?, ?)" if newer else " AND (asked_at, id) < (?, ?)"
+            params.extend((_to_micros(cursor[0]), cursor[1]))
+        query += " ORDER BY asked_at ASC, id ASC" if newer else " ORDER BY asked_at DESC, id DESC"
+        query += " LIMIT ?"
+        params.append(limit)
+
+        rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+        for row in rows:
+            row["asked_at"] = _to_datetime(row["asked_at"])
+        return rows
+
+    @read_only
+    def _get_user_questions(self, conn, user_id: int, cursor: Optional[Tuple[datetime, int]], newer: bool,
+                            limit: int, preview_length: int) -> List[Dict[str, Any]]:
+        # Сначала ID страницы только по индексу, затем тексты только этих строк
+        page = "SELECT id, asked_at FROM questions WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if cursor:
+            page += " AND (asked_at, id) > (?, ?)" if newer else " AND (asked_at, id) < (?, ?)"
+            params.extend((_to_micros(cursor[0]), cursor[1]))
+        direction = "ASC" if newer else "DESC"
+        page += f" ORDER BY asked_at {direction}, id {direction} LIMIT ?"
+        params.append(limit)
+        query = (
+            "SELECT q.id, q.asked_at, q.is_answered, q.media_type, substr(q.question_text, 1, ?) AS preview, "
+            "substr(q.answer_text, 1, ?) AS answer_preview "
+            f"FROM ({page}) page JOIN questions q ON q.id = page.id "
+            f"ORDER BY q.asked_at {direction}, q.id {direction}"
+        )
+
+        rows = [dict(row) for row in conn.execute(query, [preview_length, preview_length] + params).fetchall()]
+        for row in rows:
+            row["asked_at"] = _to_datetime(row["asked_at"])
+            row["is_answered"] = bool(row["is_answered"])
+        return rows
+
+    @read_only
+    def _export_questions(self, conn, write_rows: Callable[[List[Tuple]], None], since: Optional[datetime],
+                          until: Optional[datetime], answered: Optional[bool], batch_size: int) -> int:
+        period = ""
+        period_params: List[Any] = []
+        if since:
+            period += " AND asked_at >= ?"
+            period_params.append(_to_micros(since))
+        if until:
+            period += " AND asked_at < ?"
+            period_params.append(_to_micros(until))
+
+        query = (
+            "SELECT id, asked_at, is_answered, answered_at, question_text, answer_text, duplicate_of, media_type "
+            "FROM questions WHERE 1" + period
+        )
+        params = list(period_params)
+        if answered is not None:
+            query += " AND is_answered = ?"
+            params.append(int(answered))
+        # В архиве только отвеченные вопросы
+        if answered is not False:
+            query += (
+                " UNION ALL SELECT id, asked_at, 1, answered_at, question_text, answer_text, duplicate_of, media_type "
+                "FROM questions_archive WHERE 1" + period
+            )
+            params.extend(period_params)
+        query += " ORDER BY id"
+
+        # Курсор SQLite читает строки по мере выборки: в памяти только одна пачка
+        exported = 0
+        cur = conn.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            write_rows([
+                (row[0], _to_datetime(row[1]), bool(row[2]), _to_datetime(row[3]), row[4], row[5], row[6], row[7])
+                for row in rows
+            ])
+            exported += len(rows)
+        logger.info(f"📦 Выгружено вопросов: {exported}")
+        return exported
+
+    # --- Кластер ---
+
+    def _cluster_heartbeat(self, conn, node_id: str, slots: int, lease_seconds: float) -> Dict[str, Any]:
+        # Запись идет в BEGIN IMMEDIATE: узлы выполняют heartbeat строго по очереди
+        now = _now()
+        lease = int(lease_seconds * 1_000_000)
+        conn.execute(
+            "INSERT INTO cluster_nodes (node_id, heartbeat_at) VALUES (?, ?) "
+            "ON CONFLICT (node_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+            (node_id, now)
+        )
+        conn.execute("DELETE FROM cluster_nodes WHERE heartbeat_at < ?", (now - 4 * lease,))
+        nodes = conn.execute("SELECT COUNT(*) FROM cluster_nodes WHERE heartbeat_at >= ?", (now - lease,)).fetchone()[0]
+        if conn.execute("SELECT COUNT(*) FROM cluster_slots").fetchone()[0] < slots:
+            conn.executemany("INSERT OR IGNORE INTO cluster_slots (slot) VALUES (?)", ((slot,) for slot in range(slots)))
+        conn.execute("UPDATE cluster_slots SET lease_until = ? WHERE owner = ? AND slot < ?", (now + lease, node_id, slots))
+        owned = [row[0] for row in conn.execute("SELECT slot FROM cluster_slots WHERE owner = ? AND slot < ?", (node_id, slots))]
+        want = -(-slots // max(nodes, 1)) - len(owned)
+        if want > 0:
+            free = [row[0] for row in conn.execute(
+                "SELECT slot FROM cluster_slots WHERE slot < ? AND (owner IS NULL OR lease_until < ?) ORDER BY slot LIMIT ?",
+                (slots, now, want)
+            )]
+            conn.executemany(
+                "UPDATE cluster_slots SET owner = ?, lease_until = ? WHERE slot = ?",
+                [(node_id, now + lease, slot) for slot in free]
+            )
+            owned.extend(free)
+        # Журнал событий нужен только узлам, которые опрашивают его прямо сейчас
+        conn.execute("DELETE FROM cluster_events WHERE created_at < ?", (now - max(4 * lease, 60_000_000),))
+        return {"owned": sorted(owned), "nodes": nodes}
+
+    def _release_slots(self, conn, node_id: str, slots: List[int], leave: bool):
+        if leave:
+            conn.execute("UPDATE cluster_slots SET owner = NULL, lease_until = NULL WHERE owner = ?", (node_id,))
+            conn.execute("DELETE FROM cluster_nodes WHERE node_id = ?", (node_id,))
+        else:
+            conn.executemany(
+                "UPDATE cluster_slots SET owner = NULL, lease_until = NULL WHERE owner = ? AND slot = ?",
+                [(node_id, slot) for slot in slots]
+            )
+
+    def _put_inbox(self, conn, update_id: int, slot: int, payload: str) -> bool:
+        return conn.execute(
+            "INSERT OR IGNORE INTO inbox (update_id, slot, payload, received_at) VALUES (?, ?, ?, ?)",
+            (update_id, slot, payload, _now())
+        ).rowcount > 0
+
+    @read_only
+    def _get_inbox(self, conn, slots: List[int], exclude: List[int], limit: int) -> List[Tuple[int, int, str]]:
+        rows = conn.execute(
+            f"SELECT update_id, slot, payload FROM inbox WHERE slot IN ({', '.join('?' * len(slots))}) "
+            f"AND update_id NOT IN ({', '.join('?' * len(exclude))}) ORDER BY update_id LIMIT ?",
+            (*slots, *exclude, limit)
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def _delete_inbox(self, conn, update_ids: List[int]) -> int:
+        return conn.executemany(
+            "DELETE FROM inbox WHERE update_id = ?", [(update_id,) for update_id in update_ids]
+        ).rowcount
+
+    def _publish(self, conn, payload: str):
+        conn.execute("INSERT INTO cluster_events (payload, created_at) VALUES (?, ?)", (payload, _now()))
+
+    @read_only
+    def _get_events(self, conn, after_id: Optional[int]) -> Tuple[int, List[str]]:
+        """События после after_id; без after_id — только ID последнего события"""
+        if after_id is None:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM cluster_events").fetchone()[0], []
+        rows = conn.execute("SELECT id, payload FROM cluster_events WHERE id > ? ORDER BY id", (after_id,)).fetchall()
+        return (rows[-1]["id"] if rows else after_id), [row["payload"] for row in rows]
+
+    async def listen(self, callback: Callable[[Optional[str]], None], poll_interval: float = 0.1):
+        """Опрашивать журнал cluster_events каждые poll_interval секунд (в SQLite нет LISTEN/NOTIFY)"""
+        if self._listen_task is None:
+            self._listen_task = asyncio.create_task(self._listen_loop(callback, poll_interval))
+
+    async def unlisten(self):
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+            try:
+                await self._listen_task
+            except asyncio.CancelledError:
+                pass
+            self._listen_task = None
+
+    async def _listen_loop(self, callback: Callable[[Optional[str]], None], poll_interval: float):
+        last_id = None
+        while True:
+            result = await self._run(self._get_events, last_id, error_message="❌ Ошибка чтения событий кластера")
+            if result is not None:
+                if last_id is None:
+                    callback(None)
+                last_id, payloads = result
+                for payload in payloads:
+                    callback(payload)
+            await asyncio.sleep(poll_interval)
+
+def _resolve(future: "asyncio.Future", ok: bool, value):
+    if future.cancelled():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
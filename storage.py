@@ -0,0 +1,795 @@
+import asyncio
+import logging
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Callable, List, Tuple, Union
+
+from cache import LRUCache, SingleFlight
+from circuit import CircuitBreaker
+from metrics import DB_CIRCUIT_REJECTED, DB_QUERY_ERRORS, DB_QUERY_LATENCY
+from profiling import add_stage
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(asked_at: datetime, question_id: int) -> str:
+    """Курсор страницы для callback_data: микросекунды от эпохи и ID вопроса"""
+    return f"{(asked_at - _EPOCH) // timedelta(microseconds=1)}_{question_id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    micros, question_id = cursor.split('_')
+    return _EPOCH + timedelta(microseconds=int(micros)), int(question_id)
+
+_WORD = re.compile(r'\w+')
+
+# Падежные окончания существительных и прилагательных для упрощенного стемминга,
+# от длинных к коротким. Глагольных ("ат", "ет") нет: они срезали бы основы вроде "возврат"
+_ENDINGS = sorted((
+    "ыми ими ями ами его ого ему ому ая яя ое ее ие ые ой ей ий ый ую юю ом ем ам ям ах ях ов ев ми "
+    "а я о е и ы у ю ь й"
+).split(), key=len, reverse=True)
+
+# Сколько самых новых совпадений ранжировать: частое слово совпадает с сотнями тысяч
+# вопросов, а ранжирование всех совпадений стоит сотни миллисекунд
+SEARCH_RANK_WINDOW = 5000
+
+def _stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 4:
+            return word[:-len(ending)]
+    return word
+
+def search_terms(text: str) -> List[str]:
+    """
+    Слова текста в нижнем регистре без окончаний ("вопросы", "вопросов" -> "вопрос").
+    Упрощенный стемминг для SQLite и памяти: в PostgreSQL работает словарь russian.
+    """
+    return [_stem(word) for word in _WORD.findall(text.lower())]
+
+def query_terms(query: str) -> List[str]:
+    """Слова поискового запроса: предлоги и союзы (1-2 буквы) отбрасываются, если есть другие слова"""
+    terms = search_terms(query)
+    return [term for term in terms if len(term) > 2] or terms
+
+def search_text(text: Optional[str]) -> str:
+    """Текст для поискового индекса: основы слов через пробел"""
+    return " ".join(search_terms(text or ""))
+
+# save_question: БД недоступна, вопрос записан в локальный журнал и получит номер при переносе
+SPOOLED = 0
+
+# Значение _run по умолчанию для недоступной БД — тот же default, что и для прочих ошибок
+_DEFAULT = object()
+
+def admin_message_rows(delivered: List[Dict[str, Any]]) -> List[Tuple[int, int, int, bool]]:
+    """
+    Строки admin_messages для выполненных доставок. Последний ID доставки —
+    карточка вопроса с кнопками, предыдущие — копии вложений.
+    """
+    return [
+        (item["chat_id"], message_id, item["question_id"], index == len(item["message_ids"]) - 1)
+        for item in delivered for index, message_id in enumerate(item["message_ids"])
+    ]
+
+def open_storage(url: str, **options) -> "Storage":
+    """
+    Создать хранилище по DATABASE_URL.
+
+    postgres:// и postgresql:// — PostgreSQL (Database), sqlite:///path.db —
+    встроенная SQLite, memory:// — в памяти процесса (данные теряются при
+    перезапуске). Драйвер PostgreSQL импортируется только при необходимости.
+    """
+    scheme = (url or '').split('://', 1)[0].lower()
+    if scheme in ('postgres', 'postgresql'):
+        from database import Database
+        return Database(url, **options)
+    if scheme == 'sqlite':
+        from sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(url, **options)
+    if scheme == 'memory':
+        from memory_database import MemoryDatabase
+        return MemoryDatabase(**options)
+    raise ValueError(f"Неподдерживаемый DATABASE_URL ({scheme or 'пусто'}): ожидается postgres://, sqlite:// или memory://")
+
+class Storage:
+    """
+    Хранилище вопросов: общий асинхронный интерфейс для бота.
+
+    Публичные методы одинаковы для всех бэкендов и отвечают за кэши, метрики
+    и обработку ошибок. Бэкенд реализует connect/close, _submit (где и как
+    выполнить синхронную функцию) и синхронные методы _name(conn, ...),
+    каждый из которых выполняется в одной транзакции.
+    """
+
+    def __init__(self, reply_cache_size: int = 10000, stats_cache_ttl: float = 2.0,
+                 breaker_threshold: int = 5, breaker_reset_timeout: float = 10.0,
+                 history_cache_ttl: float = 30.0):
+        self._pending = 0
+        # Отказы соединения с БД размыкают автомат: дальше запросы отклоняются сразу
+        self.breaker = CircuitBreaker("БД", breaker_threshold, breaker_reset_timeout)
+        # Журнал вопросов на время недоступности БД (QuestionSpool), подключается ботом
+        self.spool = None
+        # (admin_chat_id, admin_message_id) -> {"id", "user_id"}; эти поля вопроса не меняются
+        self.reply_cache = LRUCache(reply_cache_size)
+        # Статистика: строка-счетчик + короткий кэш и склейка одновременных запросов
+        self.stats_cache_ttl = stats_cache_ttl
+        self._stats_cache: Optional[Tuple[float, Dict[str, int]]] = None
+        self._stats_flight = SingleFlight()
+        # История вопросов пользователя: user_id -> (истекает, {(курсор, направление, размер): страница})
+        self.history_cache_ttl = history_cache_ttl
+        self._history_cache = LRUCache(10000)
+        # Растет при каждом сбросе: страницу, прочитанную во время сброса, не кэшируем
+        self._history_epoch = 0
+
+    @property
+    def supports_cluster(self) -> bool:
+        """Можно ли запустить на этом хранилище несколько экземпляров бота"""
+        return False
+
+    @property
+    def persistent(self) -> bool:
+        """Переживают ли данные перезапуск процесса (иначе кэши из снимка состояния устарели бы)"""
+        return True
+
+    @property
+    def supports_spool(self) -> bool:
+        """Может ли хранилище стать недоступным, так что вопросам нужен локальный журнал"""
+        return False
+
+    async def connect(self):
+        """Открыть хранилище и создать таблицы"""
+        raise NotImplementedError
+
+    async def close(self):
+        """Закрыть хранилище"""
+        raise NotImplementedError
+
+    async def _submit(self, func: Callable, *args):
+        """Выполнить func(conn, *args) в одной транзакции"""
+        raise NotImplementedError
+
+    @property
+    def queue_depth(self) -> int:
+        """Сколько запросов сейчас выполняется или ждет очереди"""
+        return self._pending
+
+    def _is_outage(self, error: Exception) -> bool:
+        """Ошибка означает недоступность БД (соединение, таймаут), а не ошибку самого запроса"""
+        return False
+
+    async def _run(self, func: Callable, *args, default=None, unavailable=_DEFAULT,
+                   error_message: str = "❌ Ошибка БД"):
+        """
+        Выполнить запрос, не блокируя event loop; при ошибке вернуть default.
+
+        Пока автомат защиты разомкнут, запрос не выполняется; при недоступной БД
+        возвращается unavailable (по умолчанию тот же default).
+        """
+        method = func.__name__.lstrip('_')
+        if unavailable is _DEFAULT:
+            unavailable = default
+        if not self.breaker.allow():
+            DB_CIRCUIT_REJECTED.labels(method).inc()
+            return unavailable
+        start = time.perf_counter()
+        self._pending += 1
+        try:
+            result = await self._submit(func, *args)
+        except asyncio.CancelledError:
+            # Отмена (например, по сроку остановки) не успех и не отказ; иначе отмененный
+            # пробный вызов оставил бы автомат полуоткрытым и отклоняющим все вызовы
+            self.breaker.cancelled()
+            raise
+        except Exception as e:
+            DB_QUERY_ERRORS.labels(method).inc()
+            logger.error(f"{error_message}: {e}")
+            if self._is_outage(e):
+                self.breaker.failure()
+                return unavailable
+            self.breaker.success()
+            return default
+        finally:
+            self._pending -= 1
+            elapsed = time.perf_counter() - start
+            DB_QUERY_LATENCY.labels(method).observe(elapsed)
+            add_stage('db', elapsed)
+        self.breaker.success()
+        return result
+
+    # --- Вопросы ---
+
+    async def save_question(self, user_id: int, message_id: int, question_text: str,
+                            recipients: List[int] = (), assigned_admin_id: Optional[int] = None,
+                            duplicate_of: Optional[int] = None, media_type: Optional[str] = None,
+                            media: Optional[List[Dict[str, str]]] = None) -> Optional[int]:
+        """
+        Сохранить вопрос от пользователя и поставить его доставку recipients в outbox.
+
+        Для вопроса с вложениями question_text — подпись (может быть пустой),
+        media_type — вид вложения или 'album', media — [{"type", "file_id"}, ...].
+
+        Если БД недоступна и подключен журнал, вопрос записывается в журнал
+        и возвращается SPOOLED: в БД его перенесет replay_spool().
+        """
+        question_id = await self._run(
+            self._save_question, user_id, message_id, question_text, list(recipients), assigned_admin_id, duplicate_of,
+            media_type, media,
+            unavailable=SPOOLED,
+            error_message="❌ Ошибка сохранения вопроса"
+        )
+        self.invalidate_user_questions(user_id)
+        if question_id == SPOOLED:
+            return await self._spool_question({
+                "key": uuid.uuid4().hex, "asked_at": time.time(),
+                "user_id": user_id, "message_id": message_id, "question_text": question_text,
+                "recipients": list(recipients), "assigned_admin_id": assigned_admin_id,
+                "duplicate_of": duplicate_of, "media_type": media_type, "media": media,
+            })
+        self._stats_cache = None
+        return question_id
+
+    async def _spool_question(self, record: Dict[str, Any]) -> Optional[int]:
+        if self.spool is None:
+            return None
+        try:
+            await self.spool.append(record)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи вопроса в журнал: {e}")
+            return None
+        logger.warning(f"📼 БД недоступна: вопрос пользователя {record['user_id']} записан в журнал")
+        return SPOOLED
+
+    async def replay_spool(self, batch_size: int = 500) -> List[Dict[str, Any]]:
+        """
+        Перенести вопросы из журнала в БД пачками, каждая — одной транзакцией.
+        Возвращает новые вопросы {"id", "user_id", "question_text", "media_type"}.
+        """
+        if self.spool is None:
+            return []
+        saved = await self.spool.replay(self._save_spooled, batch_size)
+        if saved:
+            self._stats_cache = None
+            for question in saved:
+                self.invalidate_user_questions(question["user_id"])
+        return saved
+
+    async def _save_spooled(self, records: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        return await self._run(
+            self._save_spooled_questions, records,
+            error_message="❌ Ошибка переноса вопросов из журнала"
+        )
+
+    async def get_question(self, question_id: int) -> Optional[Dict[str, Any]]:
+        """Получить вопрос по ID"""
+        return await self._run(
+            self._get_question, question_id,
+            error_message="❌ Ошибка получения вопроса"
+        )
+
+    async def get_user_by_admin_message(self, admin_chat_id: int, admin_message_id: int) -> Optional[Dict[str, Any]]:
+        """Найти пользователя по ID сообщения с вопросом в чате админа"""
+        key = (admin_chat_id, admin_message_id)
+        cached = self.reply_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+
+        question = await self._run(
+            self._get_user_by_admin_message, admin_chat_id, admin_message_id,
+            error_message="❌ Ошибка поиска пользователя"
+        )
+        if question:
+            self.reply_cache.put(key, {"id": question["id"], "user_id": question["user_id"]})
+        return question
+
+    async def save_admin_messages(self, question_id: int, user_id: int, admin_messages: List[Tuple[int, int]],
+                                  media_messages: List[Tuple[int, int]] = ()):
+        """
+        Сохранить ID копий вопроса у админов одной вставкой: карточки вопроса
+        admin_messages и копии вложений media_messages, [(admin_chat_id, admin_message_id), ...]
+        """
+        rows = ([(chat_id, message_id, question_id, True) for chat_id, message_id in admin_messages]
+                + [(chat_id, message_id, question_id, False) for chat_id, message_id in media_messages])
+        if not rows:
+            return
+        await self._run(
+            self._save_admin_messages, rows,
+            error_message="❌ Ошибка сохранения ID сообщений админов"
+        )
+        for admin_chat_id, admin_message_id, _, _ in rows:
+            self.reply_cache.put((admin_chat_id, admin_message_id), {"id": question_id, "user_id": user_id})
+
+    async def get_question_cards(self, question_id: int) -> List[Tuple[int, int]]:
+        """Карточки вопроса у админов (без копий вложений): [(admin_chat_id, admin_message_id), ...]"""
+        return await self._run(
+            self._get_question_cards, question_id,
+            default=[],
+            error_message="❌ Ошибка выборки карточек вопроса"
+        )
+
+    async def mark_as_answered(self, question_id: int, answer_text: str):
+        """Отметить вопрос как отвеченный"""
+        await self._run(
+            self._mark_as_answered, question_id, answer_text,
+            error_message="❌ Ошибка отметки ответа"
+        )
+        self._stats_cache = None
+
+    async def close_question(self, question_id: int) -> Union[int, bool, None]:
+        """
+        Отметить вопрос отвеченным без текста ответа (кнопка «Отвечено»).
+        Возвращает user_id автора вопроса; False — вопрос уже был отвечен, None — ошибка БД.
+        """
+        closed = await self._run(
+            self._close_question, question_id,
+            error_message="❌ Ошибка закрытия вопроса"
+        )
+        if closed:
+            self._stats_cache = None
+        return closed
+
+    # --- Outbox ---
+
+    async def claim_deliveries(self, batch_size: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        """
+        Забрать пачку готовых к отправке доставок из outbox.
+
+        Забранные доставки сдвигаются на lease_seconds вперед: пока идет отправка,
+        их не возьмет другой обработчик, а если процесс упадет, доставка вернется
+        в очередь после истечения аренды.
+        """
+        return await self._run(
+            self._claim_deliveries, batch_size, lease_seconds,
+            default=[],
+            error_message="❌ Ошибка выборки доставок из outbox"
+        )
+
+    async def complete_deliveries(self, delivered: List[Dict[str, Any]]):
+        """Записать ID доставленных сообщений и убрать доставки из outbox одной транзакцией"""
+        if not delivered:
+            return
+        await self._run(
+            self._complete_deliveries, delivered,
+            error_message="❌ Ошибка завершения доставок"
+        )
+        for item in delivered:
+            for message_id in item["message_ids"]:
+                self.reply_cache.put((item["chat_id"], message_id), {"id": item["question_id"], "user_id": item["user_id"]})
+
+    async def reschedule_deliveries(self, failed: List[Tuple[int, float, str, List[int]]]):
+        """
+        Отложить неудачные доставки: [(outbox_id, задержка в секундах, текст ошибки,
+        ID уже отправленных копий вложений), ...]
+        """
+        if not failed:
+            return
+        await self._run(
+            self._reschedule_deliveries, failed,
+            error_message="❌ Ошибка переноса доставок"
+        )
+
+    async def drop_deliveries(self, outbox_ids: List[int]):
+        """Убрать из outbox доставки, которые не удастся выполнить"""
+        if not outbox_ids:
+            return
+        await self._run(
+            self._drop_deliveries, outbox_ids,
+            error_message="❌ Ошибка удаления доставок"
+        )
+
+    # --- Назначение вопросов ---
+
+    async def get_admin_loads(self) -> Dict[int, int]:
+        """Число неотвеченных вопросов, назначенных каждому админу"""
+        return await self._run(
+            self._get_admin_loads,
+            default={},
+            error_message="❌ Ошибка получения нагрузки админов"
+        )
+
+    async def claim_question(self, question_id: int, admin_id: int) -> bool:
+        """Закрепить вопрос за админом; False, если он уже взят другим или отвечен"""
+        return await self._run(
+            self._claim_question, question_id, admin_id,
+            default=False,
+            error_message="❌ Ошибка закрепления вопроса"
+        )
+
+    async def release_question(self, question_id: int, admin_id: int) -> bool:
+        """Снять вопрос с админа; False, если вопрос не был за ним"""
+        return await self._run(
+            self._release_question, question_id, admin_id,
+            default=False,
+            error_message="❌ Ошибка снятия вопроса"
+        )
+
+    async def get_overdue_assignments(self, timeout_seconds: float, limit: int = 100) -> List[Dict[str, Any]]:
+        """Назначенные, но не взятые в работу вопросы без ответа дольше timeout_seconds"""
+        return await self._run(
+            self._get_overdue_assignments, timeout_seconds, limit,
+            default=[],
+            error_message="❌ Ошибка поиска просроченных назначений"
+        )
+
+    async def reassign_question(self, question_id: int, from_admin_id: Optional[int], to_admin_id: int) -> bool:
+        """Переназначить вопрос и поставить доставку новому админу в outbox"""
+        return await self._run(
+            self._reassign_question, question_id, from_admin_id, to_admin_id,
+            default=False,
+            error_message="❌ Ошибка переназначения вопроса"
+        )
+
+    # --- Статистика и очередь неотвеченных ---
+
+    async def get_stats(self) -> Dict[str, int]:
+        """Получить статистику вопросов (за постоянное время, из строки-счетчика)"""
+        cached = self._stats_cache
+        if cached and cached[0] > time.monotonic():
+            return dict(cached[1])
+        stats = await self._stats_flight.do("stats", self._load_stats)
+        return dict(stats)
+
+    async def _load_stats(self) -> Dict[str, int]:
+        stats = await self._run(
+            self._get_stats,
+            error_message="❌ Ошибка получения статистики"
+        )
+        if stats is None:
+            return {"total": 0, "answered": 0, "pending": 0, "media": 0}
+        self._stats_cache = (time.monotonic() + self.stats_cache_ttl, stats)
+        return stats
+
+    async def reconcile_stats(self):
+        """Пересчитать счетчики по таблице вопросов и исправить накопившийся дрейф"""
+        await self._run(self._reconcile_stats, error_message="❌ Ошибка сверки статистики")
+        self._stats_cache = None
+
+    async def get_pending_page(self, cursor: Optional[str] = None, newer: bool = False,
+                               limit: int = 10, preview_length: int = 100) -> Dict[str, Any]:
+        """
+        Страница неотвеченных вопросов, от новых к старым (keyset-пагинация по (asked_at, id)).
+
+        cursor — граница из encode_cursor: без него возвращается первая страница,
+        newer=False листает к более старым вопросам, newer=True — к более новым.
+        Текст вопроса обрезается до preview_length символов на стороне БД.
+        """
+        # Берем на строку больше, чтобы понять, есть ли следующая страница,
+        # и на символ больше превью, чтобы понять, обрезан ли текст
+        rows = await self._run(
+            self._get_pending_page, cursor and decode_cursor(cursor), newer, limit + 1, preview_length + 1,
+            default=[],
+            error_message="❌ Ошибка получения неотвеченных вопросов"
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if newer:
+            rows.reverse()
+        items = []
+        for row in rows:
+            preview = row["preview"]
+            if len(preview) > preview_length:
+                preview = preview[:preview_length] + "..."
+            items.append({
+                "id": row["id"],
+                "asked_at": row["asked_at"],
+                "preview": preview,
+                "media_type": row["media_type"],
+                "cursor": encode_cursor(row["asked_at"], row["id"]),
+            })
+        stats = await self.get_stats()
+        return {
+            "items": items,
+            "total": stats["pending"],
+            "has_older": has_more if not newer else bool(items),
+            "has_newer": has_more if newer else cursor is not None,
+        }
+
+    # --- История вопросов пользователя ---
+
+    async def get_user_questions(self, user_id: int, cursor: Optional[str] = None, newer: bool = False,
+                                 limit: int = 5, preview_length: int = 200) -> Optional[Dict[str, Any]]:
+        """
+        Страница вопросов пользователя со статусом и ответом, от новых к старым
+        (keyset-пагинация по (asked_at, id), курсоры — как у get_pending_page).
+
+        Страница выбирается по индексу (user_id, asked_at, id), а тексты вопроса
+        и ответа читаются только для ее строк. Страницы пользователя кэшируются
+        на history_cache_ttl секунд: новый вопрос сбрасывает кэш сам, ответ —
+        через invalidate_user_questions(); отметка «Отвечено» и изменения на других
+        узлах кластера видны после истечения кэша. None — ошибка БД.
+        """
+        key = (cursor, newer, limit)
+        now = time.monotonic()
+        cached = self._history_cache.get(user_id)
+        if cached is not None and cached[0] > now and key in cached[1]:
+            return cached[1][key]
+
+        epoch = self._history_epoch
+        rows = await self._run(
+            self._get_user_questions, user_id, cursor and decode_cursor(cursor), newer, limit + 1, preview_length + 1,
+            error_message="❌ Ошибка получения вопросов пользователя"
+        )
+        if rows is None:
+            return None
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if newer:
+            rows.reverse()
+        items = []
+        for row in rows:
+            item = dict(row)
+            for field in ("preview", "answer_preview"):
+                if item[field] and len(item[field]) > preview_length:
+                    item[field] = item[field][:preview_length] + "..."
+            item["cursor"] = encode_cursor(row["asked_at"], row["id"])
+            items.append(item)
+        page = {
+            "items": items,
+            "has_older": has_more if not newer else bool(items),
+            "has_newer": has_more if newer else cursor is not None,
+        }
+
+        if epoch != self._history_epoch:
+            return page
+        cached = self._history_cache.get(user_id)
+        if cached is None or cached[0] <= now:
+            cached = (now + self.history_cache_ttl, {})
+            self._history_cache.put(user_id, cached)
+        cached[1][key] = page
+        return page
+
+    def invalidate_user_questions(self, user_id: int):
+        """Сбросить кэш истории вопросов пользователя (новый вопрос или ответ на него)"""
+        self._history_epoch += 1
+        self._history_cache.pop(user_id)
+
+    # --- Поиск ---
+
+    async def search_questions(self, query: str, page: int = 0, limit: int = 10,
+                               preview_length: int = 100) -> Dict[str, Any]:
+        """
+        Полнотекстовый поиск по вопросам и ответам (включая архив), от самых релевантных.
+
+        Страницы листаются по номеру (OFFSET): порядок по релевантности не дает
+        устойчивого курсора, а дальше первых страниц поиск обычно не листают.
+        """
+        rows = await self._run(
+            self._search_questions, query, limit + 1, page * limit, preview_length + 1,
+            default=[],
+            error_message="❌ Ошибка поиска вопросов"
+        )
+        items = []
+        for row in rows[:limit]:
+            item = dict(row)
+            for key in ("preview", "answer_preview"):
+                if item[key] and len(item[key]) > preview_length:
+                    item[key] = item[key][:preview_length] + "..."
+            items.append(item)
+        return {"items": items, "has_more": len(rows) > limit}
+
+    # --- Хранение и архив ---
+
+    async def archive_questions(self, age_seconds: float, keep_archive: bool = True, limit: int = 1000) -> int:
+        """
+        Убрать из рабочей таблицы до limit отвеченных вопросов старше age_seconds.
+
+        keep_archive=True переносит их в questions_archive (в PostgreSQL — в месячные
+        секции), False — удаляет. Копии у админов и доставки удаляются вместе с вопросом.
+        Статистика не меняется: счетчики archived и archived_media (из них с вложениями)
+        учитывают ушедшие вопросы при сверке.
+        Возвращает число перенесенных вопросов.
+        """
+        moved = await self._run(
+            self._archive_questions, age_seconds, keep_archive, limit,
+            default=0,
+            error_message="❌ Ошибка переноса вопросов в архив"
+        )
+        if moved:
+            # Копий у админов больше нет: ответ на них не должен найти вопрос через кэш
+            self.reply_cache.clear()
+        return moved
+
+    async def purge_archive(self, age_seconds: float):
+        """Удалить из архива вопросы старше age_seconds (в PostgreSQL — целыми месячными секциями)"""
+        await self._run(
+            self._purge_archive, age_seconds,
+            error_message="❌ Ошибка очистки архива"
+        )
+
+    # --- Выгрузка ---
+
+    async def export_questions(self, write_rows: Callable[[List[Tuple]], None], since: Optional[datetime] = None,
+                               until: Optional[datetime] = None, answered: Optional[bool] = None,
+                               batch_size: int = 1000) -> Optional[int]:
+        """
+        Выгрузить вопросы (включая архив) по возрастанию id пачками по batch_size строк.
+
+        write_rows получает каждую пачку (кортежи в порядке export.EXPORT_COLUMNS)
+        прямо в потоке БД, так что память не растет с числом строк. Фильтры:
+        asked_at в [since, until), answered — только отвеченные/неотвеченные.
+        Возвращает число выгруженных строк или None при ошибке.
+        """
+        return await self._run(
+            self._export_questions, write_rows, since, until, answered, batch_size,
+            error_message="❌ Ошибка выгрузки вопросов"
+        )
+
+    def invalidate_stats(self):
+        """Сбросить кэш статистики (например, когда вопрос записал другой экземпляр бота)"""
+        self._stats_cache = None
+
+    # --- Кластер: несколько экземпляров бота на одной БД ---
+
+    async def cluster_heartbeat(self, node_id: str, slots: int, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        Отметить узел живым, продлить аренду его слотов и занять свободные слоты
+        (без владельца или с истекшей арендой) до справедливой доли: ceil(slots / живых узлов).
+
+        Возвращает {"owned": [слоты узла], "nodes": число живых узлов} или None при ошибке.
+        """
+        return await self._run(
+            self._cluster_heartbeat, node_id, slots, lease_seconds,
+            error_message="❌ Ошибка продления аренды слотов"
+        )
+
+    async def release_slots(self, node_id: str, slots: List[int], leave: bool = False):
+        """Отдать слоты другим узлам; leave=True — узел выходит из кластера"""
+        await self._run(
+            self._release_slots, node_id, list(slots), leave,
+            error_message="❌ Ошибка освобождения слотов"
+        )
+
+    async def put_inbox(self, update_id: int, slot: int, payload: str) -> Optional[bool]:
+        """Записать обновление в общий inbox; False — уже записано, None — ошибка БД"""
+        return await self._run(
+            self._put_inbox, update_id, slot, payload,
+            error_message="❌ Ошибка записи обновления в inbox"
+        )
+
+    async def get_inbox(self, slots: List[int], exclude: List[int], limit: int) -> List[Tuple[int, int, str]]:
+        """Необработанные обновления слотов по возрастанию update_id, кроме exclude: [(update_id, slot, payload), ...]"""
+        if not slots:
+            return []
+        return await self._run(
+            self._get_inbox, list(slots), list(exclude), limit,
+            default=[],
+            error_message="❌ Ошибка чтения inbox"
+        )
+
+    async def delete_inbox(self, update_ids: List[int]) -> Optional[int]:
+        """Убрать обработанные обновления из inbox; возвращает число удаленных или None при ошибке"""
+        if not update_ids:
+            return 0
+        return await self._run(
+            self._delete_inbox, list(update_ids),
+            error_message="❌ Ошибка очистки inbox"
+        )
+
+    async def publish(self, payload: str):
+        """Разослать событие всем узлам кластера (включая отправителя)"""
+        await self._run(self._publish, payload, error_message="❌ Ошибка публикации события")
+
+    async def listen(self, callback: Callable[[Optional[str]], None]):
+        """
+        Подписаться на события кластера: callback(payload) вызывается в event loop.
+        callback(None) означает, что события могли быть пропущены (переподключение).
+        """
+        raise NotImplementedError
+
+    async def unlisten(self):
+        """Отписаться от событий кластера"""
+        raise NotImplementedError
+
+    # --- Синхронные методы бэкенда: каждый выполняется в одной транзакции ---
+
+    def _save_question(self, conn, user_id: int, message_id: int, question_text: str,
+                       recipients: List[int], assigned_admin_id: Optional[int], duplicate_of: Optional[int],
+                       media_type: Optional[str], media: Optional[List[Dict[str, str]]]) -> int:
+        raise NotImplementedError
+
+    def _save_spooled_questions(self, conn, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Вставить вопросы из журнала с их временем asked_at (UNIX-время) и доставками;
+        записи, чей key уже есть в БД (повторный перенос), пропускаются
+        """
+        raise NotImplementedError
+
+    def _get_question(self, conn, question_id: int) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def _get_user_by_admin_message(self, conn, admin_chat_id: int, admin_message_id: int) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def _save_admin_messages(self, conn, rows: List[Tuple[int, int, int, bool]]):
+        """Строки (admin_chat_id, admin_message_id, question_id, is_card)"""
+        raise NotImplementedError
+
+    def _get_question_cards(self, conn, question_id: int) -> List[Tuple[int, int]]:
+        raise NotImplementedError
+
+    def _mark_as_answered(self, conn, question_id: int, answer_text: str):
+        raise NotImplementedError
+
+    def _close_question(self, conn, question_id: int) -> Union[int, bool]:
+        raise NotImplementedError
+
+    def _claim_deliveries(self, conn, batch_size: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def _complete_deliveries(self, conn, delivered: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def _reschedule_deliveries(self, conn, failed: List[Tuple[int, float, str, List[int]]]):
+        raise NotImplementedError
+
+    def _drop_deliveries(self, conn, outbox_ids: List[int]):
+        raise NotImplementedError
+
+    def _get_admin_loads(self, conn) -> Dict[int, int]:
+        raise NotImplementedError
+
+    def _claim_question(self, conn, question_id: int, admin_id: int) -> bool:
+        raise NotImplementedError
+
+    def _release_question(self, conn, question_id: int, admin_id: int) -> bool:
+        raise NotImplementedError
+
+    def _get_overdue_assignments(self, conn, timeout_seconds: float, limit: int) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def _reassign_question(self, conn, question_id: int, from_admin_id: Optional[int], to_admin_id: int) -> bool:
+        raise NotImplementedError
+
+    def _get_stats(self, conn) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def _reconcile_stats(self, conn):
+        raise NotImplementedError
+
+    def _get_pending_page(self, conn, cursor: Optional[Tuple[datetime, int]], newer: bool,
+                          limit: int, preview_length: int) -> List[Dict[str, Any]]:
+        """Строки {"id", "asked_at", "preview", "media_type"}; preview — первые preview_length символов"""
+        raise NotImplementedError
+
+    def _export_questions(self, conn, write_rows: Callable[[List[Tuple]], None], since: Optional[datetime],
+                          until: Optional[datetime], answered: Optional[bool], batch_size: int) -> int:
+        raise NotImplementedError
+
+    def _archive_questions(self, conn, age_seconds: float, keep_archive: bool, limit: int) -> int:
+        raise NotImplementedError
+
+    def _purge_archive(self, conn, age_seconds: float):
+        raise NotImplementedError
+
+    def _get_user_questions(self, conn, user_id: int, cursor: Optional[Tuple[datetime, int]], newer: bool,
+                            limit: int, preview_length: int) -> List[Dict[str, Any]]:
+        """
+        Строки {"id", "asked_at", "is_answered", "media_type", "preview", "answer_preview"}
+        в порядке листания; тексты обрезаны до preview_length символов
+        """
+        raise NotImplementedError
+
+    def _search_questions(self, conn, query: str, limit: int, offset: int,
+                          preview_length: int) -> List[Dict[str, Any]]:
+        """Строки {"id", "asked_at", "is_answered", "media_type", "preview", "answer_preview"} по убыванию релевантности"""
+        raise NotImplementedError
+
+    def _cluster_heartbeat(self, conn, node_id: str, slots: int, lease_seconds: float) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def _release_slots(self, conn, node_id: str, slots: List[int], leave: bool):
+        raise NotImplementedError
+
+    def _put_inbox(self, conn, update_id: int, slot: int, payload: str) -> bool:
+        raise NotImplementedError
+
+    def _get_inbox(self, conn, slots: List[int], exclude: List[int], limit: int) -> List[Tuple[int, int, str]]:
+        raise NotImplementedError
+
+    def _delete_inbox(self, conn, update_ids: List[int]) -> int:
+        raise NotImplementedError
+
+    def _publish(self, conn, payload: str):
+        raise NotImplementedError
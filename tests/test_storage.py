@@ -0,0 +1,178 @@
+"""Одинаковое поведение бэкендов хранилища (в памяти и SQLite) через общий интерфейс Storage"""
+import asyncio
+
+import pytest
+
+from storage import open_storage
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def url(request, tmp_path):
+    if request.param == 'memory':
+        return 'memory://'
+    return f"sqlite:///{tmp_path / 'bot.db'}"
+
+def run(url, scenario):
+    """Выполнить scenario(db) на открытом хранилище без кэша статистики"""
+    async def main():
+        db = open_storage(url, stats_cache_ttl=0)
+        await db.connect()
+        try:
+            return await scenario(db)
+        finally:
+            await db.close()
+    return asyncio.run(main())
+
+async def save(db, user_id, text, recipients=()):
+    question_id = await db.save_question(user_id, 1, text, recipients=recipients)
+    assert question_id
+    return question_id
+
+def test_save_answer_close(url):
+    async def scenario(db):
+        first = await save(db, 100, "первый вопрос")
+        second = await save(db, 101, "второй вопрос")
+        question = await db.get_question(first)
+        assert question["user_id"] == 100
+        assert question["question_text"] == "первый вопрос"
+        assert not question["is_answered"]
+
+        await db.mark_as_answered(first, "ответ")
+        question = await db.get_question(first)
+        assert question["is_answered"]
+
+        # Закрытие возвращает автора вопроса, повторное закрытие ничего не меняет
+        assert await db.close_question(second) == 101
+        assert await db.close_question(second) is False
+        assert await db.get_question(10 ** 6) is None
+    run(url, scenario)
+
+def test_stats_counters(url):
+    async def scenario(db):
+        assert await db.get_stats() == {"total": 0, "answered": 0, "pending": 0, "media": 0}
+        ids = [await save(db, 100 + i, f"вопрос {i}") for i in range(5)]
+        await db.save_question(200, 1, "", media_type="photo", media=[{"type": "photo", "file_id": "f"}])
+        await db.mark_as_answered(ids[0], "ответ")
+        await db.close_question(ids[1])
+        await db.close_question(ids[1])
+        stats = await db.get_stats()
+        assert stats == {"total": 6, "answered": 2, "pending": 4, "media": 1}
+        # Сверка с таблицей не находит дрейфа
+        await db.reconcile_stats()
+        assert await db.get_stats() == stats
+    run(url, scenario)
+
+def test_reconcile_counts_archived_media(url):
+    async def scenario(db):
+        first = await db.save_question(200, 1, "", media_type="photo", media=[{"type": "photo", "file_id": "f"}])
+        await save(db, 100, "вопрос")
+        await db.mark_as_answered(first, "ответ")
+        assert await db.archive_questions(0, keep_archive=False) == 1
+        stats = await db.get_stats()
+        assert stats == {"total": 2, "answered": 1, "pending": 1, "media": 1}
+        # Удаленный вопрос с вложением остается в счетчике после сверки
+        await db.reconcile_stats()
+        assert await db.get_stats() == stats
+    run(url, scenario)
+
+def test_pending_page_keyset(url):
+    async def scenario(db):
+        ids = [await save(db, 100 + i, f"вопрос {i}") for i in range(7)]
+        await db.mark_as_answered(ids[3], "ответ")
+        pending = [question_id for question_id in reversed(ids) if question_id != ids[3]]
+
+        first = await db.get_pending_page(limit=3)
+        assert [item["id"] for item in first["items"]] == pending[:3]
+        assert first["total"] == 6
+        assert first["has_older"] and not first["has_newer"]
+
+        second = await db.get_pending_page(first["items"][-1]["cursor"], limit=3)
+        assert [item["id"] for item in second["items"]] == pending[3:6]
+        assert second["has_newer"]
+
+        last = await db.get_pending_page(second["items"][-1]["cursor"], limit=3)
+        assert last["items"] == [] and not last["has_older"]
+
+        back = await db.get_pending_page(second["items"][0]["cursor"], newer=True, limit=3)
+        assert [item["id"] for item in back["items"]] == pending[:3]
+        assert not back["has_newer"]
+    run(url, scenario)
+
+def test_outbox_claim_and_finish(url):
+    async def scenario(db):
+        delivered_id = await save(db, 100, "вопрос", recipients=[1, 2])
+        items = await db.claim_deliveries(10, lease_seconds=60)
+        assert sorted(item["chat_id"] for item in items) == [1, 2]
+        assert all(item["question_id"] == delivered_id and item["attempts"] == 1 for item in items)
+        # Забранные доставки арендованы и не выдаются повторно
+        assert await db.claim_deliveries(10, lease_seconds=60) == []
+
+        done, later = sorted(items, key=lambda item: item["chat_id"])
+        await db.complete_deliveries([{**done, "message_ids": [55, 56]}])
+        await db.reschedule_deliveries([(later["id"], 0, "сеть", [57])])
+        retried = await db.claim_deliveries(10, lease_seconds=60)
+        assert [(item["id"], item["attempts"]) for item in retried] == [(later["id"], 2)]
+        # Копии вложений, отправленные неудачной попыткой, возвращаются с доставкой
+        assert retried[0]["sent_message_ids"] == [57]
+        assert done["sent_message_ids"] == []
+
+        await db.drop_deliveries([later["id"]])
+        await db.reschedule_deliveries([])
+        assert await db.claim_deliveries(10, lease_seconds=0) == []
+
+        # Последний ID доставки — карточка вопроса, предыдущие — копии вложений
+        assert await db.get_question_cards(delivered_id) == [(1, 56)]
+        db.reply_cache.clear()
+        for message_id in (55, 56):
+            question = await db.get_user_by_admin_message(1, message_id)
+            assert (question["id"], question["user_id"]) == (delivered_id, 100)
+        assert await db.get_user_by_admin_message(2, 56) is None
+    run(url, scenario)
+
+def test_admin_message_lookup(url):
+    async def scenario(db):
+        question_id = await save(db, 100, "вопрос")
+        await db.save_admin_messages(question_id, 100, [(1, 10), (2, 20)], [(1, 9)])
+        db.reply_cache.clear()
+        for chat_id, message_id in ((1, 10), (2, 20), (1, 9)):
+            question = await db.get_user_by_admin_message(chat_id, message_id)
+            assert (question["id"], question["user_id"]) == (question_id, 100)
+        assert await db.get_user_by_admin_message(3, 10) is None
+        assert sorted(await db.get_question_cards(question_id)) == [(1, 10), (2, 20)]
+    run(url, scenario)
+
+def test_cancelled_probe_releases_breaker(url):
+    async def scenario(db):
+        db.breaker.reset_timeout = 0
+        for _ in range(db.breaker.failure_threshold):
+            db.breaker.failure()
+        submit = db._submit
+
+        async def hanging_submit(func, *args):
+            await asyncio.sleep(3600)
+
+        # Пробный вызов отменяется, не дождавшись БД (как при остановке бота)
+        db._submit = hanging_submit
+        probe = asyncio.ensure_future(db.get_question(1))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        db._submit = submit
+        question_id = await save(db, 100, "вопрос после отмены")
+        assert db.breaker.state == 'closed'
+        assert (await db.get_question(question_id))["user_id"] == 100
+    run(url, scenario)
+
+def test_legacy_admin_message_lookup(tmp_path):
+    async def scenario(db):
+        question_id = await save(db, 100, "вопрос до таблицы admin_messages")
+
+        def set_legacy_id(conn):
+            conn.execute("UPDATE questions SET admin_message_id = 77 WHERE id = ?", (question_id,))
+        await db._submit(set_legacy_id)
+        # ID чата у старых копий неизвестен: находятся по одному ID сообщения
+        question = await db.get_user_by_admin_message(1, 77)
+        assert (question["id"], question["user_id"]) == (question_id, 100)
+        assert await db.get_user_by_admin_message(1, 78) is None
+    run(f"sqlite:///{tmp_path / 'bot.db'}", scenario)
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import sys
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from logs import bind_update
+from profiling import UpdateProfiler, add_stage
+
+logger = logging.getLogger(__name__)
+
+def chat_key(update: object) -> Optional[int]:
+    """Ключ упорядочивания обновления: ID чата, а без чата — ID пользователя"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+class RecentUpdates:
+    """
+    ID последних обработанных обновлений (не больше maxlen).
+
+    После перезапуска Telegram повторно присылает обновления, получение которых
+    не было подтверждено; уже обработанные из них по этому списку пропускаются.
+    """
+
+    def __init__(self, maxlen: int = 10000):
+        self._order = deque(maxlen=maxlen)
+        self._ids: Set[int] = set()
+
+    def add(self, update_id: int):
+        if update_id in self._ids:
+            return
+        if len(self._order) == self._order.maxlen:
+            self._ids.discard(self._order[0])
+        self._order.append(update_id)
+        self._ids.add(update_id)
+
+    def extend(self, update_ids: Iterable[int]):
+        for update_id in update_ids:
+            self.add(update_id)
+
+    @property
+    def last(self) -> Optional[int]:
+        """Наибольший обработанный ID"""
+        return max(self._ids) if self._ids else None
+
+    def __contains__(self, update_id: int) -> bool:
+        return update_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def snapshot(self) -> List[int]:
+        return list(self._order)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления разных чатов обрабатываются одновременно (не больше
+    max_concurrent_updates), а обновления одного чата — строго по очереди:
+    задачи начинаются в порядке поступления, сразу же встают в FIFO-очередь
+    asyncio.Lock своего чата и поэтому не обгоняют друг друга. Слот
+    параллельной обработки занимается только после замка чата: обновления,
+    ждущие свой чат, не отнимают слоты у остальных чатов.
+
+    on_processed(update) вызывается после обработки каждого обновления
+    (в кластерном режиме по нему из inbox удаляются обработанные обновления),
+    а ID обработанных обновлений запоминаются в recent. profiler замеряет время
+    каждого обновления с разбивкой по этапам, включая ожидание очереди чата.
+
+    cancel_after(timeout) ограничивает остановку: обновления, не обработанные
+    за timeout секунд, отменяются, а новые больше не начинаются. Тот же срок
+    действует на фоновые задачи обработчиков, переданные в track()
+    (application.create_task: альбомы, выгрузки, публикации в кластер) —
+    их PTB иначе дожидается при остановке без ограничения.
+    """
+
+    def __init__(self, max_concurrent_updates: int,
+                 on_processed: Optional[Callable[[object], None]] = None,
+                 recent: Optional[RecentUpdates] = None,
+                 profiler: Optional[UpdateProfiler] = None):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должно быть положительным")
+        # Семафор PTB охватывает весь do_process_update вместе с ожиданием замка чата:
+        # всплеск обновлений одного чата занял бы им все слоты. Поэтому PTB получает
+        # неограниченный лимит, а свой семафор захватывается уже под замком чата.
+        # __init__ PTB строит семафор по max_concurrent_updates, поэтому настоящий лимит
+        # подставляется после него
+        self._limit = sys.maxsize
+        super().__init__(sys.maxsize)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self.on_processed = on_processed
+        self.recent = recent
+        self.profiler = profiler
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._users: Dict[int, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._background: Set[asyncio.Task] = set()
+        self._cancelled = False
+        self._deadline: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        """Сколько обновлений обрабатывается одновременно"""
+        return self._limit
+
+    @property
+    def inflight(self) -> int:
+        """Сколько обновлений обрабатывается или ждет очереди своего чата"""
+        return len(self._tasks)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        update_id = getattr(update, 'update_id', None)
+        if self._cancelled:
+            # on_processed не вызывается: в кластере обновление остается в inbox для другого узла
+            coroutine.close()
+            logger.warning(f"⚠️ Обновление {update_id} не обработано: бот останавливается")
+            return
+        # Каждое обновление обрабатывается в своей задаче: контекст лога не смешивается
+        bind_update(update_id)
+        trace = self.profiler.begin(update_id) if self.profiler is not None else None
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        interrupted = False
+        try:
+            await self._process_in_order(update, coroutine)
+            if self.recent is not None and update_id is not None:
+                self.recent.add(update_id)
+        except asyncio.CancelledError:
+            if not self._cancelled:
+                raise
+            # Отменено по истечении срока остановки: обновление не считается обработанным
+            interrupted = True
+            logger.warning(f"⚠️ Обработка обновления {update_id} прервана остановкой бота")
+        finally:
+            self._tasks.discard(task)
+            if trace is not None:
+                self.profiler.finish(trace)
+            if self.on_processed is not None and not interrupted:
+                self.on_processed(update)
+
+    def track(self, task: asyncio.Task):
+        """Подчинить сроку остановки фоновую задачу обработчика"""
+        if self._cancelled:
+            task.cancel()
+            return
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def cancel_after(self, timeout: float):
+        """Через timeout секунд отменить необработанные обновления (повторный вызов переносит срок)"""
+        if self._deadline is not None:
+            self._deadline.cancel()
+        self._deadline = asyncio.get_running_loop().call_later(max(0.0, timeout), self._cancel_all)
+
+    def _cancel_all(self):
+        self._cancelled = True
+        if self._tasks or self._background:
+            logger.warning(
+                f"⏱ Срок остановки истек, прерываются обновления: {len(self._tasks)}, "
+                f"фоновые задачи: {len(self._background)}"
+            )
+        for task in self._tasks | self._background:
+            task.cancel()
+
+    async def _process_in_order(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = chat_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            started = time.perf_counter()
+            async with lock, self._slots:
+                add_stage('wait', time.perf_counter() - started)
+                await coroutine
+        finally:
+            # Убираем замок, когда у чата не осталось ожидающих обновлений
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Версия формата файла: снимок другой версии не загружается
+SNAPSHOT_VERSION = 1
+
+class WarmState:
+    """
+    Снимок состояния процесса в памяти для быстрого перезапуска.
+
+    Части состояния регистрируются через register(name, dump, load): dump()
+    возвращает данные для JSON, load(data, elapsed) восстанавливает их, где
+    elapsed — сколько секунд прошло с момента снимка. Файл записывается
+    атомарно (временный файл, fsync, os.replace): падение посреди записи
+    оставляет прежний снимок. Снимок старше max_age не загружается — за это
+    время кэши могли устареть. Методы вызываются из потока event loop.
+    """
+
+    def __init__(self, path: str, max_age: float = 600.0):
+        self.path = path
+        self.max_age = max_age
+        self._parts: Dict[str, Tuple[Callable[[], Any], Callable[[Any, float], None]]] = {}
+        self._lock = asyncio.Lock()
+
+    def register(self, name: str, dump: Callable[[], Any], load: Callable[[Any, float], None]):
+        self._parts[name] = (dump, load)
+
+    async def load(self) -> bool:
+        """Восстановить части состояния из файла; False — снимка нет или он не подходит"""
+        loop = asyncio.get_running_loop()
+        try:
+            snapshot = await loop.run_in_executor(None, self._read)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Снимок состояния {self.path} не прочитан: {e}")
+            return False
+
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"⚠️ Снимок состояния {self.path} другой версии, пропущен")
+            return False
+        elapsed = max(0.0, time.time() - snapshot.get("saved_at", 0))
+        if elapsed > self.max_age:
+            logger.info(f"💤 Снимок состояния устарел ({elapsed:.0f} с), запуск с пустыми кэшами")
+            return False
+
+        parts = snapshot.get("parts", {})
+        for name, (_, load) in self._parts.items():
+            if name not in parts:
+                continue
+            try:
+                load(parts[name], elapsed)
+            except Exception as e:
+                logger.error(f"❌ Ошибка восстановления состояния {name}: {e}", exc_info=True)
+        logger.info(f"♨️ Состояние восстановлено из снимка {elapsed:.0f}-секундной давности")
+        return True
+
+    def _read(self) -> Dict[str, Any]:
+        with open(self.path, 'rb') as file:
+            return json.loads(file.read())
+
+    async def save(self):
+        """Записать снимок всех частей состояния"""
+        # Данные собираются в потоке event loop, сериализация и запись — в пуле потоков
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "parts": {name: dump() for name, (dump, _) in self._parts.items()},
+        }
+        async with self._lock:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, snapshot)
+            except (OSError, TypeError, ValueError) as e:
+                logger.error(f"❌ Ошибка сохранения снимка состояния: {e}")
+
+    def _write(self, snapshot: Dict[str, Any]):
+        data = json.dumps(snapshot, ensure_ascii=False, separators=(',', ':')).encode()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        # Переименование надежно только после fsync каталога
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)